@@ -0,0 +1,421 @@
+"""
+Microbenchmarks for the bot's hot paths.
+
+Times packet flattening and encoding, every `Storage` insert and read method
+against a scratch database seeded with a realistic number of rows, command
+dispatch through `Hops.on_message` and the packing of BBS and mail replies.
+
+Results are written as JSON. Given a previous results file as a baseline, the
+run is compared against it and exits non-zero if anything got slower than the
+allowed threshold:
+
+    python benchmarks/bench.py --output baseline.json
+    python benchmarks/bench.py --baseline baseline.json --output current.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from meshtastic.protobuf.mesh_pb2 import MeshPacket
+from meshtastic.protobuf.portnums_pb2 import PortNum
+from hops.delivery import MailDelivery
+from hops.hops import Hops
+from hops.message_coordinates import MessageCoordinates
+from hops.packet_codec import JSON, PROTOBUF, PROTOBUF_ZLIB, encode_packet
+from hops.packing import pack
+from hops.storage import MICROSECONDS_PER_DAY, Storage, timestamp_now
+from hops.util import flat_dict, num_to_id
+
+BOT_NUM = 0x0B0B0B0B
+USER_NUM = 0x1234ABCD
+
+
+def make_packet(packet_id: int, text: str = "héllo from the mesh 👋") -> dict:
+    """
+    A received text packet as published by meshtastic, including the raw
+    protobuf
+    """
+    mesh_packet = MeshPacket(
+        id=packet_id, to=0xFFFFFFFF, rx_time=1700000000, hop_limit=3, hop_start=3
+    )
+    setattr(mesh_packet, "from", USER_NUM + packet_id % 500)
+    mesh_packet.rx_snr = 6.25
+    mesh_packet.rx_rssi = -87
+    mesh_packet.decoded.portnum = PortNum.TEXT_MESSAGE_APP
+    mesh_packet.decoded.payload = text.encode("utf-8")
+    return {
+        "from": USER_NUM + packet_id % 500,
+        "to": 0xFFFFFFFF,
+        "id": packet_id,
+        "rxTime": 1700000000,
+        "rxSnr": 6.25,
+        "rxRssi": -87,
+        "hopLimit": 3,
+        "hopStart": 3,
+        "fromId": num_to_id(USER_NUM + packet_id % 500),
+        "toId": "^all",
+        "decoded": {
+            "portnum": "TEXT_MESSAGE_APP",
+            "payload": mesh_packet.decoded.payload,
+            "text": text,
+        },
+        "raw": mesh_packet,
+    }
+
+
+def make_node(num: int) -> dict:
+    """
+    A flattened node database entry
+    """
+    return flat_dict(
+        {
+            "num": num,
+            "user": {
+                "id": num_to_id(num),
+                "longName": f"Node {num:08x} portable",
+                "shortName": f"{num % 0xFFFF:04x}",
+                "macaddr": "AAAAAAAA",
+                "hwModel": "TBEAM",
+            },
+            "position": {"latitudeI": 515000000, "longitudeI": -1000000},
+            "snr": 5.5,
+            "lastHeard": 1700000000 + num % 86400,
+            "deviceMetrics": {"batteryLevel": 90, "voltage": 4.1},
+            "hopsAway": num % 4,
+        }
+    )
+
+
+class StubClient:
+    """
+    Stands in for `Client`, collecting responses instead of sending them
+    """
+
+    class _Interface:
+        class _MyInfo:
+            my_node_num = BOT_NUM
+
+        myInfo = _MyInfo()
+        nodesByNum: Dict[int, dict] = {}
+
+    interface = _Interface()
+
+    def __init__(self):
+        self.sent: List[str] = []
+
+    def send_response(self, message, message_coordinates, priority=None):
+        """
+        Record a response
+        """
+        _ = message_coordinates, priority
+        self.sent.append(message)
+        return True
+
+
+def coordinates(is_dm: bool = True, from_id: int = USER_NUM) -> MessageCoordinates:
+    """
+    Coordinates of a message from a benchmark user
+    """
+    return MessageCoordinates(
+        from_id=from_id,
+        from_node={"user": {"shortName": "USR", "longName": "Bench user"}, "snr": 6},
+        to_id=BOT_NUM,
+        to_node=None,
+        message_id=1,
+        channel_index=0,
+        is_dm=is_dm,
+    )
+
+
+def seed(storage: Storage, rows: int, nodes: int, posts: int, mail: int) -> None:
+    """
+    Fill a scratch database with synthetic traffic
+    """
+    now = timestamp_now()
+    batch = 10_000
+    data = encode_packet(make_packet(1), PROTOBUF)[1]
+    for start in range(0, rows, batch):
+        count = min(batch, rows - start)
+        storage.log_packets(
+            (now - (rows - start - i) * 1_000_000, PROTOBUF, data) for i in range(count)
+        )
+    for start in range(0, nodes, batch):
+        storage.log_nodes(
+            (now, num_to_id(USER_NUM + num), make_node(USER_NUM + num))
+            for num in range(start, min(nodes, start + batch))
+        )
+    storage.bbs_import(
+        (
+            now - i * (60 * MICROSECONDS_PER_DAY // max(posts, 1)),
+            num_to_id(USER_NUM + i % 50),
+            f"{i % 0xFFFF:04x}",
+            None,
+            f"Post number {i} about the repeater on the hill",
+        )
+        for i in range(posts)
+    )
+    # There is no bulk insert for mail, so seed it directly
+    with storage._transaction() as cursor:  # pylint: disable=protected-access
+        cursor.executemany(
+            """
+            INSERT INTO messages
+                (timestamp, from_id, from_short_name, from_long_name, to_id, message)
+            VALUES
+                (?, ?, ?, ?, ?, ?)
+        """,
+            (
+                (
+                    now - i * 1_000_000,
+                    num_to_id(USER_NUM + i % 50),
+                    f"{i % 0xFFFF:04x}",
+                    None,
+                    num_to_id(USER_NUM + i % 1000),
+                    f"Message {i}, see you on the net tonight",
+                )
+                for i in range(mail)
+            ),
+        )
+
+
+def benchmarks(storage: Storage, nodes: int) -> Dict[str, Callable[[], object]]:
+    """
+    The benchmarks to run, by name
+    """
+    packet = make_packet(42)
+    flat = flat_dict(packet)
+    encoded = encode_packet(packet, PROTOBUF)[1]
+    node = make_node(USER_NUM + nodes // 2)
+    node_id = num_to_id(USER_NUM + nodes // 2)
+    rows_200 = [(timestamp_now(), PROTOBUF, encoded)] * 200
+    hops = Hops(storage)
+    client = StubClient()
+    delivery = MailDelivery(storage)
+    interface = client.interface
+    command = coordinates(is_dm=False)
+    counter = iter(range(10**9))
+    ascii_rows = [
+        f"USR{i}: {'Meet at the hall on Saturday at noon ' * 2}" for i in range(5)
+    ]
+    emoji_rows = [f"🐇{i}: {'Lovely 🌞 day on the 🏔️ ' * 4}" for i in range(5)]
+    long_row = ["A very long post about the mesh " * 30]
+
+    def changed_node():
+        node["snr"] = next(counter)
+        storage.log_node(node_id, node)
+
+    def drain_packets():
+        for _ in zip(range(1000), storage.iter_packets()):
+            pass
+
+    def drain_nodes():
+        for _ in zip(range(1000), storage.iter_nodes()):
+            pass
+
+    return {
+        "packet.flat_dict": lambda: flat_dict(packet),
+        "packet.flat_dict_json": lambda: json.dumps(flat_dict(packet)),
+        "packet.json_compact": lambda: json.dumps(
+            flat, separators=(",", ":"), ensure_ascii=False
+        ),
+        "packet.encode_json": lambda: encode_packet(packet, JSON),
+        "packet.encode_pb": lambda: encode_packet(packet, PROTOBUF),
+        "packet.encode_pb_zlib": lambda: encode_packet(packet, PROTOBUF_ZLIB),
+        "storage.log_packet": lambda: storage.log_packet(encoded, PROTOBUF),
+        "storage.log_packets_200": lambda: storage.log_packets(rows_200),
+        "storage.iter_packets_1000": drain_packets,
+        "storage.log_node_unchanged": lambda: storage.log_node(node_id, node),
+        "storage.log_node_changed": changed_node,
+        "storage.node_read": lambda: storage.node_read(node_id),
+        "storage.node_read_by_num": lambda: storage.node_read_by_num(
+            USER_NUM + nodes // 3
+        ),
+        "storage.nodes_search": lambda: storage.nodes_search("node 1234"),
+        "storage.iter_nodes_1000": drain_nodes,
+        "storage.bbs_insert": lambda: storage.bbs_insert(
+            num_to_id(USER_NUM), "USR", None, "Benchmark post"
+        ),
+        "storage.bbs_read": storage.bbs_read,
+        "storage.bbs_page_deep": lambda: storage.bbs_page(
+            before=(timestamp_now() - 30 * MICROSECONDS_PER_DAY, 0)
+        ),
+        "storage.messages_insert": lambda: storage.messages_insert(
+            num_to_id(USER_NUM), "USR", None, num_to_id(USER_NUM + 1), "Hi"
+        ),
+        "storage.messages_read": lambda: storage.messages_read(num_to_id(USER_NUM + 7)),
+        "storage.messages_unread": lambda: storage.messages_unread(
+            num_to_id(USER_NUM + 7)
+        ),
+        "storage.messages_page": lambda: storage.messages_page(num_to_id(USER_NUM + 7)),
+        "storage.messages_recipients": storage.messages_recipients,
+        # What every packet from a node without mail waiting costs
+        "delivery.heard_no_mail": lambda: delivery.heard(0x7FFFFFFF, 0, client),
+        "coordinates.from_packet": lambda: MessageCoordinates.from_packet(
+            packet, interface
+        ),
+        "coordinates.direct": lambda: command.direct(),
+        "dispatch.not_a_command": lambda: hops.on_message(
+            coordinates(), "just chatting", client
+        ),
+        "dispatch.unknown_command": lambda: hops.on_message(
+            coordinates(), ".nonsense", client
+        ),
+        "dispatch.ping": lambda: hops.on_message(coordinates(), ".ping", client),
+        "dispatch.whoami": lambda: hops.on_message(coordinates(), ".whoami", client),
+        "pack.rows_ascii": lambda: pack(ascii_rows),
+        "pack.rows_emoji": lambda: pack(emoji_rows),
+        "pack.split_long_row": lambda: pack(long_row),
+        "pack.bbs": lambda: hops.on_message(coordinates(is_dm=False), ".bbs", client),
+        "pack.bbs_uncached": lambda: (
+            hops.bbs_cache.clear(),
+            hops.on_message(coordinates(is_dm=False), ".bbs", client),
+        ),
+        # Mail is only unread once, so page through it from the top instead
+        "pack.messages": lambda: (
+            hops.mail_cursors.clear(),
+            hops.on_message(coordinates(from_id=USER_NUM + 7), ".mail more", client),
+        ),
+    }
+
+
+def measure(function: Callable[[], object], budget: float, repeat: int) -> dict:
+    """
+    Time `function`, choosing the number of calls per round so each round
+    takes roughly `budget` seconds. The best round is the headline figure.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    number = max(1, int(number * budget / 0.2))
+    rounds = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+    return {
+        "best_us": min(rounds) * 1e6,
+        "median_us": statistics.median(rounds) * 1e6,
+        "calls": number * repeat,
+    }
+
+
+def compare(
+    results: Dict[str, dict], baseline: Dict[str, dict], threshold: float
+) -> List[str]:
+    """
+    Print the change against the baseline and return the names of the
+    benchmarks that regressed by more than `threshold`
+    """
+    regressions = []
+    print(f"{'benchmark':<30} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<30} {'-':>12} {result['best_us']:>10.2f}us {'new':>8}")
+            continue
+        change = result["best_us"] / before["best_us"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"{name:<30} {before['best_us']:>10.2f}us {result['best_us']:>10.2f}us "
+            f"{change:>+8.1%}{flag}"
+        )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Run the benchmarks
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--rows", type=int, default=1_000_000, help="Packets to seed (default: 1M)"
+    )
+    parser.add_argument(
+        "--nodes", type=int, default=5000, help="Nodes to seed (default: 5000)"
+    )
+    parser.add_argument(
+        "--posts", type=int, default=20000, help="BBS posts to seed (default: 20000)"
+    )
+    parser.add_argument(
+        "--mail", type=int, default=200000, help="Messages to seed (default: 200000)"
+    )
+    parser.add_argument(
+        "--db", type=str, help="Reuse this scratch database instead of seeding one"
+    )
+    parser.add_argument(
+        "--only", type=str, default="", help="Only run benchmarks with this prefix"
+    )
+    parser.add_argument(
+        "--budget", type=float, default=0.2, help="Seconds per round (default: 0.2)"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Rounds per benchmark (default: 5)"
+    )
+    parser.add_argument("--output", type=str, help="Write the results to this file")
+    parser.add_argument("--baseline", type=str, help="Compare against this file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Slowdown counted as a regression (default: 0.10)",
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_filename = args.db or os.path.join(directory, "bench.sqlite")
+        fresh = not os.path.exists(db_filename)
+        storage = Storage(db_filename)
+        if fresh:
+            started = time.perf_counter()
+            seed(storage, args.rows, args.nodes, args.posts, args.mail)
+            print(
+                f"Seeded {db_filename} in {time.perf_counter() - started:.1f}s",
+                file=sys.stderr,
+            )
+
+        results = {}
+        for name, function in benchmarks(storage, args.nodes).items():
+            if not name.startswith(args.only):
+                continue
+            results[name] = measure(function, args.budget, args.repeat)
+            print(f"{name:<30} {results[name]['best_us']:>10.2f}us", file=sys.stderr)
+        storage.close()
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+            "rows": args.rows,
+            "nodes": args.nodes,
+            "posts": args.posts,
+            "mail": args.mail,
+            "time": int(time.time()),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
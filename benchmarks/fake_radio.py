@@ -0,0 +1,293 @@
+"""
+A stand-in meshtastic radio speaking the stream protocol over TCP.
+
+`FakeRadio` listens like a node's TCP API (port 4403 on a real device). When
+a client asks for the configuration it is sent a synthetic node database, a
+primary channel and the `config_complete_id`, which is everything
+`TCPInterface` waits for before publishing `meshtastic.connection.established`.
+Text and position packets can then be injected as if heard on the mesh, and
+every packet the client transmits is recorded with the time it arrived.
+
+    python benchmarks/fake_radio.py --nodes 500 --port 4403
+    hops --tcp 127.0.0.1
+"""
+
+import argparse
+import logging
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+from meshtastic.protobuf import channel_pb2, config_pb2, mesh_pb2, portnums_pb2
+
+START1 = 0x94
+START2 = 0xC3
+BROADCAST_NUM = 0xFFFFFFFF
+BOT_NUM = 0x0B0B0B0B
+FIRST_NODE_NUM = 0x10000000
+
+
+class FakeRadio:
+    """
+    TCP server impersonating a meshtastic node with `nodes` other nodes in
+    its node database
+    """
+
+    def __init__(
+        self,
+        nodes: int = 100,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        my_node_num: int = BOT_NUM,
+    ):
+        self.my_node_num = my_node_num
+        self.node_nums = [FIRST_NODE_NUM + i for i in range(nodes)]
+        # (monotonic time received, packet) for every packet the client sent
+        self.outbound: List[Tuple[float, mesh_pb2.MeshPacket]] = []
+        self.outbound_changed = threading.Condition()
+        self.connected = threading.Event()
+        self._next_id = random.randint(1, 0x7FFFFFFF)
+        self._write_lock = threading.Lock()
+        self._connection: Optional[socket.socket] = None
+        self._server = socket.create_server((host, port))
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._accept, name="fake-radio", daemon=True
+        )
+
+    @property
+    def port(self) -> int:
+        """
+        The port actually listened on
+        """
+        return self._server.getsockname()[1]
+
+    def start(self) -> None:
+        """
+        Start accepting a client
+        """
+        self._thread.start()
+
+    def close(self) -> None:
+        """
+        Stop serving
+        """
+        self._closed = True
+        if self._connection is not None:
+            try:
+                self._connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._server.close()
+
+    def inject_text(
+        self, from_num: int, text: str, to: int = BROADCAST_NUM, channel: int = 0
+    ) -> int:
+        """
+        Deliver a text message to the client, returning its packet id
+        """
+        packet = self._packet(from_num, to, channel)
+        packet.decoded.portnum = portnums_pb2.PortNum.TEXT_MESSAGE_APP
+        packet.decoded.payload = text.encode("utf-8")
+        self._send(mesh_pb2.FromRadio(packet=packet))
+        return packet.id
+
+    def inject_position(self, from_num: int) -> int:
+        """
+        Deliver a position broadcast to the client, returning its packet id
+        """
+        position = mesh_pb2.Position(
+            latitude_i=515000000 + random.randint(-10000, 10000),
+            longitude_i=-1000000 + random.randint(-10000, 10000),
+            altitude=random.randint(0, 300),
+            time=int(time.time()),
+        )
+        packet = self._packet(from_num, BROADCAST_NUM, 0)
+        packet.decoded.portnum = portnums_pb2.PortNum.POSITION_APP
+        packet.decoded.payload = position.SerializeToString()
+        self._send(mesh_pb2.FromRadio(packet=packet))
+        return packet.id
+
+    def wait_outbound(self, count: int, timeout: float) -> bool:
+        """
+        Wait until at least `count` packets have been sent by the client
+        """
+        deadline = time.monotonic() + timeout
+        with self.outbound_changed:
+            while len(self.outbound) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.outbound_changed.wait(remaining)
+        return True
+
+    def _packet(self, from_num: int, to: int, channel: int) -> mesh_pb2.MeshPacket:
+        self._next_id = (self._next_id + 1) & 0x7FFFFFFF
+        packet = mesh_pb2.MeshPacket(
+            id=self._next_id,
+            to=to,
+            channel=channel,
+            rx_time=int(time.time()),
+            rx_snr=random.uniform(-10, 10),
+            rx_rssi=random.randint(-120, -40),
+            hop_limit=3,
+            hop_start=3,
+        )
+        setattr(packet, "from", from_num)
+        return packet
+
+    def _node_info(self, num: int) -> mesh_pb2.NodeInfo:
+        node_id = f"!{num:08x}"
+        return mesh_pb2.NodeInfo(
+            num=num,
+            user=mesh_pb2.User(
+                id=node_id,
+                long_name=f"Soak node {num:08x}",
+                short_name=f"{num & 0xFFFF:04x}",
+                hw_model=mesh_pb2.HardwareModel.TBEAM,
+            ),
+            last_heard=int(time.time()) - random.randint(0, 86400),
+            snr=random.uniform(-10, 10),
+        )
+
+    def _send(self, message: mesh_pb2.FromRadio) -> None:
+        data = message.SerializeToString()
+        frame = struct.pack(">BBH", START1, START2, len(data)) + data
+        with self._write_lock:
+            if self._connection is None:
+                raise ConnectionError("No client connected")
+            self._connection.sendall(frame)
+
+    def _send_config(self, config_id: int) -> None:
+        self._send(
+            mesh_pb2.FromRadio(
+                my_info=mesh_pb2.MyNodeInfo(my_node_num=self.my_node_num)
+            )
+        )
+        for num in [self.my_node_num] + self.node_nums:
+            self._send(mesh_pb2.FromRadio(node_info=self._node_info(num)))
+        self._send(
+            mesh_pb2.FromRadio(
+                config=config_pb2.Config(
+                    lora=config_pb2.Config.LoRaConfig(use_preset=True)
+                )
+            )
+        )
+        self._send(
+            mesh_pb2.FromRadio(
+                channel=channel_pb2.Channel(
+                    index=0,
+                    role=channel_pb2.Channel.Role.PRIMARY,
+                    settings=channel_pb2.ChannelSettings(),
+                )
+            )
+        )
+        self._send(mesh_pb2.FromRadio(config_complete_id=config_id))
+        self.connected.set()
+
+    def _handle(self, message: mesh_pb2.ToRadio) -> None:
+        if message.HasField("want_config_id"):
+            self._send_config(message.want_config_id)
+        elif message.HasField("packet"):
+            with self.outbound_changed:
+                self.outbound.append((time.monotonic(), message.packet))
+                self.outbound_changed.notify_all()
+
+    def _accept(self) -> None:
+        while not self._closed:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            with self._write_lock:
+                self._connection = connection
+            try:
+                self._read(connection)
+            except OSError:
+                pass
+            finally:
+                self.connected.clear()
+                with self._write_lock:
+                    self._connection = None
+                connection.close()
+
+    def _read(self, connection: socket.socket) -> None:
+        buffer = b""
+        while True:
+            chunk = connection.recv(4096)
+            if not chunk:
+                return
+            buffer += chunk
+            while True:
+                # Skip the wake-up bytes and anything else before a frame
+                start = buffer.find(bytes([START1, START2]))
+                if start < 0:
+                    buffer = buffer[-1:]
+                    break
+                if len(buffer) < start + 4:
+                    buffer = buffer[start:]
+                    break
+                length = struct.unpack(">H", buffer[start + 2 : start + 4])[0]
+                end = start + 4 + length
+                if len(buffer) < end:
+                    buffer = buffer[start:]
+                    break
+                message = mesh_pb2.ToRadio()
+                try:
+                    message.ParseFromString(buffer[start + 4 : end])
+                    self._handle(message)
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("Bad frame from client")
+                buffer = buffer[end:]
+
+
+def main() -> int:
+    """
+    Serve a fake radio until interrupted
+    """
+    parser = argparse.ArgumentParser(description="Run a fake meshtastic TCP radio")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4403)
+    parser.add_argument(
+        "--nodes", type=int, default=100, help="Size of the node database"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=1.0, help="Packets injected per second"
+    )
+    parser.add_argument(
+        "--text-ratio",
+        type=float,
+        default=0.3,
+        help="Fraction of injected packets that are text rather than positions",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    radio = FakeRadio(nodes=args.nodes, host=args.host, port=args.port)
+    radio.start()
+    logging.info("Fake radio listening on %s:%d", args.host, radio.port)
+    try:
+        while True:
+            radio.connected.wait()
+            sender = random.choice(radio.node_nums)
+            try:
+                if random.random() < args.text_ratio:
+                    radio.inject_text(sender, random.choice([".ping", "hello", ".bbs"]))
+                else:
+                    radio.inject_position(sender)
+            except (ConnectionError, OSError):
+                continue
+            time.sleep(1 / args.rate)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        radio.close()
+        logging.info("Received %d packets from the client", len(radio.outbound))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""
+End-to-end soak test of the bot against a fake radio.
+
+Runs the real `Client`, `Hops`, storage, writer, dispatcher and (optionally)
+send scheduler against `FakeRadio` over TCP. The offered load is stepped up
+through a series of packet rates; at each step a share of the packets are
+`.ping` commands, and the time from injecting a command to the bot's reply
+reaching the radio is measured. A step fails if any reply is missing or any
+logged row was dropped. The highest rate that passed is reported as the
+maximum sustainable rate.
+
+    python benchmarks/soak.py --rates 5,10,20,50,100 --duration 10
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from meshtastic.tcp_interface import TCPInterface
+from pubsub import pub
+from fake_radio import FakeRadio
+from hops.client import Client
+from hops.dispatch import CommandDispatcher
+from hops.hops import Hops
+from hops.scheduler import SendScheduler
+from hops.storage import Storage
+from hops.writer import BatchWriter
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """
+    The value below which `fraction` of `values` fall
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 2)
+
+
+def run_step(
+    radio: FakeRadio,
+    writer: BatchWriter,
+    rate: float,
+    duration: float,
+    command_ratio: float,
+    drain: float,
+) -> Dict[str, object]:
+    """
+    Offer `rate` packets per second for `duration` seconds and measure the
+    replies
+    """
+    dropped_before = writer.dropped
+    outbound_before = len(radio.outbound)
+    injected = 0
+    commands: Dict[int, float] = {}
+    interval = 1 / rate
+    next_time = time.monotonic()
+    deadline = next_time + duration
+    while next_time < deadline:
+        delay = next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        sender = random.choice(radio.node_nums)
+        roll = random.random()
+        if roll < command_ratio:
+            sent_at = time.monotonic()
+            commands[radio.inject_text(sender, ".ping", to=radio.my_node_num)] = sent_at
+        elif roll < command_ratio + (1 - command_ratio) / 2:
+            radio.inject_text(sender, "just passing through")
+        else:
+            radio.inject_position(sender)
+        injected += 1
+        next_time += interval
+    achieved = injected / max(duration, time.monotonic() - (deadline - duration))
+
+    # Wait for the replies to the commands still in flight
+    radio.wait_outbound(outbound_before + len(commands), drain)
+    latencies = []
+    for received_at, packet in radio.outbound[outbound_before:]:
+        sent_at = commands.pop(packet.decoded.reply_id, None)
+        if sent_at is not None:
+            latencies.append((received_at - sent_at) * 1000)
+
+    return {
+        "rate": rate,
+        "achieved_rate": round(achieved, 1),
+        "injected": injected,
+        "commands": len(latencies) + len(commands),
+        "replies": len(latencies),
+        "lost": len(commands),
+        "rows_dropped": writer.dropped - dropped_before,
+        "p50_ms": percentile(latencies, 0.5),
+        "p90_ms": percentile(latencies, 0.9),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": round(max(latencies), 2) if latencies else None,
+    }
+
+
+def main() -> int:
+    """
+    Run the soak test
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--rates",
+        type=str,
+        default="1,2,5,10,20,50,100",
+        help="Comma separated packet rates to step through",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10, help="Seconds per step (default: 10)"
+    )
+    parser.add_argument(
+        "--nodes", type=int, default=500, help="Size of the node database"
+    )
+    parser.add_argument(
+        "--command-ratio",
+        type=float,
+        default=0.2,
+        help="Fraction of packets that are .ping commands (default: 0.2)",
+    )
+    parser.add_argument(
+        "--drain",
+        type=float,
+        default=5,
+        help="Seconds to wait for outstanding replies after a step",
+    )
+    parser.add_argument(
+        "--max-p99-ms",
+        type=float,
+        help="Also fail a step whose 99th percentile latency exceeds this",
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--airtime-per-byte",
+        type=float,
+        default=0,
+        help="Pace replies with the send scheduler (default: 0, unpaced)",
+    )
+    parser.add_argument("--output", type=str, help="Write the results as JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    radio = FakeRadio(nodes=args.nodes)
+    radio.start()
+    with tempfile.TemporaryDirectory() as directory:
+        storage = Storage(os.path.join(directory, "soak.sqlite"))
+        writer = BatchWriter(storage)
+        hops = Hops(storage)
+        dispatcher = CommandDispatcher(hops.on_message, workers=args.workers)
+        scheduler = None
+        if args.airtime_per_byte > 0:
+            scheduler = SendScheduler(airtime_per_byte=args.airtime_per_byte)
+        interface = TCPInterface(hostname="127.0.0.1", portNumber=radio.port)
+        client = Client(
+            interface, hops, storage, writer, scheduler=scheduler, dispatcher=dispatcher
+        )
+        client._event_connect(interface)  # pylint: disable=protected-access
+
+        steps = []
+        sustainable = None
+        try:
+            for rate in (float(rate) for rate in args.rates.split(",")):
+                step = run_step(
+                    radio, writer, rate, args.duration, args.command_ratio, args.drain
+                )
+                step["passed"] = step["lost"] == 0 and step["rows_dropped"] == 0
+                if args.max_p99_ms is not None and step["p99_ms"] is not None:
+                    step["passed"] = (
+                        step["passed"] and step["p99_ms"] <= args.max_p99_ms
+                    )
+                steps.append(step)
+                print(json.dumps(step), file=sys.stderr)
+                if not step["passed"]:
+                    break
+                sustainable = rate
+        finally:
+            # Client exits the process when the connection drops
+            pub.unsubAll()
+            interface.close()
+            if scheduler is not None:
+                scheduler.close()
+            dispatcher.close(wait=False)
+            writer.close()
+            storage.close()
+            radio.close()
+
+    report = {
+        "nodes": args.nodes,
+        "duration": args.duration,
+        "command_ratio": args.command_ratio,
+        "steps": steps,
+        "max_sustainable_rate": sustainable,
+        "dispatcher": dispatcher.metrics(),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
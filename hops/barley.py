@@ -0,0 +1,338 @@
+"""
+Command Line Interface for 'barley', the tools for managing a Hops database
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+from typing import TextIO, Union
+from .migrations import iso_to_us
+from .packet_codec import PROTOBUF, PROTOBUF_ZLIB
+from .replay import guess_my_node_num, replay
+from .retention import add_retention_arguments, apply_policies, policies_from_arguments
+from .storage import Storage, timestamp_to_iso
+
+BBS_COLUMNS = [
+    "id",
+    "timestamp",
+    "from_id",
+    "from_short_name",
+    "from_long_name",
+    "message",
+]
+# Fields containing the delimiter, quotes or newlines are quoted, so that
+# `bbs import` reads back exactly what `bbs list` wrote
+BBS_DELIMITER = "|"
+NODE_HEADER = "num|id|short_name|long_name|hw_model|last_heard"
+
+
+def _packets_compact(storage: Storage, args: argparse.Namespace) -> None:
+    converted, rewritten = storage.compact_packets(
+        codec=args.codec, batch_size=args.batch_size
+    )
+    print(f"Packets converted: {converted}, kept as JSON: {rewritten}")
+
+
+def _packets_replay(storage: Storage, args: argparse.Namespace) -> None:
+    my_node_num = args.node
+    if my_node_num is None:
+        my_node_num = guess_my_node_num(storage)
+        if my_node_num is None:
+            sys.exit("No direct messages in the log, specify the bot with --node")
+    with tempfile.TemporaryDirectory() as directory:
+        # Run against a copy so the replay neither changes the log nor reads
+        # back the packets it logs itself
+        into = args.into or os.path.join(directory, "replay.sqlite")
+        if args.into is None:
+            storage.backup(into)
+        target = Storage(into)
+        try:
+            report = replay(
+                storage,
+                target,
+                my_node_num,
+                speed=args.speed,
+                after_id=args.after_id,
+                limit=args.limit,
+                workers=args.workers,
+            )
+        finally:
+            target.close()
+    outbound = report.pop("outbound")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            for record in outbound:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    report["outbound"] = len(outbound)
+    print(json.dumps(report, indent=2))
+
+
+def _prune(storage: Storage, args: argparse.Namespace) -> None:
+    deleted = apply_policies(
+        storage, policies_from_arguments(args), batch_size=args.batch_size
+    )
+    for table, count in deleted.items():
+        print(f"Pruned {count} rows from {table}")
+    if args.vacuum:
+        storage.vacuum()
+        print("Database vacuumed")
+
+
+def _bbs_writer(file: TextIO):
+    return csv.writer(file, delimiter=BBS_DELIMITER, lineterminator="\n")
+
+
+def _bbs_list(storage: Storage, args: argparse.Namespace) -> None:
+    _ = args
+    writer = _bbs_writer(sys.stdout)
+    writer.writerow(BBS_COLUMNS)
+    for row in storage.iter_bbs():
+        writer.writerow(
+            "" if value is None else value
+            for value in (
+                row["id"],
+                timestamp_to_iso(row["timestamp"]),
+                row["from_id"],
+                row["from_short_name"],
+                row["from_long_name"],
+                row["message"],
+            )
+        )
+
+
+def _bbs_post(storage: Storage, args: argparse.Namespace) -> None:
+    post_id = storage.bbs_insert(
+        from_id=args.from_id,
+        from_short_name=args.short_name,
+        from_long_name=args.long_name,
+        message=args.message,
+    )
+    print(f"Post added (id: {post_id})")
+
+
+def _bbs_delete(storage: Storage, args: argparse.Namespace) -> None:
+    if storage.bbs_delete(args.id):
+        print("Post deleted")
+    else:
+        print(f"Post {args.id} not found")
+
+
+def _bbs_import(storage: Storage, args: argparse.Namespace) -> None:
+    def rows():
+        reader = csv.reader(args.file, delimiter=BBS_DELIMITER)
+        for fields in reader:
+            if not fields or fields == BBS_COLUMNS:
+                continue
+            if len(fields) != len(BBS_COLUMNS):
+                sys.exit(f"Line {reader.line_num}: expected {len(BBS_COLUMNS)} fields")
+            _, timestamp, from_id, short_name, long_name, message = fields
+            yield (
+                iso_to_us(timestamp) if timestamp else None,
+                from_id,
+                short_name or None,
+                long_name or None,
+                message,
+            )
+
+    print(f"Posts imported: {storage.bbs_import(rows())}")
+
+
+def _format_node(row: dict) -> str:
+    last_heard = (
+        timestamp_to_iso(row["last_heard"]) if row["last_heard"] is not None else ""
+    )
+    return "|".join(
+        "" if value is None else str(value)
+        for value in (
+            row["node_num"],
+            row["node_id"],
+            row["short_name"],
+            row["long_name"],
+            row["hw_model"],
+            last_heard,
+        )
+    )
+
+
+def _nodedb_search(storage: Storage, args: argparse.Namespace) -> None:
+    print(NODE_HEADER)
+    for row in storage.nodes_search(args.needle, limit=args.limit):
+        print(_format_node(row))
+
+
+def _node_reference(value: str) -> Union[int, str]:
+    """
+    A node number, or a node id starting with '!'
+    """
+    try:
+        if value.startswith("!"):
+            int(value[1:], 16)
+            return value
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected a node number or a !hex node id, not {value!r}"
+        ) from None
+
+
+def _nodedb_lastseen(storage: Storage, args: argparse.Namespace) -> None:
+    node = args.node
+    if isinstance(node, str):
+        row = storage.node_read(node)
+    else:
+        row = storage.node_read_by_num(node)
+    if row is None:
+        print(f"Node {node} not found")
+        return
+    print(NODE_HEADER)
+    print(_format_node(row))
+
+
+def _nodedb_list(storage: Storage, args: argparse.Namespace) -> None:
+    _ = args
+    print(NODE_HEADER)
+    for row in storage.iter_nodes():
+        print(_format_node(row))
+
+
+def main():
+    """
+    main
+    """
+    parser = argparse.ArgumentParser(
+        prog="barley", description="Manage the hops database"
+    )
+    parser.add_argument(
+        "--db",
+        type=str,
+        default="./db.sqlite",
+        help="Specify the path to the database (default: ./db.sqlite)",
+    )
+    tools = parser.add_subparsers(dest="tool", required=True)
+
+    packets = tools.add_parser("packets", help="Manage the packet log")
+    packets_commands = packets.add_subparsers(dest="command", required=True)
+    compact = packets_commands.add_parser(
+        "compact", help="Convert legacy JSON packets to the protobuf archive"
+    )
+    compact.add_argument(
+        "--codec",
+        type=str,
+        default=PROTOBUF,
+        choices=(PROTOBUF, PROTOBUF_ZLIB),
+        help="Codec for converted packets (default: pb)",
+    )
+    compact.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Number of rows converted per transaction (default: 500)",
+    )
+    compact.set_defaults(func=_packets_compact)
+    replay_parser = packets_commands.add_parser(
+        "replay", help="Run the logged packets through the bot without a radio"
+    )
+    replay_parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Multiple of the logged rate, 0 for as fast as possible (default: 1)",
+    )
+    replay_parser.add_argument(
+        "--node",
+        type=lambda value: int(value.lstrip("!"), 16 if value.startswith("!") else 10),
+        help="Node number (or !id) of the bot, guessed from the log if not given",
+    )
+    replay_parser.add_argument(
+        "--after-id", type=int, default=0, help="Start after this packet id"
+    )
+    replay_parser.add_argument("--limit", type=int, help="Replay at most this many")
+    replay_parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Command worker threads, 0 to run commands inline (default: 0)",
+    )
+    replay_parser.add_argument(
+        "--into",
+        type=str,
+        help="Database for the bot to use (default: a temporary copy of --db)",
+    )
+    replay_parser.add_argument(
+        "--output", type=str, help="Write the responses sent as JSON lines"
+    )
+    replay_parser.set_defaults(func=_packets_replay)
+
+    bbs = tools.add_parser("bbs", help="Manage the BBS")
+    bbs_commands = bbs.add_subparsers(dest="command", required=True)
+    bbs_list = bbs_commands.add_parser("list", help="List every post, oldest first")
+    bbs_list.set_defaults(func=_bbs_list)
+    post = bbs_commands.add_parser("post", help="Add a post")
+    post.add_argument("message", type=str, help="The message to post")
+    post.add_argument(
+        "--from-id", type=str, default="barley", help="Poster id (default: barley)"
+    )
+    post.add_argument("--short-name", type=str, help="Poster short name")
+    post.add_argument("--long-name", type=str, help="Poster long name")
+    post.set_defaults(func=_bbs_post)
+    delete = bbs_commands.add_parser("delete", help="Delete a post")
+    delete.add_argument("id", type=int, help="Id of the post to delete")
+    delete.set_defaults(func=_bbs_delete)
+    bbs_import = bbs_commands.add_parser(
+        "import", help="Add the posts from the output of 'barley bbs list'"
+    )
+    bbs_import.add_argument(
+        "file", type=argparse.FileType("r"), help="File to import, or - for stdin"
+    )
+    bbs_import.set_defaults(func=_bbs_import)
+
+    nodedb = tools.add_parser("nodedb", help="Query the node database")
+    nodedb_commands = nodedb.add_subparsers(dest="command", required=True)
+    search = nodedb_commands.add_parser(
+        "search", help="Search long names, short names and hardware models"
+    )
+    search.add_argument("needle", type=str, help="Words or word prefixes to find")
+    search.add_argument(
+        "--limit", type=int, default=50, help="Maximum results (default: 50)"
+    )
+    search.set_defaults(func=_nodedb_search)
+    lastseen = nodedb_commands.add_parser("lastseen", help="When a node was last heard")
+    lastseen.add_argument(
+        "node", type=_node_reference, help="Node number, or node id starting with '!'"
+    )
+    lastseen.set_defaults(func=_nodedb_lastseen)
+    listing = nodedb_commands.add_parser(
+        "list", help="List every node, most recently heard first"
+    )
+    listing.set_defaults(func=_nodedb_list)
+
+    prune = tools.add_parser(
+        "prune",
+        help="Delete old packets and node changes according to retention limits",
+    )
+    add_retention_arguments(prune)
+    prune.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Number of rows deleted per transaction (default: 500)",
+    )
+    prune.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="Rebuild the database afterwards. Needed once to enable incremental "
+        "vacuuming on databases created by older versions; holds the database "
+        "lock until done, so stop the bot first.",
+    )
+    prune.set_defaults(func=_prune)
+
+    args = parser.parse_args()
+
+    storage = Storage(args.db)
+    try:
+        args.func(storage, args)
+    finally:
+        storage.close()
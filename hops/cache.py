@@ -0,0 +1,123 @@
+"""
+This module provides `ExpiringCache`, a bounded, time-expiring set of recently
+seen keys used to suppress duplicate work for the same radio packet, and
+`VersionedCache`, which keeps values rendered from rarely changing data until
+that data changes.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class ExpiringCache:
+    """
+    Remembers up to `max_entries` keys for `ttl` seconds each. The least
+    recently added key is evicted first once the cache is full.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Fraction of lookups that found a key already seen
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def seen(self, key: Hashable) -> bool:
+        """
+        Return True if `key` was seen within the last `ttl` seconds, otherwise
+        remember it and return False.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                self.hits += 1
+                return True
+            self.misses += 1
+            self._entries[key] = now + self.ttl
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return False
+
+    def _expire(self, now: float) -> None:
+        # Entries are kept in insertion order, and so in expiry order too
+        while self._entries:
+            key, expires = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+
+
+class VersionedCache:
+    """
+    Remembers values computed from data identified by a version. A value is
+    returned only while the data still has the version it was computed from
+    and, if it was given one, before its expiry time.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Hashable, Tuple[Hashable, Optional[float], Any]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Fraction of lookups that found a current value
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: Hashable, version: Hashable, now: float) -> Optional[Any]:
+        """
+        The value for `key` if it is still current at `version` and time `now`
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, expires, value = entry
+                if entry_version == version and (expires is None or now < expires):
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        key: Hashable,
+        version: Hashable,
+        value: Any,
+        expires: Optional[float] = None,
+    ) -> None:
+        """
+        Remember `value` for `key`, computed from data at `version`, until
+        time `expires`
+        """
+        with self._lock:
+            self._entries[key] = (version, expires, value)
+
+    def clear(self) -> None:
+        """
+        Forget every value
+        """
+        with self._lock:
+            self._entries.clear()
@@ -9,8 +9,28 @@ import time
 from meshtastic.tcp_interface import TCPInterface
 from meshtastic.serial_interface import SerialInterface
 from .client import Client
+from .delivery import MailDelivery
 from .hops import Hops
-from .storage import Storage
+from .storage import Storage, SYNCHRONOUS_LEVELS
+from .packet_codec import CODECS, PROTOBUF
+from .dispatch import CommandDispatcher
+from .metrics import REGISTRY, MetricsLogger, MetricsServer
+from .ratelimit import RateLimiter
+from .runtime import AsyncRuntime
+from .scheduler import SendScheduler
+from .sysinfo import SystemSampler
+from .retention import Pruner, add_retention_arguments, policies_from_arguments
+from .writer import BatchWriter, BACKPRESSURE_POLICIES, DROP_OLDEST
+
+
+def duty_cycle(value: str) -> float:
+    """
+    A fraction of time above 0 and at most 1
+    """
+    fraction = float(value)
+    if not 0 < fraction <= 1:
+        raise argparse.ArgumentTypeError(f"must be above 0 and at most 1, not {value}")
+    return fraction
 
 
 def main():
@@ -31,6 +51,145 @@ def main():
     parser.add_argument(
         "--serial", action="store_true", help="Enable serial streaming mode"
     )
+    parser.add_argument(
+        "--synchronous",
+        type=str.upper,
+        default="NORMAL",
+        choices=SYNCHRONOUS_LEVELS,
+        help="SQLite synchronous level for the database (default: NORMAL)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=200,
+        help="Number of logged packets to group into one commit (default: 200)",
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=1.0,
+        help="Maximum seconds before queued packets are committed (default: 1.0)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=10000,
+        help="Maximum number of packets waiting to be logged (default: 10000)",
+    )
+    parser.add_argument(
+        "--backpressure",
+        type=str,
+        default=DROP_OLDEST,
+        choices=BACKPRESSURE_POLICIES,
+        help="What to do when the logging queue is full (default: drop_oldest)",
+    )
+    parser.add_argument(
+        "--packet-codec",
+        type=str,
+        default=PROTOBUF,
+        choices=CODECS,
+        help="How received packets are archived (default: pb)",
+    )
+    parser.add_argument(
+        "--prune-interval",
+        type=float,
+        default=0,
+        help="Seconds between pruning the packet and node logs, which deletes "
+        "rows beyond the retention limits; 0 to keep everything (default: 0)",
+    )
+    parser.add_argument(
+        "--airtime-per-byte",
+        type=float,
+        default=0.0075,
+        help="Estimated seconds of airtime per transmitted byte, 0 to send "
+        "replies immediately (default: 0.0075, LongFast)",
+    )
+    parser.add_argument(
+        "--duty-cycle",
+        type=duty_cycle,
+        default=0.1,
+        help="Fraction of time the bot may spend transmitting (default: 0.1)",
+    )
+    parser.add_argument(
+        "--airtime-burst",
+        type=float,
+        default=10.0,
+        help="Seconds of airtime that can be saved up for bursts (default: 10)",
+    )
+    parser.add_argument(
+        "--send-queue-size",
+        type=int,
+        default=256,
+        help="Maximum number of replies waiting to be sent (default: 256)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of threads running commands, 0 to run them on the radio "
+        "reader thread (default: 4)",
+    )
+    parser.add_argument(
+        "--max-pending-commands",
+        type=int,
+        default=64,
+        help="Commands allowed to wait for a worker before new ones are "
+        "dropped (default: 64)",
+    )
+    parser.add_argument(
+        "--command-timeout",
+        type=float,
+        default=30.0,
+        help="Seconds a command may run before its responses are discarded "
+        "(default: 30)",
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Run commands and periodic jobs on an asyncio event loop",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=300,
+        help="Seconds between logging queue and command statistics with "
+        "--asyncio, 0 to disable (default: 300)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=0,
+        help="Serve Prometheus metrics on this localhost port, 0 to disable "
+        "(default: 0)",
+    )
+    parser.add_argument(
+        "--metrics-log-interval",
+        type=float,
+        default=0,
+        help="Seconds between logging a metrics line, 0 to disable (default: 0)",
+    )
+    parser.add_argument(
+        "--rate-limit-window",
+        type=float,
+        default=60,
+        help="Seconds over which command budgets are spent, 0 to disable rate "
+        "limiting (default: 60)",
+    )
+    parser.add_argument(
+        "--sender-budget",
+        type=int,
+        default=10,
+        help="Command cost each node may spend per window; .ping costs 1, "
+        ".bbs, .mail, .message and .post cost 3 (default: 10)",
+    )
+    parser.add_argument(
+        "--channel-budget",
+        type=int,
+        default=30,
+        help="Command cost all nodes on a channel may spend per window "
+        "(default: 30)",
+    )
+    add_retention_arguments(parser)
     args = parser.parse_args()
 
     if args.verbose:
@@ -39,8 +198,23 @@ def main():
         logging.basicConfig(level=logging.INFO)
 
     storage = None
+    writer = None
+    pruner = None
     if args.db is not None:
-        storage = Storage(args.db)
+        storage = Storage(args.db, synchronous=args.synchronous)
+        writer = BatchWriter(
+            storage,
+            max_queue=args.queue_size,
+            batch_size=args.batch_size,
+            flush_interval=args.flush_interval,
+            policy=args.backpressure,
+        )
+        if args.prune_interval > 0:
+            pruner = Pruner(
+                storage, policies_from_arguments(args), interval=args.prune_interval
+            )
+            if not args.asyncio:
+                pruner.start()
 
     interface = None
     if args.serial:
@@ -51,12 +225,125 @@ def main():
         print("Error: One of --tcp or --serial must be defined", file=sys.stderr)
         sys.exit(1)
 
-    hops = Hops(storage)
+    sampler = SystemSampler(db_filename=args.db)
+    limiter = None
+    if args.rate_limit_window > 0:
+        limiter = RateLimiter(
+            sender_budget=args.sender_budget,
+            channel_budget=args.channel_budget,
+            window=args.rate_limit_window,
+        )
+    delivery = MailDelivery(storage) if storage is not None else None
+    hops = Hops(storage, sampler=sampler, limiter=limiter, delivery=delivery)
+
+    scheduler = None
+    if args.airtime_per_byte > 0:
+        scheduler = SendScheduler(
+            airtime_per_byte=args.airtime_per_byte,
+            duty_cycle=args.duty_cycle,
+            burst=args.airtime_burst,
+            max_queue=args.send_queue_size,
+        )
+
+    runtime = None
+    dispatcher = None
+    if args.asyncio:
+        runtime = dispatcher = AsyncRuntime(
+            hops.on_message,
+            workers=max(args.workers, 1),
+            max_pending=args.max_pending_commands,
+            timeout=args.command_timeout,
+        )
+        if pruner is not None:
+            runtime.every(args.prune_interval, pruner.run_once, name="prune")
+        if args.stats_interval > 0:
+            runtime.every(
+                args.stats_interval,
+                lambda: log_stats(writer, scheduler, runtime),
+                name="stats",
+            )
+    elif args.workers > 0:
+        dispatcher = CommandDispatcher(
+            hops.on_message,
+            workers=args.workers,
+            max_pending=args.max_pending_commands,
+            timeout=args.command_timeout,
+        )
+
+    sampler.add_source("queues", lambda: queue_depths(writer, scheduler, dispatcher))
 
-    _ = Client(interface, hops, storage)
+    if writer is not None:
+        REGISTRY.gauge("hops_write_queue_depth", "Rows waiting", lambda: writer.depth)
+    if scheduler is not None:
+        REGISTRY.gauge(
+            "hops_send_queue_depth", "Responses waiting", lambda: scheduler.depth
+        )
+    if dispatcher is not None:
+        REGISTRY.gauge(
+            "hops_command_queue_depth", "Commands waiting", lambda: dispatcher.pending
+        )
+    metrics_server = None
+    if args.metrics_port > 0:
+        metrics_server = MetricsServer(REGISTRY, port=args.metrics_port)
+        metrics_server.start()
+    metrics_logger = None
+    if args.metrics_log_interval > 0:
+        metrics_logger = MetricsLogger(REGISTRY, interval=args.metrics_log_interval)
+        metrics_logger.start()
+
+    _ = Client(
+        interface,
+        hops,
+        storage,
+        writer,
+        packet_codec=args.packet_codec,
+        scheduler=scheduler,
+        dispatcher=dispatcher,
+        sampler=sampler,
+        delivery=delivery,
+    )
     try:
         logging.info("Hops running. Press Ctrl+C to stop.")
-        while True:
-            time.sleep(1)
+        if runtime is not None:
+            runtime.run()
+        else:
+            while True:
+                time.sleep(1)
     except KeyboardInterrupt:
         print("Bot stopped.")
+    finally:
+        if metrics_logger is not None:
+            metrics_logger.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        if runtime is None and dispatcher is not None:
+            dispatcher.close(wait=False)
+        if scheduler is not None:
+            scheduler.close()
+        if pruner is not None:
+            pruner.close()
+        if writer is not None:
+            writer.close()
+        if storage is not None:
+            storage.close()
+
+
+def log_stats(writer, scheduler, runtime) -> None:
+    """
+    Log the depth of the internal queues and the command counters
+    """
+    logging.info(
+        "Stats: queues %s, commands %s",
+        queue_depths(writer, scheduler, runtime),
+        runtime.metrics(),
+    )
+
+
+def queue_depths(writer, scheduler, dispatcher) -> str:
+    """
+    Summarise the write, send and command queue depths
+    """
+    write = writer.depth if writer is not None else "-"
+    send = scheduler.depth if scheduler is not None else "-"
+    command = dispatcher.pending if dispatcher is not None else "-"
+    return f"write {write}, send {send}, cmd {command}"
@@ -7,17 +7,41 @@ reception, node updates, position updates, text messages, and user updates.
 """
 
 import sys
-import json
 import logging
+import time
+from typing import Optional, Union
 import emoji
 from pubsub import pub
 import meshtastic
 from meshtastic.stream_interface import StreamInterface
 from meshtastic.protobuf.mesh_pb2 import Data, MeshPacket
 from meshtastic.protobuf.portnums_pb2 import PortNum
-from .util import get_or_else, flat_dict
-from .storage import Storage
+from .util import complete, get_or_else, flat_dict
+from .packet_codec import PROTOBUF, encode_packet
+from .storage import Storage, timestamp_now
+from .writer import BatchWriter
+from .cache import ExpiringCache
+from .delivery import MailDelivery
+from .dispatch import CommandDispatcher
+from .runtime import AsyncRuntime
+from .node_index import NodeIndex
+from .scheduler import HIGH, NORMAL, SendScheduler
+from .sysinfo import SystemSampler
 from .message_coordinates import MessageCoordinates
+from .metrics import REGISTRY
+
+PACKETS_RECEIVED = REGISTRY.counter(
+    "hops_packets_received_total", "Distinct packets received from the mesh"
+)
+PACKETS_DUPLICATE = REGISTRY.counter(
+    "hops_packets_duplicate_total", "Packets delivered more than once by pubsub"
+)
+TEXT_DUPLICATE = REGISTRY.counter(
+    "hops_text_duplicate_total", "Repeats of a text packet that were not handled"
+)
+SEND_SECONDS = REGISTRY.histogram(
+    "hops_send_seconds", "Time taken to hand a response to the radio"
+)
 
 
 class Client:
@@ -25,11 +49,38 @@ class Client:
     Meshtastic bot
     """
 
-    def __init__(self, interface: StreamInterface, hops, storage: Storage):
+    def __init__(
+        self,
+        interface: StreamInterface,
+        hops,
+        storage: Storage,
+        writer: Optional[BatchWriter] = None,
+        packet_codec: str = PROTOBUF,
+        scheduler: Optional[SendScheduler] = None,
+        dispatcher: Optional[Union[CommandDispatcher, AsyncRuntime]] = None,
+        sampler: Optional[SystemSampler] = None,
+        delivery: Optional[MailDelivery] = None,
+    ):
         self.interface = interface
         self.hops = hops
         self.storage = storage
+        self.writer = writer
+        self.packet_codec = packet_codec
+        # pypubsub also delivers subtopic messages to the listeners of parent
+        # topics, so the same packet reaches `_log_packet` more than once
+        self.packet_dedupe = ExpiringCache(max_entries=4096, ttl=600)
+        # The mesh delivers rebroadcasts and retries of a packet more than
+        # once, and each command must only run once
+        self.text_dedupe = ExpiringCache(max_entries=4096, ttl=600)
+        self.node_index = NodeIndex()
+        self.scheduler = scheduler
+        self.dispatcher = dispatcher
+        self.sampler = sampler
+        self.delivery = delivery
+        if scheduler is not None:
+            scheduler.start(self._transmit)
         pub.subscribe(self._event_connect, "meshtastic.connection.established")
+        pub.subscribe(self._event_node_updated, "meshtastic.node.updated")
         pub.subscribe(self._event_disconnect, "meshtastic.connection.lost")
         pub.subscribe(self._event_text, "meshtastic.receive.text")
 
@@ -53,17 +104,48 @@ class Client:
         for event, handler in events.items():
             pub.subscribe(handler, event)
 
-    def send_response(self, message: str, message_coordinates: MessageCoordinates):
+    def send_response(
+        self,
+        message: str,
+        message_coordinates: MessageCoordinates,
+        priority: Optional[int] = None,
+    ) -> bool:
+        """
+        Send a message. With a scheduler the message is queued and sent once
+        there is airtime to spare; emoji acknowledgements go first by default.
+        Returns False if the message was dropped because the queue was full.
+        """
+        if self.scheduler is None:
+            self._transmit(message, message_coordinates)
+            return True
+
+        is_emoji = _is_emoji(message)
+        if priority is None:
+            priority = HIGH if is_emoji else NORMAL
+        destination = (
+            _destination_id(message_coordinates),
+            message_coordinates.channel_index or 0,
+        )
+        return self.scheduler.enqueue(
+            message,
+            message_coordinates,
+            destination,
+            priority=priority,
+            # Reactions and replies refer to a specific packet
+            coalesce=not is_emoji and message_coordinates.message_id is None,
+        )
+
+    def _transmit(self, message: str, message_coordinates: MessageCoordinates):
         """
-        Send a message
+        Hand a message to the radio
         """
 
-        is_emoji = len(message) == 1 and message in emoji.EMOJI_DATA
+        is_emoji = _is_emoji(message)
 
         data_packet = Data(
             portnum=PortNum.TEXT_MESSAGE_APP,
             payload=message.encode("utf-8"),
-            emoji=is_emoji,
+            emoji=int(is_emoji),
             want_response=False,
         )
         if message_coordinates.message_id is not None:
@@ -80,26 +162,36 @@ class Client:
             priority=MeshPacket.Priority.RELIABLE,
         )
 
-        destination_id = meshtastic.BROADCAST_ADDR
-        if message_coordinates.is_dm:
-            destination_id = message_coordinates.from_id
-
+        started = time.perf_counter()
         self.interface._sendPacket(
             mesh_packet,
-            destinationId=destination_id,
+            destinationId=_destination_id(message_coordinates),
             wantAck=False,
             hopLimit=3,
             pkiEncrypted=False,
             publicKey=None,
         )
+        SEND_SECONDS.observe(time.perf_counter() - started)
 
     def _event_connect(self, interface: StreamInterface) -> None:
         """
         Callback function for connection established
         """
-        # Suppress unused error
-        _ = interface
         logging.info("Connected")
+        self.node_index.rebuild((interface.nodesByNum or {}).values())
+
+    def _event_node_updated(self, node: dict, interface: StreamInterface) -> None:
+        """
+        Callback function for a node being added or changed in the node database
+        """
+        _ = interface
+        self.node_index.update(node)
+        self._log_node(node)
+        if self.delivery is not None:
+            # Only a recent update means the node is on the air now
+            last_heard = node.get("lastHeard")
+            if last_heard and time.time() - last_heard < self.delivery.online_window:
+                self.delivery.heard(node.get("num"), None, self)
 
     def _event_disconnect(
         self, interface: StreamInterface, topic=pub.AUTO_TOPIC
@@ -120,17 +212,77 @@ class Client:
         # Suppress unused error
         _ = interface
 
+        payload = get_or_else(packet, ["decoded", "payload"], b"")
+        packet_id = packet.get("id")
+        if packet_id and self.text_dedupe.seen(
+            (packet.get("from"), packet_id, hash(payload))
+        ):
+            TEXT_DUPLICATE.inc()
+            logging.debug("Ignoring repeat of packet %s", packet_id)
+            return
+
+        message = payload.decode("utf-8")
+        command = self.hops.command(message)
+        if command is None:
+            return
         coordinates = MessageCoordinates.from_packet(packet, self.interface)
-        message = get_or_else(packet, ["decoded", "payload"], "").decode("utf-8")
-        self.hops.on_message(coordinates, message, self)
+        # Before the dispatcher, so one node's refused commands cannot fill
+        # the queue that everyone else's commands wait in
+        if not self.hops.admit(coordinates, command, self):
+            return
+        if self.dispatcher is not None:
+            self.dispatcher.submit(coordinates.from_id, coordinates, message, self)
+        else:
+            complete(self.hops.on_message(coordinates, message, self))
 
     def _log_packet(self, packet: dict, interface: StreamInterface) -> None:
         _ = interface
+        packet_id = packet.get("id")
+        if packet_id and self.packet_dedupe.seen((packet.get("from"), packet_id)):
+            PACKETS_DUPLICATE.inc()
+            return
+        PACKETS_RECEIVED.inc()
+        if self.sampler is not None:
+            self.sampler.record_packet()
+        if self.delivery is not None:
+            self.delivery.heard(packet.get("from"), packet.get("channel"), self)
         if self.storage is not None:
-            flat_json_packet = json.dumps(flat_dict(packet), indent=3)
-            self.storage.log_packet(flat_json_packet)
+            codec, data = encode_packet(packet, self.packet_codec)
+            if self.writer is not None:
+                self.writer.put("packets", (timestamp_now(), codec, data))
+            else:
+                self.storage.log_packet(data, codec)
 
     def _log_nodes(self, interface: StreamInterface) -> None:
-        for node_id, node in interface.nodes.items():
-            flat_json_node = json.dumps(flat_dict(node), indent=3)
-            self.storage.log_node(node_id, flat_json_node)
+        if self.storage is None:
+            return
+        now = timestamp_now()
+        rows = [
+            (now, node_id, flat_dict(node)) for node_id, node in interface.nodes.items()
+        ]
+        if self.writer is not None:
+            for row in rows:
+                self.writer.put("nodes", row)
+        else:
+            self.storage.log_nodes(rows)
+
+    def _log_node(self, node: dict) -> None:
+        if self.storage is None:
+            return
+        node_id = get_or_else(node, ["user", "id"])
+        if node_id is None:
+            return
+        if self.writer is not None:
+            self.writer.put("nodes", (timestamp_now(), node_id, flat_dict(node)))
+        else:
+            self.storage.log_node(node_id, flat_dict(node))
+
+
+def _is_emoji(message: str) -> bool:
+    return len(message) == 1 and message in emoji.EMOJI_DATA
+
+
+def _destination_id(message_coordinates: MessageCoordinates):
+    if message_coordinates.is_dm:
+        return message_coordinates.from_id
+    return meshtastic.BROADCAST_ADDR
@@ -0,0 +1,132 @@
+"""
+This module provides `MailDelivery`, which forwards mail to its addressee
+when they are next heard on the mesh.
+
+A node that is not on the air when mail is left for it would miss any
+notification sent at that moment, so instead the bot waits until the
+addressee transmits something, which shows they are in range, and then sends
+the undelivered messages as direct messages packed into as few packets as
+possible. The addressees with undelivered mail are kept in memory, seeded
+from the partial index of undelivered messages, so that the packets of every
+other node cost a dictionary lookup rather than a query.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from .message_coordinates import MessageCoordinates
+from .metrics import REGISTRY
+from .packing import pack_posts
+from .scheduler import LOW
+from .storage import Storage
+
+MAIL_PUSHED = REGISTRY.counter(
+    "hops_mail_pushed_total", "Messages forwarded to their addressee when heard"
+)
+
+
+def id_to_num(node_id: str) -> int:
+    """
+    The node number of a meshtastic identifier such as `!1234abcd`
+    """
+    return int(node_id.lstrip("!"), 16)
+
+
+class MailDelivery:
+    """
+    Forwards undelivered mail, at most `batch` messages at a time, to nodes
+    as they are heard. A node counts as on the air for `online_window`
+    seconds after it was last heard, so mail left for it meanwhile is sent
+    straight away.
+    """
+
+    def __init__(self, storage: Storage, batch: int = 5, online_window: float = 900):
+        self.storage = storage
+        self.batch = batch
+        self.online_window = online_window
+        self.pushed = 0
+        # Node number to the stored identifier of addressees with mail waiting
+        self._pending: Dict[int, str] = {}
+        # When each node was last heard, least recently heard first
+        self._heard: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        for to_id in storage.messages_recipients():
+            try:
+                self._pending[id_to_num(to_id)] = to_id
+            except ValueError:
+                logging.warning("Ignoring mail for invalid node id %s", to_id)
+
+    def __contains__(self, num: int) -> bool:
+        return num in self._pending
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, to_id: str, client) -> None:
+        """
+        Note new mail for `to_id`, and forward it now if they are on the air
+        """
+        num = id_to_num(to_id)
+        with self._lock:
+            self._pending[num] = to_id
+            heard = self._heard.get(num)
+        if heard is not None and time.monotonic() - heard < self.online_window:
+            self._push(num, None, client)
+
+    def heard(self, num: Optional[int], channel: Optional[int], client) -> None:
+        """
+        Note a packet from node `num`, and forward any mail waiting for it
+        """
+        if num is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._heard[num] = now
+            self._heard.move_to_end(num)
+            horizon = now - self.online_window
+            while next(iter(self._heard.values())) < horizon:
+                self._heard.popitem(last=False)
+            if num not in self._pending:
+                return
+        self._push(num, channel, client)
+
+    def _push(self, num: int, channel: Optional[int], client) -> None:
+        with self._lock:
+            # Claimed so that packets heard while sending don't send it again
+            to_id = self._pending.pop(num, None)
+        if to_id is None:
+            return
+        rows = self.storage.messages_unread(to_id, limit=self.batch)
+        if len(rows) == 0:
+            return
+
+        # Replies as if to a direct message from the addressee
+        coordinates = MessageCoordinates(
+            from_id=num,
+            from_node=(client.interface.nodesByNum or {}).get(num),
+            to_id=client.interface.myInfo.my_node_num,
+            to_node=None,
+            message_id=None,
+            channel_index=channel,
+            is_dm=True,
+        )
+        for message in pack_posts(rows, prefix="📫 "):
+            if not client.send_response(
+                message=message, message_coordinates=coordinates, priority=LOW
+            ):
+                # Tried again, in full, the next time they are heard
+                logging.warning("Could not forward mail to %s", to_id)
+                with self._lock:
+                    self._pending.setdefault(num, to_id)
+                return
+        delivered = self.storage.messages_mark_delivered(row["id"] for row in rows)
+        self.pushed += delivered
+        MAIL_PUSHED.inc(delivered)
+        logging.info("Forwarded %d messages to %s", delivered, to_id)
+
+        if len(rows) == self.batch:
+            # There may be more, which go the next time they are heard
+            with self._lock:
+                self._pending.setdefault(num, to_id)
@@ -0,0 +1,229 @@
+"""
+This module provides the `CommandDispatcher` class, which runs command handlers
+on a bounded pool of worker threads instead of the meshtastic reader thread.
+
+Commands from the same sender run one at a time, in the order they were
+received, while different senders are served in parallel. A command which
+overruns its timeout releases its sender's lane so later commands are not held
+up, and anything it tries to send after the deadline is discarded. When too
+many commands are waiting, new ones are shed rather than queued without bound.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+from .util import complete
+
+
+class _Job:
+    """
+    A command waiting for, or running on, a worker
+    """
+
+    __slots__ = ("sender", "args", "deadline", "finished")
+
+    def __init__(self, sender: Hashable, args: Tuple):
+        self.sender = sender
+        self.args = args
+        self.deadline: Optional[float] = None
+        self.finished = False
+
+
+class DeadlineClient:
+    """
+    Stands in for `Client` while a handler runs, dropping any response sent
+    after the command timed out
+    """
+
+    def __init__(self, client, sender: Hashable, deadline: float):
+        self._client = client
+        self._sender = sender
+        self._deadline = deadline
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def send_response(self, *args, **kwargs):
+        """
+        Send a response unless the command has timed out, returning whether
+        it was sent
+        """
+        if time.monotonic() > self._deadline:
+            logging.warning("Discarding late response to %s", self._sender)
+            return False
+        return self._client.send_response(*args, **kwargs)
+
+
+class CommandDispatcher:
+    """
+    Runs `handler(coordinates, message, client)` on `workers` threads.
+
+    At most `max_pending` commands wait for a worker; further commands are
+    shed and counted in `shed`. Each command has `timeout` seconds to finish.
+    """
+
+    def __init__(
+        self,
+        handler: Callable,
+        workers: int = 4,
+        max_pending: int = 64,
+        timeout: float = 30.0,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.active = 0
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.shed = 0
+        self.timed_out = 0
+        self._lanes: Dict[Hashable, Deque[_Job]] = {}
+        self._running: Dict[Hashable, _Job] = {}
+        self._deadlines: List[Tuple[float, int, _Job]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._accepting = True
+        self._closed = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="hops-command"
+        )
+        self._watchdog = threading.Thread(
+            target=self._watch, name="hops-command-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    @property
+    def utilization(self) -> float:
+        """
+        Fraction of the workers currently running a command
+        """
+        return self.active / self.workers
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        Snapshot of the pool counters
+        """
+        with self._condition:
+            return {
+                "active": self.active,
+                "pending": self.pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "shed": self.shed,
+                "timed_out": self.timed_out,
+                "utilization": self.utilization,
+            }
+
+    def submit(self, sender: Hashable, coordinates, message: str, client) -> bool:
+        """
+        Queue a command from `sender`. Returns False if it was shed.
+        """
+        job = _Job(sender, (coordinates, message, client))
+        with self._condition:
+            if not self._accepting:
+                return False
+            if self.pending >= self.max_pending:
+                self.shed += 1
+                logging.warning("Command pool saturated, shedding %s", sender)
+                return False
+            self.pending += 1
+            if sender in self._running:
+                self._lanes.setdefault(sender, deque()).append(job)
+            else:
+                self._start(job)
+        return True
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Stop accepting commands. With `wait` the commands already accepted are
+        run first (each still subject to the timeout), otherwise those not yet
+        started are discarded.
+        """
+        with self._condition:
+            self._accepting = False
+            if wait:
+                while self._running:
+                    self._condition.wait()
+            self._closed = True
+            for lane in self._lanes.values():
+                self.pending -= len(lane)
+            self._lanes.clear()
+            self._condition.notify_all()
+        self._executor.shutdown(wait=wait)
+
+    def _start(self, job: _Job) -> None:
+        # Called with the condition held
+        self._running[job.sender] = job
+        self._executor.submit(self._run, job)
+
+    def _release(self, job: _Job) -> None:
+        # Called with the condition held: hand the lane to the sender's next job
+        if job.finished:
+            return
+        job.finished = True
+        if self._running.get(job.sender) is job:
+            del self._running[job.sender]
+        lane = self._lanes.get(job.sender)
+        if lane:
+            self._start(lane.popleft())
+            if not lane:
+                del self._lanes[job.sender]
+        self._condition.notify_all()
+
+    def _run(self, job: _Job) -> None:
+        with self._condition:
+            if self._closed:
+                self.pending -= 1
+                return
+            self.pending -= 1
+            self.active += 1
+            job.deadline = time.monotonic() + self.timeout
+            heapq.heappush(self._deadlines, (job.deadline, next(self._sequence), job))
+            self._condition.notify_all()
+        coordinates, message, client = job.args
+        try:
+            # Coroutine handlers have no event loop to run on here
+            complete(
+                self.handler(
+                    coordinates,
+                    message,
+                    DeadlineClient(client, job.sender, job.deadline),
+                )
+            )
+            with self._condition:
+                self.completed += 1
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Command from %s failed", job.sender)
+            with self._condition:
+                self.failed += 1
+        finally:
+            with self._condition:
+                self.active -= 1
+                self._release(job)
+
+    def _watch(self) -> None:
+        with self._condition:
+            while not self._closed:
+                while self._deadlines and self._deadlines[0][2].finished:
+                    heapq.heappop(self._deadlines)
+                if not self._deadlines:
+                    self._condition.wait()
+                    continue
+                deadline, _, job = self._deadlines[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                heapq.heappop(self._deadlines)
+                self.timed_out += 1
+                logging.warning(
+                    "Command from %s timed out after %ss", job.sender, self.timeout
+                )
+                self._release(job)
@@ -2,18 +2,40 @@
 Bot
 """
 
+import inspect
 import logging
 
 # import argparse
-import copy
-from typing import Optional
+from collections import OrderedDict
+from typing import Awaitable, List, Optional, Tuple, Union
+from .cache import VersionedCache
 from .client import Client
-from .storage import Storage
+from .delivery import MailDelivery
+from .storage import (
+    BBS_WINDOW_DAYS,
+    MICROSECONDS_PER_DAY,
+    Storage,
+    timestamp_now,
+)
 from .message_coordinates import MessageCoordinates
+from .metrics import REGISTRY
+from .packing import pack_posts
+from .ratelimit import ADMIT, NOTIFY, RateLimiter
+from .scheduler import LOW
+from .sysinfo import SystemSampler
 from .util import get_or_else, num_to_id
 
 import os
 import subprocess
+import time
+
+COMMAND_SECONDS = REGISTRY.histogram(
+    "hops_command_seconds", "Time taken to handle a command", ["command"]
+)
+BBS_CACHE = REGISTRY.counter(
+    "hops_bbs_cache_total", "Lookups of the rendered first page of the BBS", ["result"]
+)
+
 
 class Hops:
     """
@@ -23,6 +45,8 @@ class Hops:
 
     prefix = "."
 
+    max_cursors = 256
+
     synonyms = {
         "👋": "hello",
         "👋🏻": "hello",
@@ -48,37 +72,112 @@ class Hops:
         except ValueError:
             logging.warning("HOPS_ADMIN_ID is missing or invalid")
 
-    def __init__(self, storage: Optional[Storage] = None):
+    def __init__(
+        self,
+        storage: Optional[Storage] = None,
+        sampler: Optional[SystemSampler] = None,
+        limiter: Optional[RateLimiter] = None,
+        delivery: Optional[MailDelivery] = None,
+    ):
         """
-        Initialize the Hops instance with optional storage.
+        Initialize the Hops instance with optional storage and, if commands
+        are to be rate limited, a limiter. With `delivery`, mail is forwarded
+        when its addressee is heard rather than announced straight away.
         """
         self.storage = storage
+        self.sampler = sampler if sampler is not None else SystemSampler()
+        self.limiter = limiter
+        self.delivery = delivery
+        # Where each sender's last page of the BBS ended, for `.bbs more`
+        self.bbs_cursors: "OrderedDict[Union[int, str], Tuple[int, int]]" = (
+            OrderedDict()
+        )
+        # Where each sender's last page of mail ended, for `.mail more`
+        self.mail_cursors: "OrderedDict[Union[int, str], Tuple[int, int]]" = (
+            OrderedDict()
+        )
+        # The rendered first page of the BBS, which everybody asks for
+        self.bbs_cache = VersionedCache()
 
-    def on_message(
-        self, coordinates: MessageCoordinates, message: str, client: Client
-    ) -> None:
+    def command(self, message: str) -> Optional[str]:
         """
-        Handler for incoming messages
+        The canonical name of the command in a message, or None if the
+        message is not a command this bot handles
         """
-        split = message.split(" ", 1)
-
-        command = split[0]
+        command = message.split(" ", 1)[0]
 
         # Require that the command be prefixed with by '.'
         if not command.startswith(self.prefix):
-            return
+            return None
         command = command[1:]
 
         # Map synonyms to canonical names
         command = self.synonyms[command] if command in self.synonyms else command
 
-        method_name = f"_on_{command.lower()}"
-        if hasattr(self, method_name):
-            method = getattr(self, method_name)
-            if callable(method):
-                arguments = split[1] if len(split) > 1 else None
-                logging.debug("Received %s", command)
-                method(coordinates, arguments, client)
+        method = getattr(self, f"_on_{command.lower()}", None)
+        return command.lower() if callable(method) else None
+
+    def on_message(
+        self, coordinates: MessageCoordinates, message: str, client: Client
+    ) -> Optional[Awaitable[None]]:
+        """
+        Handler for incoming messages, which the caller has already let past
+        `admit`. Returns the awaitable of a coroutine command handler, which
+        the caller must run.
+        """
+        command = self.command(message)
+        if command is None:
+            return None
+        method = getattr(self, f"_on_{command}")
+
+        split = message.split(" ", 1)
+        arguments = split[1] if len(split) > 1 else None
+        logging.debug("Received %s", command)
+        started = time.perf_counter()
+        result = None
+        try:
+            result = method(coordinates, arguments, client)
+        finally:
+            if not inspect.iscoroutine(result):
+                self._record_latency(command, started)
+        if inspect.iscoroutine(result):
+            # Timed from when the caller runs it
+            return self._timed(command, result)
+        return result
+
+    async def _timed(self, command: str, coroutine: Awaitable[None]) -> None:
+        """
+        Await a coroutine command handler, recording how long it ran
+        """
+        started = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            self._record_latency(command, started)
+
+    def _record_latency(self, command: str, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        self.sampler.record_latency(command, elapsed)
+        COMMAND_SECONDS.labels(command).observe(elapsed)
+
+    def admit(
+        self, coordinates: MessageCoordinates, command: str, client: Client
+    ) -> bool:
+        """
+        Whether the rate limiter lets the command run. The first command
+        refused in a row gets a back-off notice, the rest are ignored.
+        Called on the reader thread, so that refused commands never wait for
+        a worker.
+        """
+        if self.limiter is None:
+            return True
+        decision = self.limiter.admit(
+            coordinates.from_id, coordinates.channel_index, command
+        )
+        if decision == NOTIFY:
+            logging.info("Rate limiting %s", coordinates.from_id)
+            client.send_response(message="⏳", message_coordinates=coordinates)
+        return decision == ADMIT
 
     def _on_hello(
         self, coordinates: MessageCoordinates, _argument: str, client: Client
@@ -150,28 +249,12 @@ class Hops:
             logging.warning(f"Unauthorized status request from {id} ({coordinates.from_id})")
             return
 
-        uptime = subprocess.check_output(["uptime", "-p"]).decode("utf-8").strip()
-        components.append(f"uptime: {uptime}")
-
-        ip_addresses = subprocess.check_output(["hostname", "-I"]).decode("utf-8").strip()
-        ip_addresses = ip_addresses.split(" ")
-        ip_address = ip_addresses[0] if len(ip_addresses) > 0 else "N/A"
-        components.append(f"ip: {ip_address}")
-
-        load_avg = subprocess.check_output(["cat", "/proc/loadavg"]).decode("utf-8").strip()
-        load_avg = load_avg.split(" ")[0:3]
-        load_avg = ", ".join(load_avg)
-        components.append(f"load: {load_avg}")
-
-        #battery_info = subprocess.check_output(["./battery_meter"]).decode("utf-8").strip()
-        #components.append(f"battery: {battery_info} %")
+        components.append(self.sampler.render())
 
         logging.info(components)
 
         # only send as DM
-        new_coordinates = copy.deepcopy(coordinates)
-        new_coordinates.is_dm = True
-        new_coordinates.message_id = None
+        new_coordinates = coordinates.direct()
 
         client.send_response(
             message="\n".join(components),
@@ -193,17 +276,14 @@ class Hops:
             logging.warning(f"Unauthorized shutdown request from {id} ({coordinates.from_id})")
             return
 
-        public_coordinates = copy.deepcopy(coordinates)
-        public_coordinates.channel_index = 0 # FIXME: this could be done better or extracted as a config parameter
+        public_coordinates = coordinates.replace(channel_index=0) # FIXME: this could be done better or extracted as a config parameter
         client.send_response(
             message="Admin request received, shutting down...",
             message_coordinates=public_coordinates,
         )
 
         # only send details as DM
-        new_coordinates = copy.deepcopy(coordinates)
-        new_coordinates.is_dm = True
-        new_coordinates.message_id = None
+        new_coordinates = coordinates.direct()
 
         shutdown_args = ["-h", "now"] if argument is None else str(argument).split(" ")
         shutdown_command = ["sudo", "shutdown"] + shutdown_args
@@ -230,7 +310,7 @@ class Hops:
         )
         client.send_response(message="📤", message_coordinates=coordinates)
 
-    def _on_bbs(self, coordinates: MessageCoordinates, _argument: str, client: Client):
+    def _on_bbs(self, coordinates: MessageCoordinates, argument: str, client: Client):
         if self.storage is None:
             logging.info("Cannot use BBS without storage")
             return
@@ -238,37 +318,64 @@ class Hops:
         if not coordinates.is_dm:
             client.send_response(message="📬", message_coordinates=coordinates)
 
-        new_coordinates = copy.deepcopy(coordinates)
-        new_coordinates.is_dm = True
-        new_coordinates.message_id = None
-
-        rows = self.storage.bbs_read()
-
-        messages = []
-        for row in rows[0:5]:
-            from_id = (
-                row["from_short_name"]
-                if row["from_short_name"] is not None
-                else row["from_id"]
+        new_coordinates = coordinates.direct()
+
+        # `.bbs more` carries on from where the sender's last page ended
+        cursor = None
+        if argument is not None and argument.strip().lower() == "more":
+            cursor = self.bbs_cursors.get(coordinates.from_id)
+        if cursor is None:
+            chunks, last = self._bbs_first_page()
+        else:
+            rows = self.storage.bbs_page(
+                before=cursor,
+                since=timestamp_now() - BBS_WINDOW_DAYS * MICROSECONDS_PER_DAY,
             )
-            messages.append(f"{from_id}: {row['message']}")
-
-        # Group the messages together into as few messages as possible
-        concatenated_messages = []
-        current_message = ""
-        for message in messages:
-            if len(current_message) + len(message) + 1 <= 200:
-                current_message += f"\n{message}" if current_message else message
-            else:
-                concatenated_messages.append(current_message)
-                current_message = message
-
-        if current_message:
-            concatenated_messages.append(current_message)
-
-        for message in concatenated_messages:
+            if len(rows) == 0:
+                client.send_response(message="📭", message_coordinates=new_coordinates)
+            chunks = self._render_posts(rows)
+            last = (rows[-1]["timestamp"], rows[-1]["id"]) if rows else None
+
+        if last is not None:
+            self.bbs_cursors[coordinates.from_id] = last
+            self.bbs_cursors.move_to_end(coordinates.from_id)
+            if len(self.bbs_cursors) > self.max_cursors:
+                self.bbs_cursors.popitem(last=False)
+
+        for message in chunks:
             client.send_response(message=message, message_coordinates=new_coordinates)
 
+    def _bbs_first_page(self) -> Tuple[List[str], Optional[Tuple[int, int]]]:
+        """
+        The newest page of the board rendered for sending, and the position of
+        its last post. The page is cached until the board changes or its
+        oldest post leaves the window.
+        """
+        now = timestamp_now()
+        version = self.storage.bbs_version()
+        page = self.bbs_cache.get("bbs", version, now)
+        if page is not None:
+            BBS_CACHE.labels("hit").inc()
+            return page
+        BBS_CACHE.labels("miss").inc()
+
+        rows = self.storage.bbs_read()
+        expires = None
+        last = None
+        if rows:
+            last = (rows[-1]["timestamp"], rows[-1]["id"])
+            expires = rows[-1]["timestamp"] + BBS_WINDOW_DAYS * MICROSECONDS_PER_DAY
+        page = (self._render_posts(rows), last)
+        self.bbs_cache.put("bbs", version, page, expires)
+        return page
+
+    @staticmethod
+    def _render_posts(rows: List[dict]) -> List[str]:
+        """
+        Pack the first five posts or messages into as few replies as possible
+        """
+        return pack_posts(rows[0:5])
+
     def _on_message(
         self, coordinates: MessageCoordinates, argument: str, client: Client
     ):
@@ -280,22 +387,19 @@ class Hops:
         to_name = split[0]
         message = split[1] if len(split) > 1 else ""
 
-        to_name = to_name.lower()
-        to_id = None
-        for node in client.interface.nodes.values():
-            if "user" not in node:
-                continue
-            short = get_or_else(node["user"], ["shortName"])
-            long = get_or_else(node["user"], ["longName"])
-            if (short is not None and short.lower() == to_name) or (
-                long is not None and long.lower() == to_name
-            ):
-                to_id = get_or_else(node["user"], ["id"])
-                break
-
-        if to_id is None:
+        matches = client.node_index.lookup(to_name)
+        if len(matches) == 0:
             client.send_response(message="❌", message_coordinates=coordinates)
             return
+        if len(matches) > 1:
+            labels = [client.node_index.label(num) for num in matches[:5]]
+            more = ", …" if len(matches) > 5 else ""
+            client.send_response(
+                message=f"❓ {to_name} is ambiguous: {', '.join(labels)}{more}",
+                message_coordinates=coordinates,
+            )
+            return
+        to_id = client.node_index.node_id(matches[0])
 
         self.storage.messages_insert(
             from_id=coordinates.from_id,
@@ -307,6 +411,10 @@ class Hops:
 
         client.send_response(message="📤", message_coordinates=coordinates)
 
+        if self.delivery is not None:
+            self.delivery.add(to_id, client)
+            return
+
         # Notify the addressee
         addressee_coordinates = MessageCoordinates.from_addresses(
             to_id=to_id,
@@ -314,47 +422,45 @@ class Hops:
             channel_index=coordinates.channel_index,
             interface=client.interface,
         )
-        client.send_response(message="📫", message_coordinates=addressee_coordinates)
+        client.send_response(
+            message="📫", message_coordinates=addressee_coordinates, priority=LOW
+        )
 
     def _on_messages(
-        self, coordinates: MessageCoordinates, _argument: str, client: Client
+        self, coordinates: MessageCoordinates, argument: str, client: Client
     ):
         if self.storage is None:
             logging.info("Cannot use Messages without storage")
             return
 
-        rows = self.storage.messages_read(num_to_id(coordinates.from_id))
+        # `.mail` sends what has not been delivered yet, `.mail more` pages
+        # back through everything from where the sender's last page ended
+        to_id = num_to_id(coordinates.from_id)
+        if argument is not None and argument.strip().lower() == "more":
+            rows = self.storage.messages_page(
+                to_id, before=self.mail_cursors.get(coordinates.from_id)
+            )
+        else:
+            rows = self.storage.messages_unread(to_id)
         if len(rows) == 0:
             client.send_response(message="📭", message_coordinates=coordinates)
 
         if not coordinates.is_dm:
             client.send_response(message="📬", message_coordinates=coordinates)
 
-        new_coordinates = copy.deepcopy(coordinates)
-        new_coordinates.is_dm = True
-        new_coordinates.message_id = None
+        new_coordinates = coordinates.direct()
 
-        messages = []
-        for row in rows[0:5]:
-            from_id = (
-                row["from_short_name"]
-                if row["from_short_name"] is not None
-                else row["from_id"]
-            )
-            messages.append(f"{from_id}: {row['message']}")
-
-        # Group the messages together into as few messages as possible
-        concatenated_messages = []
-        current_message = ""
-        for message in messages:
-            if len(current_message) + len(message) + 1 <= 200:
-                current_message += f"\n{message}" if current_message else message
-            else:
-                concatenated_messages.append(current_message)
-                current_message = message
-
-        if current_message:
-            concatenated_messages.append(current_message)
-
-        for message in concatenated_messages:
+        for message in self._render_posts(rows):
             client.send_response(message=message, message_coordinates=new_coordinates)
+
+        if len(rows) > 0:
+            self.storage.messages_mark_delivered(
+                row["id"] for row in rows if row["delivered_at"] is None
+            )
+            self.mail_cursors[coordinates.from_id] = (
+                rows[-1]["timestamp"],
+                rows[-1]["id"],
+            )
+            self.mail_cursors.move_to_end(coordinates.from_id)
+            if len(self.mail_cursors) > self.max_cursors:
+                self.mail_cursors.popitem(last=False)
@@ -9,13 +9,17 @@ Represents message coordinates in a communication system.
 Methods:
     from_packet(packet: dict, interface: StreamInterface) -> "Coordinates":
         Creates an instance from a packet dictionary.
+    replace(**changes) -> "Coordinates":
+        Creates a copy with some fields changed.
+
+Coordinates are immutable, so copies share the node dictionaries rather than
+copying them.
 """
 
 # import logging
 from typing import Union
 from typing import Optional
 from meshtastic.stream_interface import StreamInterface
-from .util import get_or_else, num_to_id
 
 
 class MessageCoordinates:
@@ -24,6 +28,16 @@ class MessageCoordinates:
     details about the sender, receiver, message ID, and channel information.
     """
 
+    __slots__ = (
+        "from_id",
+        "from_node",
+        "to_id",
+        "to_node",
+        "message_id",
+        "channel_index",
+        "is_dm",
+    )
+
     def __init__(
         self,
         from_id: Union[int, str],
@@ -34,13 +48,62 @@ class MessageCoordinates:
         channel_index: Optional[int],
         is_dm: bool,
     ):
-        self.from_id = from_id
-        self.from_node = from_node
-        self.to_id = to_id
-        self.to_node = to_node
-        self.message_id = message_id
-        self.channel_index = channel_index
-        self.is_dm = is_dm
+        initialize = super().__setattr__
+        initialize("from_id", from_id)
+        initialize("from_node", from_node)
+        initialize("to_id", to_id)
+        initialize("to_node", to_node)
+        initialize("message_id", message_id)
+        initialize("channel_index", channel_index)
+        initialize("is_dm", is_dm)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"MessageCoordinates are immutable, cannot set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"MessageCoordinates are immutable, cannot delete {name}")
+
+    def __reduce__(self):
+        return (
+            MessageCoordinates,
+            tuple(getattr(self, name) for name in self.__slots__),
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, MessageCoordinates):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"MessageCoordinates({fields})"
+
+    def replace(self, **changes) -> "MessageCoordinates":
+        """
+        A copy with the given fields changed, sharing the node details
+        """
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return MessageCoordinates(**fields)
+
+    def direct(self) -> "MessageCoordinates":
+        """
+        Coordinates for a direct message to the sender, not replying to
+        their message
+        """
+        if self.is_dm and self.message_id is None:
+            return self
+        return MessageCoordinates(
+            self.from_id,
+            self.from_node,
+            self.to_id,
+            self.to_node,
+            None,
+            self.channel_index,
+            True,
+        )
 
     @staticmethod
     def from_packet(packet: dict, interface: StreamInterface) -> "MessageCoordinates":
@@ -50,29 +113,19 @@ class MessageCoordinates:
         :param packet: Packet dictionary containing message details.
         :return: Coordinates instance.
         """
-        from_id = get_or_else(packet, ["from"])
-        to_id = get_or_else(packet, ["to"])
-        message_id = get_or_else(packet, ["id"])
-        channel_index = get_or_else(packet, ["channel"], None)
-
-        from_id_str = num_to_id(from_id)
-        to_id_str = num_to_id(to_id)
-
-        from_node = (
-            interface.nodes[from_id_str] if from_id_str in interface.nodes else None
-        )
-        to_node = interface.nodes[to_id_str] if to_id_str in interface.nodes else None
-
-        is_dm = to_id == interface.myInfo.my_node_num
+        from_id = packet.get("from")
+        to_id = packet.get("to")
+        # Looked up by number, as the packet has it, rather than by `!id`
+        nodes_by_num = interface.nodesByNum or {}
 
         return MessageCoordinates(
-            from_id,
-            from_node,
-            to_id,
-            to_node,
-            message_id,
-            channel_index,
-            is_dm,
+            from_id=from_id,
+            from_node=nodes_by_num.get(from_id),
+            to_id=to_id,
+            to_node=nodes_by_num.get(to_id),
+            message_id=packet.get("id"),
+            channel_index=packet.get("channel"),
+            is_dm=to_id == interface.myInfo.my_node_num,
         )
 
     @staticmethod
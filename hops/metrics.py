@@ -0,0 +1,387 @@
+"""
+Lightweight instrumentation of the bot's hot paths.
+
+Modules declare their counters and histograms at import time on the shared
+`REGISTRY`. Until the registry is enabled, recording a value is a single
+attribute check, so the instrumentation costs next to nothing for anybody not
+looking at it. When enabled, the values are exported in the Prometheus text
+format by `MetricsServer` on localhost and/or logged periodically as a single
+structured line by `MetricsLogger`.
+"""
+
+import bisect
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Seconds; suits anything from an SQLite commit to a slow command
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra="") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "Registry", name: str, documentation: str, labels):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        """
+        The child metric for one combination of label values
+        """
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def header(self) -> List[str]:
+        """
+        The HELP and TYPE lines of the metric
+        """
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class _CounterChild:
+    __slots__ = ("registry", "value", "_lock")
+
+    def __init__(self, registry: "Registry"):
+        self.registry = registry
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        """
+        Add `amount` to the counter
+        """
+        if self.registry.enabled:
+            with self._lock:
+                self.value += amount
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count
+    """
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild(self.registry)
+
+    def inc(self, amount: float = 1) -> None:
+        """
+        Add `amount` to the unlabelled counter
+        """
+        if self.registry.enabled:
+            self.labels().inc(amount)
+
+    def samples(self) -> List[Tuple[str, float]]:
+        """
+        Sample lines and their values
+        """
+        return [
+            (f"{self.name}{_format_labels(self.labelnames, values)}", child.value)
+            for values, child in list(self._children.items())
+        ]
+
+
+class _HistogramChild:
+    __slots__ = ("registry", "buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, registry: "Registry", buckets: Sequence[float]):
+        self.registry = registry
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """
+        Record a single observation
+        """
+        if not self.registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if index < len(self.counts):
+                self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, typically latencies in seconds
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        registry: "Registry",
+        name: str,
+        documentation: str,
+        labels,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.registry, self.buckets)
+
+    def observe(self, value: float) -> None:
+        """
+        Record an observation on the unlabelled histogram
+        """
+        if self.registry.enabled:
+            self.labels().observe(value)
+
+    def samples(self) -> List[Tuple[str, float]]:
+        """
+        Sample lines and their values
+        """
+        samples = []
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, f'le="{bound}"')
+                samples.append((f"{self.name}_bucket{labels}", cumulative))
+            labels = _format_labels(self.labelnames, values, 'le="+Inf"')
+            samples.append((f"{self.name}_bucket{labels}", child.count))
+            labels = _format_labels(self.labelnames, values)
+            samples.append((f"{self.name}_sum{labels}", child.sum))
+            samples.append((f"{self.name}_count{labels}", child.count))
+        return samples
+
+
+class Gauge(_Metric):
+    """
+    A value read from a callback when the metrics are collected
+    """
+
+    kind = "gauge"
+
+    def __init__(self, registry, name, documentation, function: Callable[[], float]):
+        super().__init__(registry, name, documentation, ())
+        self.function = function
+
+    def samples(self) -> List[Tuple[str, float]]:
+        """
+        Sample lines and their values
+        """
+        try:
+            return [(self.name, float(self.function()))]
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Failed to collect %s", self.name)
+            return []
+
+
+class Registry:
+    """
+    The set of metrics exported by the bot. Disabled until `enabled` is set.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        """
+        Declare a counter
+        """
+        return self._register(Counter(self, name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels=(),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """
+        Declare a histogram
+        """
+        return self._register(Histogram(self, name, documentation, labels, buckets))
+
+    def gauge(
+        self, name: str, documentation: str, function: Callable[[], float]
+    ) -> Gauge:
+        """
+        Declare a gauge, replacing any previous gauge of the same name
+        """
+        gauge = Gauge(self, name, documentation, function)
+        with self._lock:
+            self._metrics[name] = gauge
+        return gauge
+
+    def expose(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.header())
+            lines.extend(
+                f"{name} {_format_value(value)}" for name, value in metric.samples()
+            )
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, float]:
+        """
+        A flat dictionary of the metrics, with histograms reduced to their
+        count and mean, for logging
+        """
+        summary: Dict[str, float] = {}
+        for metric in list(self._metrics.values()):
+            if not isinstance(metric, Histogram):
+                summary.update(metric.samples())
+                continue
+            for values, child in list(metric._children.items()):
+                labels = _format_labels(metric.labelnames, values)
+                summary[f"{metric.name}_count{labels}"] = child.count
+                summary[f"{metric.name}_mean{labels}"] = (
+                    round(child.sum / child.count, 6) if child.count else 0.0
+                )
+        return summary
+
+
+REGISTRY = Registry()
+
+
+class MetricsServer:
+    """
+    Serves `/metrics` in the Prometheus text format on a local port
+    """
+
+    def __init__(
+        self, registry: Registry = REGISTRY, port: int = 9464, host="127.0.0.1"
+    ):
+        registry.enabled = True
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Request handler bound to the registry
+            """
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                Respond with the metrics
+                """
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.expose().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                logging.debug(format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="hops-metrics", daemon=True
+        )
+
+    @property
+    def port(self) -> int:
+        """
+        The port actually listened on
+        """
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        """
+        Start serving in the background
+        """
+        self._thread.start()
+
+    def close(self) -> None:
+        """
+        Stop serving
+        """
+        if self._thread.is_alive():
+            self._server.shutdown()
+        self._server.server_close()
+
+
+class MetricsLogger:
+    """
+    Background thread logging a structured metrics line every `interval`
+    seconds
+    """
+
+    def __init__(self, registry: Registry = REGISTRY, interval: float = 60.0):
+        registry.enabled = True
+        self.registry = registry
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="hops-metrics-log", daemon=True
+        )
+
+    def start(self) -> None:
+        """
+        Start logging in the background
+        """
+        self._thread.start()
+
+    def close(self) -> None:
+        """
+        Stop logging
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def log(self) -> None:
+        """
+        Log the metrics now
+        """
+        logging.info("metrics %s", json.dumps(self.registry.summary(), sort_keys=True))
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.log()
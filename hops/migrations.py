@@ -0,0 +1,453 @@
+"""
+Versioned schema migrations for the hops database.
+
+The schema version is kept in `PRAGMA user_version`. `migrate` applies every
+migration newer than the database, in order, recording the version after each
+one so an interrupted upgrade resumes where it stopped. Migrations which touch
+existing rows copy them in batches, committing between batches, so that other
+processes are never locked out of the database for long.
+"""
+
+import json
+import logging
+import sqlite3
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Tuple
+from .util import changed_fields
+
+
+def iso_to_us(value) -> Optional[int]:
+    """
+    Convert a legacy `datetime.now().isoformat()` timestamp (local time) to
+    integer microseconds since the epoch
+    """
+    if value is None or isinstance(value, int):
+        return value
+    moment = datetime.fromisoformat(str(value))
+    return int(moment.timestamp()) * 1_000_000 + moment.microsecond
+
+
+def _initial_schema(conn: sqlite3.Connection, _batch_size: int) -> None:
+    """
+    The tables as they were before the database was versioned
+    """
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS packets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME UNIQUE NOT NULL,
+            codec TEXT NOT NULL DEFAULT 'json',
+            packet BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS nodes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME UNIQUE NOT NULL,
+            node_id TEXT NOT NULL,
+            node_json TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS bbs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME UNIQUE NOT NULL,
+            from_id TEXT NOT NULL,
+            from_short_name TEXT,
+            from_long_name TEXT,
+            message TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_bbs_timestamp
+        ON bbs (timestamp);
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME UNIQUE NOT NULL,
+            from_id TEXT NOT NULL,
+            from_short_name TEXT,
+            from_long_name TEXT,
+            to_id TEXT NOT NULL,
+            message TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_to_id_timestamp
+        ON messages (to_id, timestamp);
+        """
+    )
+
+
+def _packet_archive(conn: sqlite3.Connection, _batch_size: int) -> None:
+    """
+    Databases from before the protobuf packet archive. Both of these are
+    metadata only changes, the rows themselves are converted by
+    `Storage.compact_packets`.
+    """
+    if "packet_json" in _columns(conn, "packets"):
+        with conn:
+            conn.execute("ALTER TABLE packets RENAME COLUMN packet_json TO packet")
+            conn.execute(
+                "ALTER TABLE packets ADD COLUMN codec TEXT NOT NULL DEFAULT 'json'"
+            )
+
+
+def _integer_timestamps(conn: sqlite3.Connection, batch_size: int) -> None:
+    """
+    Replace the unique ISO string timestamps with (non-unique) integer
+    microseconds since the epoch
+    """
+    conn.create_function("iso_to_us", 1, iso_to_us, deterministic=True)
+    rebuild_table(
+        conn,
+        "packets",
+        """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        codec TEXT NOT NULL DEFAULT 'json',
+        packet BLOB NOT NULL
+        """,
+        ["id", "timestamp", "codec", "packet"],
+        ["CREATE INDEX idx_packets_timestamp ON packets (timestamp)"],
+        batch_size,
+    )
+    rebuild_table(
+        conn,
+        "nodes",
+        """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        node_id TEXT NOT NULL,
+        node_json TEXT NOT NULL
+        """,
+        ["id", "timestamp", "node_id", "node_json"],
+        ["CREATE INDEX idx_nodes_timestamp ON nodes (timestamp)"],
+        batch_size,
+    )
+    rebuild_table(
+        conn,
+        "bbs",
+        """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        from_id TEXT NOT NULL,
+        from_short_name TEXT,
+        from_long_name TEXT,
+        message TEXT NOT NULL
+        """,
+        ["id", "timestamp", "from_id", "from_short_name", "from_long_name", "message"],
+        ["CREATE INDEX idx_bbs_timestamp ON bbs (timestamp)"],
+        batch_size,
+    )
+    rebuild_table(
+        conn,
+        "messages",
+        """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        from_id TEXT NOT NULL,
+        from_short_name TEXT,
+        from_long_name TEXT,
+        to_id TEXT NOT NULL,
+        message TEXT NOT NULL
+        """,
+        [
+            "id",
+            "timestamp",
+            "from_id",
+            "from_short_name",
+            "from_long_name",
+            "to_id",
+            "message",
+        ],
+        ["CREATE INDEX idx_messages_to_id_timestamp " "ON messages (to_id, timestamp)"],
+        batch_size,
+    )
+
+
+def _node_latest(conn: sqlite3.Connection, batch_size: int) -> None:
+    """
+    Replace the `nodes` table of full snapshots with the latest state of each
+    node plus a log of the fields which changed. Each node's snapshots are
+    walked in order and turned into that log, so no history is lost, and its
+    last snapshot becomes its latest state.
+    """
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS node_latest (
+            node_id TEXT PRIMARY KEY,
+            node_num INTEGER,
+            short_name TEXT,
+            long_name TEXT,
+            hw_model TEXT,
+            last_heard INTEGER,
+            updated INTEGER NOT NULL,
+            node_json TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS node_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER NOT NULL,
+            node_id TEXT NOT NULL,
+            changes_json TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_node_changes_timestamp
+        ON node_changes (timestamp);
+        CREATE INDEX IF NOT EXISTS idx_node_changes_node_id_timestamp
+        ON node_changes (node_id, timestamp);
+        """
+    )
+    if "nodes" not in _tables(conn):
+        return
+    conn.create_function("json_or_empty", 1, _json_or_empty, deterministic=True)
+    # Nodes are converted in node_id order, and a node only gets its latest
+    # state once all of its snapshots are in the change log. An interrupted
+    # conversion drops the changes of the node it was part way through and
+    # carries on from that node.
+    with conn:
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_nodes_node_id_id ON nodes (node_id, id)"
+        )
+        after = conn.execute(
+            "SELECT COALESCE(MAX(node_id), '') FROM node_latest"
+        ).fetchone()[0]
+        conn.execute("DELETE FROM node_changes WHERE node_id > ?", (after,))
+    # Past every snapshot of the last node finished
+    key = (after, 2**63 - 1)
+    previous_id = None
+    previous = None
+    latest = None
+    while True:
+        with conn:
+            rows = conn.execute(
+                """
+                SELECT node_id, id, timestamp, json_or_empty(node_json)
+                FROM nodes
+                WHERE node_id > ?1 OR (node_id = ?1 AND id > ?2)
+                ORDER BY node_id, id
+                LIMIT ?3
+            """,
+                (*key, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            completed = []
+            changes = []
+            for node_id, _, timestamp, node_json in rows:
+                if node_id != previous_id:
+                    if latest is not None:
+                        completed.append(latest)
+                    previous_id = node_id
+                    previous = None
+                node = json.loads(node_json)
+                difference = changed_fields(previous, node)
+                if difference or previous is None:
+                    changes.append((node_id, timestamp, _compact_json(difference)))
+                previous = node
+                latest = (node_id, timestamp, node_json)
+            _insert_node_latest(conn, completed)
+            conn.executemany(
+                """
+                INSERT INTO node_changes (node_id, timestamp, changes_json)
+                VALUES (?, ?, ?)
+            """,
+                changes,
+            )
+            key = rows[-1][:2]
+    with conn:
+        if latest is not None:
+            _insert_node_latest(conn, [latest])
+        conn.execute("DROP TABLE nodes")
+
+
+def _insert_node_latest(
+    conn: sqlite3.Connection, rows: Sequence[Tuple[str, int, str]]
+) -> None:
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO node_latest
+            (node_id, node_num, short_name, long_name, hw_model,
+             last_heard, updated, node_json)
+        VALUES
+            (?1, json_extract(?3, '$.num'),
+             json_extract(?3, '$."user.shortName"'),
+             json_extract(?3, '$."user.longName"'),
+             json_extract(?3, '$."user.hwModel"'),
+             json_extract(?3, '$.lastHeard') * 1000000, ?2, ?3)
+    """,
+        rows,
+    )
+
+
+def _node_search(conn: sqlite3.Connection, _batch_size: int) -> None:
+    """
+    Full text index over the names and hardware of the latest node states,
+    kept in step with `node_latest` by triggers, plus indexes for looking
+    nodes up by number and listing them by when they were last heard
+    """
+    conn.executescript(
+        """
+        BEGIN;
+        CREATE VIRTUAL TABLE IF NOT EXISTS node_fts USING fts5(
+            long_name,
+            short_name,
+            hw_model,
+            content = 'node_latest',
+            content_rowid = 'rowid',
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS node_latest_fts_insert
+        AFTER INSERT ON node_latest
+        BEGIN
+            INSERT INTO node_fts (rowid, long_name, short_name, hw_model)
+            VALUES (new.rowid, new.long_name, new.short_name, new.hw_model);
+        END;
+        CREATE TRIGGER IF NOT EXISTS node_latest_fts_delete
+        AFTER DELETE ON node_latest
+        BEGIN
+            INSERT INTO node_fts (node_fts, rowid, long_name, short_name, hw_model)
+            VALUES ('delete', old.rowid, old.long_name, old.short_name, old.hw_model);
+        END;
+        CREATE TRIGGER IF NOT EXISTS node_latest_fts_update
+        AFTER UPDATE OF long_name, short_name, hw_model ON node_latest
+        WHEN old.long_name IS NOT new.long_name
+            OR old.short_name IS NOT new.short_name
+            OR old.hw_model IS NOT new.hw_model
+        BEGIN
+            INSERT INTO node_fts (node_fts, rowid, long_name, short_name, hw_model)
+            VALUES ('delete', old.rowid, old.long_name, old.short_name, old.hw_model);
+            INSERT INTO node_fts (rowid, long_name, short_name, hw_model)
+            VALUES (new.rowid, new.long_name, new.short_name, new.hw_model);
+        END;
+        INSERT INTO node_fts (node_fts) VALUES ('rebuild');
+        CREATE INDEX IF NOT EXISTS idx_node_latest_node_num
+        ON node_latest (node_num);
+        CREATE INDEX IF NOT EXISTS idx_node_latest_last_heard
+        ON node_latest (last_heard DESC, node_id);
+        COMMIT;
+        """
+    )
+
+
+def _mail_delivery(conn: sqlite3.Connection, _batch_size: int) -> None:
+    """
+    Record when each message was delivered to its addressee, with a partial
+    index over the undelivered messages of each addressee, newest first.
+    Messages older than the 28 days `.mail` used to look back could never
+    have been read, so they are marked delivered rather than resurfacing.
+    """
+    with conn:
+        if "delivered_at" not in _columns(conn, "messages"):
+            conn.execute("ALTER TABLE messages ADD COLUMN delivered_at INTEGER")
+        conn.execute(
+            """
+            UPDATE messages SET delivered_at = timestamp
+            WHERE delivered_at IS NULL AND timestamp < ?
+        """,
+            (int((datetime.now().timestamp() - 28 * 86400) * 1_000_000),),
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_messages_unread
+            ON messages (to_id, timestamp DESC, id DESC)
+            WHERE delivered_at IS NULL
+        """
+        )
+
+
+MIGRATIONS: List[Callable[[sqlite3.Connection, int], None]] = [
+    _initial_schema,
+    _packet_archive,
+    _integer_timestamps,
+    _node_latest,
+    _node_search,
+    _mail_delivery,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn: sqlite3.Connection, batch_size: int = 1000) -> int:
+    """
+    Bring the database up to `SCHEMA_VERSION`, returning the version it
+    started at
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than this hops "
+            f"({SCHEMA_VERSION})"
+        )
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        logging.info("Migrating database to schema version %d", number)
+        MIGRATIONS[number - 1](conn, batch_size)
+        with conn:
+            conn.execute(f"PRAGMA user_version = {number}")
+    return version
+
+
+def rebuild_table(
+    conn: sqlite3.Connection,
+    table: str,
+    definition: str,
+    columns: Sequence[str],
+    indexes: Sequence[str],
+    batch_size: int,
+) -> None:
+    """
+    Rebuild `table` with a new `definition`, converting the timestamp column
+    with `iso_to_us`. Rows are copied into a side table in batches, each in
+    its own transaction; only the final catch-up and swap hold the write lock
+    for the whole operation. A rebuild that was interrupted resumes from the
+    last copied row.
+    """
+    if _column_type(conn, table, "timestamp") == "INTEGER":
+        return
+    side_table = f"{table}_migrating"
+    column_list = ", ".join(columns)
+    select_list = ", ".join(
+        "iso_to_us(timestamp)" if column == "timestamp" else column
+        for column in columns
+    )
+    copy = f"""
+        INSERT INTO {side_table} ({column_list})
+        SELECT {select_list}
+        FROM {table}
+        WHERE id > (SELECT COALESCE(MAX(id), 0) FROM {side_table})
+        ORDER BY id
+    """
+
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {side_table} ({definition})")
+    while True:
+        with conn:
+            copied = conn.execute(f"{copy} LIMIT ?", (batch_size,)).rowcount
+        if copied < batch_size:
+            break
+
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(copy)
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {side_table} RENAME TO {table}")
+        for index in indexes:
+            conn.execute(index)
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _tables(conn: sqlite3.Connection) -> List[str]:
+    return [
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    ]
+
+
+def _compact_json(value) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _json_or_empty(value) -> str:
+    # Legacy snapshots were indented, store them compactly
+    try:
+        return _compact_json(json.loads(value))
+    except (TypeError, ValueError):
+        return "{}"
+
+
+def _column_type(conn: sqlite3.Connection, table: str, column: str) -> Optional[str]:
+    for row in conn.execute(f"PRAGMA table_info({table})"):
+        if row[1] == column:
+            return row[2].upper()
+    return None
@@ -0,0 +1,137 @@
+"""
+This module provides the `NodeIndex` class, an in-memory index used to resolve
+the names people type (short name, long name or node id) to a node number
+without scanning the whole node database on every request.
+"""
+
+import bisect
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from .util import get_or_else, num_to_id
+
+
+def fold(name: str) -> str:
+    """
+    Normalise a name for case-insensitive comparison
+    """
+    return name.strip().casefold()
+
+
+class NodeIndex:
+    """
+    Maps case-folded short names, long names and node ids to node numbers.
+    The index is updated incrementally as nodes are heard, and supports exact
+    and prefix lookups which report every matching node so that callers can
+    tell an ambiguous name from a unique one.
+    """
+
+    def __init__(self):
+        self._nums_by_key: Dict[str, Set[int]] = {}
+        self._keys_by_num: Dict[int, Tuple[str, ...]] = {}
+        self._ids_by_num: Dict[int, str] = {}
+        self._labels_by_num: Dict[int, str] = {}
+        # Distinct keys in sorted order, for prefix lookups
+        self._sorted_keys: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys_by_num)
+
+    def rebuild(self, nodes: Iterable[dict]) -> None:
+        """
+        Replace the contents of the index with `nodes`
+        """
+        with self._lock:
+            self._nums_by_key.clear()
+            self._keys_by_num.clear()
+            self._ids_by_num.clear()
+            self._labels_by_num.clear()
+            self._sorted_keys.clear()
+        for node in nodes:
+            self.update(node)
+
+    def update(self, node: dict) -> None:
+        """
+        Add or refresh a single node, as published by `meshtastic.node.updated`
+        """
+        num = node.get("num")
+        node_id = get_or_else(node, ["user", "id"])
+        if num is None and node_id is not None:
+            num = int(node_id.lstrip("!"), 16)
+        if num is None:
+            return
+        node_id = node_id or num_to_id(num)
+        short_name = get_or_else(node, ["user", "shortName"])
+        long_name = get_or_else(node, ["user", "longName"])
+        keys = tuple({fold(key) for key in (short_name, long_name, node_id) if key})
+
+        with self._lock:
+            self._remove_keys(num)
+            self._keys_by_num[num] = keys
+            self._ids_by_num[num] = node_id
+            self._labels_by_num[num] = short_name or long_name or node_id
+            for key in keys:
+                nums = self._nums_by_key.get(key)
+                if nums is None:
+                    nums = self._nums_by_key[key] = set()
+                    bisect.insort(self._sorted_keys, key)
+                nums.add(num)
+
+    def remove(self, num: int) -> None:
+        """
+        Forget a node
+        """
+        with self._lock:
+            self._remove_keys(num)
+            self._keys_by_num.pop(num, None)
+            self._ids_by_num.pop(num, None)
+            self._labels_by_num.pop(num, None)
+
+    def lookup(self, name: str, prefix: bool = True) -> List[int]:
+        """
+        Return the numbers of the nodes matching `name`. Exact matches win;
+        failing that, and if `prefix` is set, every node with a name starting
+        with `name` is returned. More than one result means the name is
+        ambiguous.
+        """
+        key = fold(name)
+        if not key:
+            return []
+        with self._lock:
+            exact = self._nums_by_key.get(key)
+            if exact:
+                return sorted(exact)
+            if not prefix:
+                return []
+            matches: Set[int] = set()
+            position = bisect.bisect_left(self._sorted_keys, key)
+            while position < len(self._sorted_keys):
+                candidate = self._sorted_keys[position]
+                if not candidate.startswith(key):
+                    break
+                matches.update(self._nums_by_key[candidate])
+                position += 1
+            return sorted(matches)
+
+    def node_id(self, num: int) -> Optional[str]:
+        """
+        The meshtastic identifier of an indexed node
+        """
+        return self._ids_by_num.get(num)
+
+    def label(self, num: int) -> Optional[str]:
+        """
+        A short human readable name for an indexed node
+        """
+        return self._labels_by_num.get(num)
+
+    def _remove_keys(self, num: int) -> None:
+        for key in self._keys_by_num.get(num, ()):
+            nums = self._nums_by_key.get(key)
+            if nums is None:
+                continue
+            nums.discard(num)
+            if not nums:
+                del self._nums_by_key[key]
+                index = bisect.bisect_left(self._sorted_keys, key)
+                del self._sorted_keys[index]
@@ -0,0 +1,110 @@
+"""
+Encoding of received packets for the `packets` archive.
+
+Packets are stored as the serialized `MeshPacket` protobuf the radio sent us,
+optionally zlib compressed. This keeps the log lossless and several times
+smaller than the flattened JSON it replaces. Packets without a raw protobuf
+(e.g. synthesized in tests) fall back to compact flattened JSON.
+"""
+
+import json
+import zlib
+from typing import Optional, Tuple, Union
+from google.protobuf import json_format
+from meshtastic import protocols
+from meshtastic.protobuf.mesh_pb2 import MeshPacket
+from .util import flat_dict
+
+JSON = "json"
+PROTOBUF = "pb"
+PROTOBUF_ZLIB = "pb+zlib"
+CODECS = (JSON, PROTOBUF, PROTOBUF_ZLIB)
+
+
+def encode_packet(packet: dict, codec: str = PROTOBUF) -> Tuple[str, Union[str, bytes]]:
+    """
+    Encode a packet dictionary as published by meshtastic, returning the codec
+    actually used together with the encoded data.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown packet codec: {codec}")
+    raw = packet.get("raw")
+    if codec != JSON and isinstance(raw, MeshPacket):
+        return codec, encode_mesh_packet(raw, codec)
+    return JSON, json.dumps(
+        flat_dict(packet), separators=(",", ":"), ensure_ascii=False
+    )
+
+
+def encode_mesh_packet(mesh_packet: MeshPacket, codec: str = PROTOBUF) -> bytes:
+    """
+    Serialize a `MeshPacket` with one of the protobuf codecs
+    """
+    data = mesh_packet.SerializeToString()
+    if codec == PROTOBUF_ZLIB:
+        data = zlib.compress(data)
+    return data
+
+
+def decode_mesh_packet(codec: str, data: Union[str, bytes]) -> MeshPacket:
+    """
+    Parse data stored with one of the protobuf codecs back into a `MeshPacket`
+    """
+    if codec == PROTOBUF_ZLIB:
+        data = zlib.decompress(data)
+    elif codec != PROTOBUF:
+        raise ValueError(f"Not a protobuf codec: {codec}")
+    return MeshPacket.FromString(data)
+
+
+def decode_packet(codec: str, data: Union[str, bytes]) -> dict:
+    """
+    Decode a stored packet back into a dictionary
+    """
+    if codec == JSON:
+        return json.loads(data)
+    return json_format.MessageToDict(decode_mesh_packet(codec, data))
+
+
+def unflatten_dict(d: dict, sep: str = ".") -> dict:
+    """
+    Reverse `util.flat_dict`
+    """
+    result: dict = {}
+    for key, value in d.items():
+        current = result
+        *parents, leaf = key.split(sep)
+        for parent in parents:
+            current = current.setdefault(parent, {})
+        current[leaf] = value
+    return result
+
+
+def mesh_packet_from_flat_json(packet_json: str) -> Optional[MeshPacket]:
+    """
+    Best effort reconstruction of a `MeshPacket` from a legacy flattened JSON
+    row. The payload is re-encoded from the decoded text or protobuf fields
+    meshtastic added to the packet. Returns None if the row cannot be parsed.
+    """
+    try:
+        packet = unflatten_dict(json.loads(packet_json))
+        if "from" not in packet:
+            return None
+        mesh_packet = json_format.ParseDict(
+            packet, MeshPacket(), ignore_unknown_fields=True
+        )
+        decoded = packet.get("decoded")
+        if isinstance(decoded, dict) and mesh_packet.HasField("decoded"):
+            handler = protocols.get(mesh_packet.decoded.portnum)
+            if handler is not None and handler.name in decoded:
+                value = decoded[handler.name]
+                if handler.protobufFactory is not None and isinstance(value, dict):
+                    message = json_format.ParseDict(
+                        value, handler.protobufFactory(), ignore_unknown_fields=True
+                    )
+                    mesh_packet.decoded.payload = message.SerializeToString()
+                elif isinstance(value, str):
+                    mesh_packet.decoded.payload = value.encode("utf-8")
+        return mesh_packet
+    except (ValueError, TypeError, AttributeError, json_format.ParseError):
+        return None
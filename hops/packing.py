@@ -0,0 +1,107 @@
+"""
+Packing of multi-line replies into as few packets as possible.
+
+Meshtastic limits the payload of a packet in bytes, not characters, so rows
+are measured by their UTF-8 encoded length. Rows are kept in order and joined
+with newlines; a row is only split when it cannot fit in a packet of its own,
+and then at a word boundary where there is one.
+"""
+
+import re
+from typing import Iterable, List, Optional
+from meshtastic.protobuf.mesh_pb2 import Constants
+
+MAX_PAYLOAD = Constants.DATA_PAYLOAD_LEN
+SEPARATOR = "\n"
+
+_LAST_SPACE = re.compile(r"\s(?=\S*$)")
+
+
+def byte_length(text: str) -> int:
+    """
+    The size of `text` in a packet payload
+    """
+    return len(text.encode("utf-8"))
+
+
+def _cut(text: str, room: int, hard: bool) -> int:
+    """
+    The index at which to cut `text` so that the head fits in `room` bytes:
+    at the last word boundary if there is one, otherwise, if `hard`, at the
+    last whole character. Returns 0 if `text` cannot be cut.
+    """
+    if room <= 0:
+        return 0
+    encoded = text.encode("utf-8")
+    if len(encoded) <= room:
+        return len(text)
+    # Back off to the start of a UTF-8 sequence
+    end = room
+    while end > 0 and encoded[end] & 0xC0 == 0x80:
+        end -= 1
+    head = encoded[:end].decode("utf-8")
+    match = _LAST_SPACE.search(head)
+    if match is not None and head[: match.start()].strip():
+        return match.start()
+    return len(head) if hard else 0
+
+
+def split(text: str, limit: int = MAX_PAYLOAD) -> List[str]:
+    """
+    Split `text` into pieces of at most `limit` bytes at word boundaries,
+    breaking words only if they are longer than `limit` on their own
+    """
+    return pack([text], limit)
+
+
+def pack(rows: Iterable[str], limit: int = MAX_PAYLOAD) -> List[str]:
+    """
+    Join `rows` into the fewest packets of at most `limit` bytes. Packets are
+    filled greedily in order, which is optimal for rows that are not split;
+    a row too long for any packet starts in the space left in the current one
+    and carries on into the next.
+    """
+    packets = []
+    current = ""
+    for row in rows:
+        while row:
+            used = byte_length(current) + byte_length(SEPARATOR) if current else 0
+            length = byte_length(row)
+            if length <= limit - used:
+                current = f"{current}{SEPARATOR}{row}" if current else row
+                break
+            if current and length <= limit:
+                # Fits in a packet of its own, so don't break it up
+                cut = 0
+            else:
+                cut = _cut(row, limit - used, hard=not current)
+            if cut:
+                head = row[:cut].rstrip()
+                current = f"{current}{SEPARATOR}{head}" if current else head
+                row = row[cut:].lstrip()
+            if current:
+                packets.append(current)
+            current = ""
+    if current:
+        packets.append(current)
+    return packets
+
+
+def pack_posts(
+    rows: Iterable[dict], prefix: Optional[str] = None, limit: int = MAX_PAYLOAD
+) -> List[str]:
+    """
+    Pack BBS posts or mail as `sender: message` lines, the sender being their
+    short name where known. `prefix` starts the first line.
+    """
+    lines = []
+    for row in rows:
+        sender = (
+            row["from_short_name"]
+            if row["from_short_name"] is not None
+            else row["from_id"]
+        )
+        lines.append(f"{sender}: {row['message']}")
+    if prefix is not None and lines:
+        lines[0] = f"{prefix}{lines[0]}"
+    return pack(lines, limit)
@@ -0,0 +1,149 @@
+"""
+This module provides `RateLimiter`, the admission control in front of command
+dispatch.
+
+Each command costs some of a budget that is spent over a sliding window, both
+by its sender and by the channel it arrived on, so that one node spamming
+commands on a public channel cannot monopolize the database and the airtime.
+Commands that touch the database or send several packets cost more than a
+`.ping`. A sender who runs out of budget is told once, and their further
+commands are dropped silently until the window has made room again.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Optional, Tuple
+from .metrics import REGISTRY
+
+ADMIT = 0
+NOTIFY = 1
+DROP = 2
+
+DEFAULT_COST = 1
+EXPENSIVE = 3
+DEFAULT_COSTS = {
+    "bbs": EXPENSIVE,
+    "messages": EXPENSIVE,
+    "message": EXPENSIVE,
+    "post": EXPENSIVE,
+}
+
+RATE_LIMITED = REGISTRY.counter(
+    "hops_rate_limited_total", "Commands refused by the rate limiter", ["scope"]
+)
+
+
+class _Window:
+    """
+    The costs spent by one sender or channel within the window
+    """
+
+    __slots__ = ("events", "spent", "last_seen", "rejecting")
+
+    def __init__(self):
+        self.events: Deque[Tuple[float, int]] = deque()
+        self.spent = 0
+        self.last_seen = 0.0
+        # Whether the last command from this sender was refused
+        self.rejecting = False
+
+    def expire(self, horizon: float) -> None:
+        while self.events and self.events[0][0] <= horizon:
+            self.spent -= self.events.popleft()[1]
+
+
+class RateLimiter:
+    """
+    Sliding window limits of `sender_budget` per sender and `channel_budget`
+    per channel every `window` seconds. A budget of 0 disables that limit.
+    At most `max_entries` senders and channels are tracked; the least
+    recently active are forgotten first.
+    """
+
+    def __init__(
+        self,
+        sender_budget: int = 10,
+        channel_budget: int = 30,
+        window: float = 60.0,
+        costs: Optional[Dict[str, int]] = None,
+        max_entries: int = 1024,
+    ):
+        self.sender_budget = sender_budget
+        self.channel_budget = channel_budget
+        self.window = window
+        self.costs = DEFAULT_COSTS if costs is None else costs
+        self.max_entries = max_entries
+        self.admitted = 0
+        self.rejected = 0
+        self.notices = 0
+        self._windows: "OrderedDict[Hashable, _Window]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def cost(self, command: str) -> int:
+        """
+        The cost of a command
+        """
+        return self.costs.get(command, DEFAULT_COST)
+
+    def admit(self, sender: Hashable, channel: Optional[int], command: str) -> int:
+        """
+        Decide whether a command may run: ADMIT, NOTIFY if it is the first
+        refused since the sender's last admitted command, otherwise DROP
+        """
+        cost = self.cost(command)
+        now = time.monotonic()
+        with self._lock:
+            sender_window = self._window(("sender", sender), now)
+            channel_window = self._window(("channel", channel or 0), now)
+            decision = self._decide(sender_window, channel_window, cost, now)
+            self._evict(now)
+            return decision
+
+    def _decide(
+        self, sender_window: _Window, channel_window: _Window, cost: int, now: float
+    ) -> int:
+        scope = None
+        if self.sender_budget and sender_window.spent + cost > self.sender_budget:
+            scope = "sender"
+        elif self.channel_budget and channel_window.spent + cost > self.channel_budget:
+            scope = "channel"
+
+        if scope is None:
+            for window in (sender_window, channel_window):
+                window.events.append((now, cost))
+                window.spent += cost
+            sender_window.rejecting = False
+            self.admitted += 1
+            return ADMIT
+
+        RATE_LIMITED.labels(scope).inc()
+        self.rejected += 1
+        if sender_window.rejecting:
+            return DROP
+        sender_window.rejecting = True
+        self.notices += 1
+        return NOTIFY
+
+    def _window(self, key: Hashable, now: float) -> _Window:
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = _Window()
+        else:
+            self._windows.move_to_end(key)
+        window.expire(now - self.window)
+        window.last_seen = now
+        return window
+
+    def _evict(self, now: float) -> None:
+        # Entries are kept in order of use, so the idle ones are at the front.
+        # An entry unused for a whole window has nothing left to remember.
+        horizon = now - self.window
+        while self._windows:
+            window = next(iter(self._windows.values()))
+            if len(self._windows) <= self.max_entries and window.last_seen > horizon:
+                break
+            self._windows.popitem(last=False)
@@ -0,0 +1,286 @@
+"""
+Replay of the packet log through the bot, without a radio.
+
+Logged packets are decoded back into `MeshPacket`s and handed, in their
+original order, to `ReplayInterface`. This is a meshtastic interface with
+nothing behind it. It publishes each packet exactly as a connected interface
+would, so `Client` and `Hops` handle it like live traffic, and it records
+what the bot sends back instead of transmitting it. The gaps between packets
+are reproduced from the logged timestamps, scaled by a speed factor, or
+skipped entirely to replay as fast as possible.
+"""
+
+import logging
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+from google.protobuf.message import DecodeError
+from pubsub import pub
+from meshtastic import BROADCAST_ADDR, BROADCAST_NUM, publishingThread
+from meshtastic.mesh_interface import MeshInterface
+from meshtastic.protobuf.mesh_pb2 import MeshPacket, MyNodeInfo
+from meshtastic.protobuf.portnums_pb2 import PortNum
+from .client import Client
+from .delivery import MailDelivery
+from .dispatch import CommandDispatcher
+from .hops import Hops
+from .packet_codec import (
+    JSON,
+    decode_mesh_packet,
+    mesh_packet_from_flat_json,
+    unflatten_dict,
+)
+from .storage import Storage
+from .util import get_or_else
+from .writer import BatchWriter
+
+
+class ReplayInterface(MeshInterface):
+    """
+    A meshtastic interface fed from a packet log rather than a radio.
+    Everything sent through it is kept in `outbound` as
+    `(seconds since creation, destination, packet)`.
+    """
+
+    # Overrides keep meshtastic's camel case names
+    # pylint: disable=invalid-name
+
+    def __init__(self, my_node_num: int, nodes: Iterable[dict] = ()):
+        super().__init__(noProto=True)
+        self.myInfo = MyNodeInfo(my_node_num=my_node_num)
+        self.nodes: Dict[str, dict] = {}
+        self.nodesByNum: Dict[int, dict] = {}
+        self.outbound: List[Tuple[float, Union[int, str], MeshPacket]] = []
+        # Sequential rather than random ids, so replays can be compared
+        self.currentPacketId = 0
+        self._outbound_lock = threading.Lock()
+        self._started = time.monotonic()
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node: dict) -> None:
+        """
+        Add a node, as found in a real interface's node database
+        """
+        num = node.get("num")
+        node_id = get_or_else(node, ["user", "id"])
+        if num is None and node_id is not None:
+            num = int(node_id.lstrip("!"), 16)
+        if num is None:
+            return
+        self.nodesByNum[num] = node
+        self.nodes[node_id or f"!{num:08x}"] = node
+
+    def connect(self) -> None:
+        """
+        Announce the connection, as a real interface does once configured
+        """
+        self.isConnected.set()
+        pub.sendMessage("meshtastic.connection.established", interface=self)
+
+    def receive(self, mesh_packet: MeshPacket) -> None:
+        """
+        Handle a packet as if it had just arrived from the radio
+        """
+        self._handlePacketFromRadio(mesh_packet)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every packet received so far has been published
+        """
+        done = threading.Event()
+        publishingThread.queueWork(done.set)
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        """
+        There is no connection to drop, so unlike a real interface closing
+        does not publish `meshtastic.connection.lost`
+        """
+        self.isConnected.clear()
+
+    def _generatePacketId(self) -> int:
+        self.currentPacketId = (self.currentPacketId + 1) & 0xFFFFFFFF
+        return self.currentPacketId
+
+    def _sendPacket(
+        self,
+        meshPacket: MeshPacket,
+        destinationId: Union[int, str] = BROADCAST_ADDR,
+        wantAck: bool = False,
+        hopLimit: Optional[int] = None,
+        pkiEncrypted: Optional[bool] = False,
+        publicKey: Optional[bytes] = None,
+    ) -> MeshPacket:
+        _ = wantAck, hopLimit, pkiEncrypted, publicKey
+        with self._outbound_lock:
+            self.outbound.append(
+                (time.monotonic() - self._started, destinationId, meshPacket)
+            )
+        return meshPacket
+
+
+def mesh_packet_from_row(codec: str, data: Union[str, bytes]) -> Optional[MeshPacket]:
+    """
+    Rebuild the `MeshPacket` of a logged packet, or None if it cannot be
+    """
+    if codec == JSON:
+        return mesh_packet_from_flat_json(data)
+    try:
+        return decode_mesh_packet(codec, data)
+    except (ValueError, DecodeError, zlib.error):
+        return None
+
+
+def outbound_record(destination: Union[int, str], mesh_packet: MeshPacket) -> dict:
+    """
+    The parts of a sent packet that identify the response, for comparing
+    replays
+    """
+    decoded = mesh_packet.decoded
+    return {
+        "to": destination,
+        "channel": mesh_packet.channel,
+        "reply_id": decoded.reply_id or None,
+        "emoji": bool(decoded.emoji),
+        "text": decoded.payload.decode("utf-8", errors="replace"),
+    }
+
+
+def guess_my_node_num(storage: Storage, sample: int = 10000) -> Optional[int]:
+    """
+    The node the log was recorded on is not stored, but is the commonest
+    addressee of direct text messages
+    """
+    addressees: Counter = Counter()
+    for count, (_, _, codec, data) in enumerate(storage.iter_packet_rows()):
+        if count >= sample:
+            break
+        mesh_packet = mesh_packet_from_row(codec, data)
+        if (
+            mesh_packet is not None
+            and mesh_packet.decoded.portnum == PortNum.TEXT_MESSAGE_APP
+            and mesh_packet.to not in (0, BROADCAST_NUM)
+        ):
+            addressees[mesh_packet.to] += 1
+    if not addressees:
+        return None
+    return addressees.most_common(1)[0][0]
+
+
+class PacketReplayer:
+    """
+    Feeds the packet log of `storage` to a `ReplayInterface`. A `speed` of
+    1 keeps the logged gaps between packets, 10 replays ten times faster and
+    0 does not wait at all.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        interface: ReplayInterface,
+        speed: float = 1.0,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.storage = storage
+        self.interface = interface
+        self.speed = speed
+        self.sleep = sleep
+        self.replayed = 0
+        self.skipped = 0
+
+    def run(self, after_id: int = 0, limit: Optional[int] = None) -> None:
+        """
+        Replay the packets logged after `after_id`, at most `limit` of them,
+        and wait until they have all been handled
+        """
+        started = time.monotonic()
+        first_timestamp = None
+        for _, timestamp, codec, data in self.storage.iter_packet_rows(after_id):
+            if limit is not None and self.replayed + self.skipped >= limit:
+                break
+            mesh_packet = mesh_packet_from_row(codec, data)
+            if mesh_packet is None:
+                self.skipped += 1
+                continue
+            if self.speed > 0:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                due = started + (timestamp - first_timestamp) / 1e6 / self.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self.sleep(delay)
+            self.interface.receive(mesh_packet)
+            self.replayed += 1
+        self.interface.drain()
+
+
+def replay(
+    source: Storage,
+    target: Storage,
+    my_node_num: int,
+    speed: float = 1.0,
+    after_id: int = 0,
+    limit: Optional[int] = None,
+    workers: int = 0,
+) -> dict:
+    """
+    Replay the packet log of `source` through a bot using `target` for its
+    own state, and report what it sent back. The bot starts with the nodes
+    `source` last knew about.
+    """
+    interface = ReplayInterface(
+        my_node_num,
+        (unflatten_dict(node) for node in source.iter_node_states()),
+    )
+    writer = BatchWriter(target)
+    delivery = MailDelivery(target)
+    hops = Hops(target, delivery=delivery)
+    # Admin commands would act on the machine running the replay, and
+    # `.status` would report on it, so the replayed bot has no admin
+    hops.admin_user_id = None
+    dispatcher = None
+    if workers > 0:
+        dispatcher = CommandDispatcher(hops.on_message, workers=workers)
+    # pubsub only holds weak references to the client's handlers
+    client = Client(
+        interface, hops, target, writer, dispatcher=dispatcher, delivery=delivery
+    )
+    replayer = PacketReplayer(source, interface, speed)
+
+    started = time.monotonic()
+    try:
+        interface.connect()
+        replayer.run(after_id, limit)
+    finally:
+        if dispatcher is not None:
+            dispatcher.close(wait=True)
+        writer.close()
+        interface.close()
+    elapsed = time.monotonic() - started
+    _ = client
+    logging.info("Replayed %d packets in %.1fs", replayer.replayed, elapsed)
+
+    return {
+        "replayed": replayer.replayed,
+        "skipped": replayer.skipped,
+        "seconds": round(elapsed, 3),
+        "packets_per_second": (
+            round(replayer.replayed / elapsed, 1) if elapsed else None
+        ),
+        "rows_dropped": writer.dropped,
+        "commands": {
+            command: {
+                "count": count,
+                "mean_ms": round(mean * 1000, 3),
+                "max_ms": round(slowest * 1000, 3),
+            }
+            for command, (count, mean, slowest) in hops.sampler.latencies().items()
+        },
+        "outbound": [
+            outbound_record(destination, mesh_packet)
+            for _, destination, mesh_packet in interface.outbound
+        ],
+    }
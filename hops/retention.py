@@ -0,0 +1,155 @@
+"""
+Retention of the high volume `packets` and `node_changes` logs.
+
+Each table gets a `RetentionPolicy` limiting the age and/or number of rows it
+keeps. `Pruner` applies the policies periodically on a background thread in
+the bot, if it was asked to with `--prune-interval`, and `barley prune`
+applies them once from the command line. Rows are
+deleted in small batches, each in its own short transaction, and the freed
+pages are handed back to the filesystem with incremental vacuuming, so
+pruning never stalls live packet ingest.
+"""
+
+import argparse
+import logging
+import threading
+from typing import Dict, NamedTuple, Optional, Sequence
+from .storage import PRUNABLE_TABLES
+
+
+class RetentionPolicy(NamedTuple):
+    """
+    Limits for a single table. A limit of None is not applied.
+    """
+
+    table: str
+    max_age_days: Optional[float] = None
+    max_rows: Optional[int] = None
+
+
+DEFAULT_POLICIES = (
+    RetentionPolicy("packets", max_age_days=30, max_rows=1_000_000),
+    RetentionPolicy("node_changes", max_age_days=90),
+)
+
+
+def add_retention_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the per-table retention limits to a command line parser
+    """
+    defaults = {policy.table: policy for policy in DEFAULT_POLICIES}
+    for table in PRUNABLE_TABLES:
+        policy = defaults.get(table, RetentionPolicy(table))
+        flag = table.replace("_", "-")
+        parser.add_argument(
+            f"--{flag}-max-age-days",
+            type=float,
+            default=policy.max_age_days,
+            help=f"Prune {table} rows older than this (default: {policy.max_age_days})",
+        )
+        parser.add_argument(
+            f"--{flag}-max-rows",
+            type=int,
+            default=policy.max_rows,
+            help=f"Keep at most this many {table} rows (default: {policy.max_rows})",
+        )
+
+
+def policies_from_arguments(args: argparse.Namespace) -> Sequence[RetentionPolicy]:
+    """
+    Build the retention policies from the parsed command line
+    """
+    return [
+        RetentionPolicy(
+            table,
+            max_age_days=getattr(args, f"{table}_max_age_days"),
+            max_rows=getattr(args, f"{table}_max_rows"),
+        )
+        for table in PRUNABLE_TABLES
+    ]
+
+
+def apply_policies(
+    storage,
+    policies: Sequence[RetentionPolicy],
+    batch_size: int = 500,
+    pause: float = 0.05,
+    stop: Optional[threading.Event] = None,
+) -> Dict[str, int]:
+    """
+    Prune every table according to its policy, returning the number of rows
+    deleted from each
+    """
+    deleted = {}
+    for policy in policies:
+        deleted[policy.table] = storage.prune(
+            policy.table,
+            max_age_days=policy.max_age_days,
+            max_rows=policy.max_rows,
+            batch_size=batch_size,
+            pause=pause,
+            stop=stop,
+        )
+    storage.incremental_vacuum(pause=pause, stop=stop)
+    return deleted
+
+
+class Pruner:
+    """
+    Background thread which applies the retention policies every `interval`
+    seconds
+    """
+
+    def __init__(
+        self,
+        storage,
+        policies: Sequence[RetentionPolicy] = DEFAULT_POLICIES,
+        interval: float = 3600.0,
+        batch_size: int = 500,
+        pause: float = 0.05,
+    ):
+        self.storage = storage
+        self.policies = policies
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.deleted: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="hops-pruner", daemon=True
+        )
+
+    def start(self) -> None:
+        """
+        Start pruning in the background
+        """
+        self._thread.start()
+
+    def close(self) -> None:
+        """
+        Stop pruning, abandoning any batches still to go
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def run_once(self) -> Dict[str, int]:
+        """
+        Apply the retention policies now
+        """
+        deleted = apply_policies(
+            self.storage, self.policies, self.batch_size, self.pause, self._stop
+        )
+        for table, count in deleted.items():
+            self.deleted[table] = self.deleted.get(table, 0) + count
+        if any(deleted.values()):
+            logging.info("Pruned %s", deleted)
+        return deleted
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Pruning failed")
+            self._stop.wait(self.interval)
@@ -0,0 +1,200 @@
+"""
+This module provides the `AsyncRuntime` class, an optional asyncio event loop
+hosting the bot.
+
+meshtastic publishes its events on its own threads; the runtime bridges them
+into the loop with `call_soon_threadsafe`. Commands are handled as tasks, with
+the blocking parts (database I/O, subprocesses) run in an executor and command
+handlers free to be coroutines. The loop also hosts periodic jobs such as
+pruning and shuts everything down cleanly on SIGTERM or SIGINT.
+"""
+
+import asyncio
+import inspect
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from .dispatch import DeadlineClient
+
+
+class AsyncRuntime:
+    """
+    Event loop running command handlers and periodic jobs.
+
+    `submit` has the same signature as `CommandDispatcher.submit`, so the
+    runtime can be handed to `Client` as its dispatcher. Commands from one
+    sender run in order, at most `max_pending` wait at once and each has
+    `timeout` seconds to finish.
+    """
+
+    def __init__(
+        self,
+        handler: Callable,
+        workers: int = 4,
+        max_pending: int = 64,
+        timeout: float = 30.0,
+    ):
+        self.handler = handler
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="hops-async"
+        )
+        self.loop.set_default_executor(self.executor)
+        self._periodic: List[Tuple[str, float, Callable]] = []
+        # Per-sender lock and the number of commands holding or awaiting it
+        self._lanes: Dict[Hashable, Tuple[asyncio.Lock, int]] = {}
+        self._counter_lock = threading.Lock()
+        self._tasks: set = set()
+        self._stopping: Optional[asyncio.Event] = None
+        self._stop_requested = False
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        Snapshot of the command counters
+        """
+        return {
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+    def every(self, interval: float, job: Callable, name: Optional[str] = None):
+        """
+        Run `job` every `interval` seconds while the runtime is running. A
+        coroutine function is awaited on the loop, anything else is run in the
+        executor.
+        """
+        self._periodic.append((name or job.__name__, interval, job))
+
+    def call_soon(self, callback: Callable, *args) -> None:
+        """
+        Schedule `callback(*args)` on the loop from any thread
+        """
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def submit(self, sender: Hashable, coordinates, message: str, client) -> bool:
+        """
+        Queue a command from any thread. Returns False if it was shed.
+        """
+        with self._counter_lock:
+            if self.pending >= self.max_pending:
+                self.shed += 1
+                logging.warning("Command queue full, shedding %s", sender)
+                return False
+            self.pending += 1
+        self.call_soon(self._spawn, sender, coordinates, message, client)
+        return True
+
+    def run(self) -> None:
+        """
+        Run until `stop` is called or a termination signal arrives
+        """
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.executor.shutdown(wait=False)
+            self.loop.close()
+
+    def stop(self) -> None:
+        """
+        Ask the runtime to shut down, from any thread
+        """
+        self._stop_requested = True
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._request_stop)
+
+    def _request_stop(self) -> None:
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def _main(self) -> None:
+        self._stopping = asyncio.Event()
+        if self._stop_requested:
+            self._stopping.set()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self.loop.add_signal_handler(signum, self._request_stop)
+            except (NotImplementedError, RuntimeError):
+                # Not on the main thread, or not supported on this platform
+                pass
+        periodic = [
+            asyncio.create_task(self._every(name, interval, job), name=name)
+            for name, interval, job in self._periodic
+        ]
+        await self._stopping.wait()
+        logging.info("Shutting down")
+        for task in periodic + list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*periodic, *self._tasks, return_exceptions=True)
+
+    async def _every(self, name: str, interval: float, job: Callable) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._call(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Periodic job %s failed", name)
+
+    async def _call(self, function: Callable, *args):
+        if inspect.iscoroutinefunction(function):
+            return await function(*args)
+        result = await self.loop.run_in_executor(None, function, *args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def _spawn(self, sender: Hashable, coordinates, message: str, client) -> None:
+        task = self.loop.create_task(self._handle(sender, coordinates, message, client))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, sender: Hashable, coordinates, message: str, client):
+        lock, users = self._lanes.get(sender, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._lanes[sender] = (lock, users + 1)
+        try:
+            async with lock:
+                with self._counter_lock:
+                    self.pending -= 1
+                await self._run_command(sender, coordinates, message, client)
+        finally:
+            lock, users = self._lanes[sender]
+            if users == 1:
+                del self._lanes[sender]
+            else:
+                self._lanes[sender] = (lock, users - 1)
+
+    async def _run_command(self, sender, coordinates, message: str, client):
+        # A handler running in the executor cannot be interrupted, so its late
+        # responses are dropped instead
+        client = DeadlineClient(client, sender, time.monotonic() + self.timeout)
+        try:
+            await asyncio.wait_for(
+                self._call(self.handler, coordinates, message, client), self.timeout
+            )
+            self.completed += 1
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            logging.warning("Command from %s timed out after %ss", sender, self.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # pylint: disable=broad-except
+            self.failed += 1
+            logging.exception("Command from %s failed", sender)
@@ -0,0 +1,194 @@
+"""
+This module provides the `SendScheduler` class, which paces outbound packets
+so that the bot stays inside the LoRa duty cycle.
+
+Handlers enqueue their replies and return immediately. A transmit thread sends
+them in priority order, round-robin across destinations within a priority so
+that one long `.bbs` reply cannot starve everybody else, and only once a token
+bucket measured in seconds of airtime can afford the packet. Replies queued
+for the same destination are coalesced into a single packet when they fit.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Hashable, Optional
+from .packing import MAX_PAYLOAD, SEPARATOR, byte_length
+
+HIGH = 0
+NORMAL = 1
+LOW = 2
+PRIORITIES = (HIGH, NORMAL, LOW)
+
+
+class Outbound:
+    """
+    A reply waiting to be transmitted
+    """
+
+    __slots__ = ("message", "coordinates", "destination", "coalesce")
+
+    def __init__(
+        self, message: str, coordinates, destination: Hashable, coalesce: bool
+    ):
+        self.message = message
+        self.coordinates = coordinates
+        self.destination = destination
+        self.coalesce = coalesce
+
+
+class SendScheduler:
+    """
+    Priority queue of outbound replies drained through an airtime token bucket.
+
+    `airtime_per_byte` and `packet_overhead` estimate how long a packet keeps
+    the channel busy, `duty_cycle` is the fraction of time the bot may
+    transmit and `burst` is how many seconds of airtime can be saved up.
+    """
+
+    def __init__(
+        self,
+        airtime_per_byte: float = 0.0075,
+        packet_overhead: int = 32,
+        duty_cycle: float = 0.1,
+        burst: float = 10.0,
+        max_payload: int = MAX_PAYLOAD,
+        max_queue: int = 256,
+    ):
+        if not 0 < duty_cycle <= 1:
+            raise ValueError(f"Duty cycle must be above 0 and at most 1: {duty_cycle}")
+        self.airtime_per_byte = airtime_per_byte
+        self.packet_overhead = packet_overhead
+        self.duty_cycle = duty_cycle
+        self.burst = burst
+        self.max_payload = max_payload
+        self.max_queue = max_queue
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._queues: Dict[int, "OrderedDict[Hashable, Deque[Outbound]]"] = {
+            priority: OrderedDict() for priority in PRIORITIES
+        }
+        self._depth = 0
+        self._tokens = burst
+        self._refilled = time.monotonic()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._transmit: Optional[Callable[[str, object], None]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def depth(self) -> int:
+        """
+        Number of packets waiting to be transmitted
+        """
+        return self._depth
+
+    def start(self, transmit: Callable[[str, object], None]) -> None:
+        """
+        Start transmitting queued replies with `transmit(message, coordinates)`
+        """
+        self._transmit = transmit
+        self._thread = threading.Thread(
+            target=self._run, name="hops-sender", daemon=True
+        )
+        self._thread.start()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        Stop transmitting. Anything still queued is discarded.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def airtime(self, message: str) -> float:
+        """
+        Estimated seconds of airtime needed to send `message`
+        """
+        return (len(message.encode("utf-8")) + self.packet_overhead) * (
+            self.airtime_per_byte
+        )
+
+    def enqueue(
+        self,
+        message: str,
+        coordinates,
+        destination: Hashable,
+        priority: int = NORMAL,
+        coalesce: bool = True,
+    ) -> bool:
+        """
+        Queue a reply for `destination`. If the last reply queued for the same
+        destination and priority can be coalesced with it and the two fit in
+        one packet, they are merged. Returns False if the queue was full.
+        """
+        with self._condition:
+            lanes = self._queues[priority]
+            lane = lanes.get(destination)
+            if coalesce and lane:
+                last = lane[-1]
+                merged = f"{last.message}{SEPARATOR}{message}"
+                if last.coalesce and byte_length(merged) <= self.max_payload:
+                    last.message = merged
+                    self.coalesced += 1
+                    return True
+            if self._depth >= self.max_queue:
+                self.dropped += 1
+                logging.warning("Send queue full, dropping reply to %s", destination)
+                return False
+            if lane is None:
+                lane = lanes[destination] = deque()
+            lane.append(Outbound(message, coordinates, destination, coalesce))
+            self._depth += 1
+            self._condition.notify_all()
+        return True
+
+    def _pop(self) -> Optional[Outbound]:
+        # Highest priority first, then round-robin over the destinations
+        for priority in PRIORITIES:
+            lanes = self._queues[priority]
+            if not lanes:
+                continue
+            destination, lane = next(iter(lanes.items()))
+            outbound = lane.popleft()
+            if lane:
+                lanes.move_to_end(destination)
+            else:
+                del lanes[destination]
+            self._depth -= 1
+            return outbound
+        return None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._refilled) * self.duty_cycle
+        )
+        self._refilled = now
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed and self._depth == 0:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                outbound = self._pop()
+                # A packet larger than the whole bucket waits for a full bucket
+                cost = min(self.airtime(outbound.message), self.burst)
+                self._refill()
+                while not self._closed and self._tokens < cost:
+                    self._condition.wait((cost - self._tokens) / self.duty_cycle)
+                    self._refill()
+                if self._closed:
+                    return
+                self._tokens -= cost
+            try:
+                self._transmit(outbound.message, outbound.coordinates)
+                self.sent += 1
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to send reply to %s", outbound.destination)
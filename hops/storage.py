@@ -2,11 +2,70 @@
 This module provides the `Storage` class for interacting with a SQLite database.
 It supports logging received messages, inserting BBS entries, and reading BBS messages.
 
+A single long-lived connection is shared by every call site. The database runs
+in WAL mode so that readers in other processes (such as the CLI tools) do not
+block the bot's writer, and so that commits do not need a full fsync when
+`synchronous` is relaxed to NORMAL.
 """
 
+import json
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from .metrics import REGISTRY
+from .migrations import migrate
+from .packet_codec import (
+    JSON,
+    PROTOBUF,
+    decode_packet,
+    encode_mesh_packet,
+    mesh_packet_from_flat_json,
+)
+from .util import changed_fields
+
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+PRUNABLE_TABLES = ("packets", "node_changes")
+NODE_SUMMARY_COLUMNS = ", ".join(
+    f"node_latest.{column}"
+    for column in (
+        "node_id",
+        "node_num",
+        "short_name",
+        "long_name",
+        "hw_model",
+        "last_heard",
+    )
+)
+
+
+MICROSECONDS_PER_DAY = 86_400_000_000
+BBS_WINDOW_DAYS = 28
+
+DB_COMMIT_SECONDS = REGISTRY.histogram(
+    "hops_db_commit_seconds", "Time taken to commit a database transaction"
+)
+
+
+def timestamp_now() -> int:
+    """
+    Timestamp for a row created now, in microseconds since the epoch
+    """
+    return time.time_ns() // 1000
+
+
+def _compact_json(value) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def timestamp_to_iso(timestamp: int) -> str:
+    """
+    Render a row timestamp as a local ISO 8601 string
+    """
+    return datetime.fromtimestamp(timestamp / 1_000_000).isoformat()
 
 
 class Storage:
@@ -15,103 +74,483 @@ class Storage:
     to store and retrieve logs, bulletin board system (BBS) messages, and general messages.
     """
 
-    def __init__(self, db_filename):
+    def __init__(
+        self,
+        db_filename,
+        synchronous: str = "NORMAL",
+        cached_statements: int = 64,
+        busy_timeout: float = 5.0,
+        migration_batch_size: int = 1000,
+    ):
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Invalid synchronous level: {synchronous}")
         self.db_filename = db_filename
+        self.synchronous = synchronous
+        self.migration_batch_size = migration_batch_size
+        self._lock = threading.RLock()
+        # Bumped after every change to the board made through this connection
+        self._bbs_generation = 0
+        self._conn = sqlite3.connect(
+            db_filename,
+            timeout=busy_timeout,
+            check_same_thread=False,
+            cached_statements=cached_statements,
+        )
+        # Only takes effect on a new database, existing databases are
+        # converted by a full `vacuum`
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
         self._initialize_database()
 
+    def close(self):
+        """
+        Close the shared connection
+        """
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Yield a cursor on the shared connection, holding the lock for the
+        duration and committing (or rolling back) on exit. Statements are
+        compiled once and reused from the connection's statement cache.
+        """
+        with self._lock:
+            with self._conn:
+                yield self._conn.cursor()
+                started = time.perf_counter()
+            DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
     def _initialize_database(self):
-        with sqlite3.connect(self.db_filename) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS packets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME UNIQUE NOT NULL,
-                    packet_json TEXT NOT NULL
-                )
-            """
-            )
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS nodes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME UNIQUE NOT NULL,
-                    node_id TEXT NOT NULL,
-                    node_json TEXT NOT NULL
-                )
-            """
-            )
+        with self._lock:
+            migrate(self._conn, self.migration_batch_size)
+
+    def log_packet(self, packet: Union[str, bytes], codec: str = JSON):
+        """
+        Log a received packet, encoded with `packet_codec.encode_packet`
+        """
+        now = timestamp_now()
+        with self._transaction() as cursor:
             cursor.execute(
                 """
-                CREATE TABLE IF NOT EXISTS bbs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME UNIQUE NOT NULL,
-                    from_id TEXT NOT NULL,
-                    from_short_name TEXT,
-                    from_long_name TEXT,
-                    message TEXT NOT NULL
-                )
-            """
+                INSERT INTO packets
+                    (timestamp, codec, packet)
+                VALUES
+                    (?, ?, ?)
+            """,
+                (now, codec, packet),
             )
-            cursor.execute(
+
+    def log_packets(self, rows: Iterable[Tuple[int, str, Union[str, bytes]]]):
+        """
+        Log a batch of `(timestamp, codec, packet)` rows in one transaction
+        """
+        with self._transaction() as cursor:
+            cursor.executemany(
                 """
-                CREATE INDEX IF NOT EXISTS idx_bbs_timestamp
-                ON bbs (timestamp)
-            """
+                INSERT INTO packets
+                    (timestamp, codec, packet)
+                VALUES
+                    (?, ?, ?)
+            """,
+                rows,
             )
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME UNIQUE NOT NULL,
-                    from_id TEXT NOT NULL,
-                    from_short_name TEXT,
-                    from_long_name TEXT,
-                    to_id TEXT NOT NULL,
-                    message TEXT NOT NULL
+
+    def iter_packet_rows(
+        self, after_id: int = 0, batch_size: int = 500
+    ) -> Iterator[Tuple[int, int, str, Union[str, bytes]]]:
+        """
+        Stream logged packets in id order as stored, i.e. as
+        `(id, timestamp, codec, packet)`. The lock is only held while each
+        batch is fetched.
+        """
+        while True:
+            with self._transaction() as cursor:
+                rows = cursor.execute(
+                    """
+                    SELECT id, timestamp, codec, packet
+                    FROM packets
+                    WHERE id > ?
+                    ORDER BY id
+                    LIMIT ?
+                """,
+                    (after_id, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            after_id = rows[-1][0]
+
+    def iter_packets(self, after_id: int = 0, batch_size: int = 500) -> Iterator[dict]:
+        """
+        Stream logged packets in id order, decoded back into dictionaries.
+        The lock is only held while each batch is fetched.
+        """
+        for row_id, timestamp, codec, packet in self.iter_packet_rows(
+            after_id, batch_size
+        ):
+            yield {
+                "id": row_id,
+                "timestamp": timestamp,
+                "packet": decode_packet(codec, packet),
+            }
+
+    def compact_packets(
+        self, codec: str = PROTOBUF, batch_size: int = 500
+    ) -> Tuple[int, int]:
+        """
+        One-shot migration of legacy flattened JSON rows. Rows which can be
+        rebuilt into a `MeshPacket` are re-encoded with `codec`, the rest are
+        rewritten as compact JSON. Each batch is committed separately so the
+        write lock is never held for long. Returns the number of rows
+        converted and the number rewritten as JSON.
+        """
+        converted = 0
+        rewritten = 0
+        after_id = 0
+        while True:
+            with self._transaction() as cursor:
+                rows = cursor.execute(
+                    """
+                    SELECT id, packet
+                    FROM packets
+                    WHERE id > ? AND codec = ?
+                    ORDER BY id
+                    LIMIT ?
+                """,
+                    (after_id, JSON, batch_size),
+                ).fetchall()
+                if not rows:
+                    return converted, rewritten
+                updates = []
+                for row_id, packet in rows:
+                    mesh_packet = mesh_packet_from_flat_json(packet)
+                    if mesh_packet is not None and codec != JSON:
+                        updates.append(
+                            (codec, encode_mesh_packet(mesh_packet, codec), row_id)
+                        )
+                        converted += 1
+                    else:
+                        try:
+                            compact = json.dumps(
+                                json.loads(packet),
+                                separators=(",", ":"),
+                                ensure_ascii=False,
+                            )
+                        except ValueError:
+                            continue
+                        if compact != packet:
+                            updates.append((JSON, compact, row_id))
+                            rewritten += 1
+                cursor.executemany(
+                    "UPDATE packets SET codec = ?, packet = ? WHERE id = ?",
+                    updates,
                 )
-            """
-            )
-            cursor.execute(
-                """
-                CREATE INDEX IF NOT EXISTS idx_messages_to_id_timestamp
-                ON messages (to_id, timestamp)
-            """
-            )
-            conn.commit()
+                after_id = rows[-1][0]
 
-    def log_packet(self, packet_json: str):
+    def log_node(self, node_id: str, node: dict):
         """
-        Log a received packet
+        Record the current state of a node, as a flattened node dictionary
         """
-        now = datetime.now().isoformat()
-        with sqlite3.connect(self.db_filename) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+        self.log_nodes([(timestamp_now(), node_id, node)])
+
+    def log_nodes(self, rows: Iterable[Tuple[int, str, dict]]) -> int:
+        """
+        Record a batch of `(timestamp, node_id, node)` observations in one
+        transaction. `node_latest` is upserted with the new state and only the
+        fields that changed are appended to `node_changes`, so re-reporting an
+        unchanged node writes nothing. Returns the number of changed nodes.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self._transaction() as cursor:
+            latest = self._read_node_latest(cursor, {row[1] for row in rows})
+            upserts = {}
+            changes = []
+            for timestamp, node_id, node in rows:
+                difference = changed_fields(latest.get(node_id), node)
+                if not difference:
+                    continue
+                latest[node_id] = node
+                changes.append((timestamp, node_id, _compact_json(difference)))
+                last_heard = node.get("lastHeard")
+                upserts[node_id] = (
+                    node_id,
+                    node.get("num"),
+                    node.get("user.shortName"),
+                    node.get("user.longName"),
+                    node.get("user.hwModel"),
+                    last_heard * 1_000_000 if last_heard is not None else None,
+                    timestamp,
+                    _compact_json(node),
+                )
+            cursor.executemany(
                 """
-                INSERT INTO packets
-                    (timestamp, packet_json)
+                INSERT INTO node_latest
+                    (node_id, node_num, short_name, long_name, hw_model,
+                     last_heard, updated, node_json)
                 VALUES
-                    (?, ?)
+                    (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (node_id) DO UPDATE SET
+                    node_num = excluded.node_num,
+                    short_name = excluded.short_name,
+                    long_name = excluded.long_name,
+                    hw_model = excluded.hw_model,
+                    last_heard = excluded.last_heard,
+                    updated = excluded.updated,
+                    node_json = excluded.node_json
             """,
-                (now, packet_json),
+                upserts.values(),
             )
-            conn.commit()
-
-    def log_node(self, node_id: str, node_json: str):
-        now = datetime.now().isoformat()
-        with sqlite3.connect(self.db_filename) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+            cursor.executemany(
                 """
-                INSERT INTO nodes
-                    (timestamp, node_id, node_json)
+                INSERT INTO node_changes
+                    (timestamp, node_id, changes_json)
                 VALUES
                     (?, ?, ?)
             """,
-                (now, node_id, node_json),
+                changes,
             )
-            conn.commit()
+        return len(changes)
+
+    def node_read(self, node_id: str) -> Optional[dict]:
+        """
+        The latest known state of a node
+        """
+        with self._transaction() as cursor:
+            cursor.execute("SELECT * FROM node_latest WHERE node_id = ?", (node_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            columns = [column[0] for column in cursor.description]
+            result = dict(zip(columns, row))
+            result["node"] = json.loads(result.pop("node_json"))
+            return result
+
+    def node_read_by_num(self, node_num: int) -> Optional[dict]:
+        """
+        The latest known state of a node, by node number
+        """
+        with self._transaction() as cursor:
+            row = cursor.execute(
+                "SELECT node_id FROM node_latest WHERE node_num = ?", (node_num,)
+            ).fetchone()
+        return self.node_read(row[0]) if row is not None else None
+
+    def nodes_search(self, needle: str, limit: int = 50) -> List[dict]:
+        """
+        Find nodes by the words (or word prefixes) of their long name, short
+        name or hardware model, best matches first. Needles without any word
+        characters, such as emoji short names, are matched exactly against
+        the names instead.
+        """
+        words = re.findall(r"\w+", needle)
+        with self._transaction() as cursor:
+            if words:
+                query = " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+                cursor.execute(
+                    f"""
+                    SELECT {NODE_SUMMARY_COLUMNS}
+                    FROM node_fts
+                    JOIN node_latest ON node_latest.rowid = node_fts.rowid
+                    WHERE node_fts MATCH ?
+                    ORDER BY rank
+                    LIMIT ?
+                """,
+                    (query, limit),
+                )
+            else:
+                cursor.execute(
+                    f"""
+                    SELECT {NODE_SUMMARY_COLUMNS}
+                    FROM node_latest
+                    WHERE short_name = ?1 OR long_name = ?1
+                    LIMIT ?2
+                """,
+                    (needle.strip(), limit),
+                )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def iter_nodes(self, batch_size: int = 500) -> Iterator[dict]:
+        """
+        Stream a summary of every node, most recently heard first and nodes
+        never heard last. Rows are fetched in keyset-paginated batches so
+        memory use stays constant and the lock is only held while each batch
+        is fetched.
+        """
+        heard = (
+            f"""
+            SELECT {NODE_SUMMARY_COLUMNS}
+            FROM node_latest
+            WHERE last_heard < ?1 OR (last_heard = ?1 AND node_id > ?2)
+            ORDER BY last_heard DESC, node_id
+            LIMIT ?3
+        """,
+            [2**63 - 1, ""],
+        )
+        never_heard = (
+            f"""
+            SELECT {NODE_SUMMARY_COLUMNS}
+            FROM node_latest
+            WHERE last_heard IS NULL AND node_id > ?2
+            ORDER BY node_id
+            LIMIT ?3
+        """,
+            [None, ""],
+        )
+        for query, position in (heard, never_heard):
+            while True:
+                with self._transaction() as cursor:
+                    cursor.execute(query, (*position, batch_size))
+                    columns = [column[0] for column in cursor.description]
+                    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                yield from rows
+                if len(rows) < batch_size:
+                    break
+                position = [rows[-1]["last_heard"], rows[-1]["node_id"]]
+
+    def iter_node_states(self, batch_size: int = 500) -> Iterator[dict]:
+        """
+        Stream the latest state of every node as the flattened node
+        dictionary it was logged as, in node id order
+        """
+        node_id = ""
+        while True:
+            with self._transaction() as cursor:
+                rows = cursor.execute(
+                    """
+                    SELECT node_id, node_json
+                    FROM node_latest
+                    WHERE node_id > ?
+                    ORDER BY node_id
+                    LIMIT ?
+                """,
+                    (node_id, batch_size),
+                ).fetchall()
+            for _, node_json in rows:
+                yield json.loads(node_json)
+            if len(rows) < batch_size:
+                return
+            node_id = rows[-1][0]
+
+    @staticmethod
+    def _read_node_latest(
+        cursor: sqlite3.Cursor, node_ids: Set[str]
+    ) -> Dict[str, dict]:
+        latest = {}
+        node_ids = list(node_ids)
+        for start in range(0, len(node_ids), 500):
+            chunk = node_ids[start : start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            for node_id, node_json in cursor.execute(
+                f"SELECT node_id, node_json FROM node_latest "
+                f"WHERE node_id IN ({placeholders})",
+                chunk,
+            ):
+                latest[node_id] = json.loads(node_json)
+        return latest
+
+    def prune(
+        self,
+        table: str,
+        max_age_days: Optional[float] = None,
+        max_rows: Optional[int] = None,
+        batch_size: int = 500,
+        pause: float = 0.0,
+        stop: Optional[threading.Event] = None,
+    ) -> int:
+        """
+        Delete rows older than `max_age_days` and all but the newest
+        `max_rows` rows from one of the log tables. Rows are deleted
+        `batch_size` at a time, each batch in its own transaction, sleeping
+        `pause` seconds in between so that other writers get a turn. Returns
+        the number of rows deleted.
+        """
+        if table not in PRUNABLE_TABLES:
+            raise ValueError(f"Table cannot be pruned: {table}")
+
+        with self._transaction() as cursor:
+            newest_to_delete = 0
+            if max_age_days is not None:
+                cutoff = timestamp_now() - int(max_age_days * MICROSECONDS_PER_DAY)
+                row = cursor.execute(
+                    f"SELECT MAX(id) FROM {table} WHERE timestamp < ?", (cutoff,)
+                ).fetchone()
+                newest_to_delete = max(newest_to_delete, row[0] or 0)
+            if max_rows is not None:
+                row = cursor.execute(
+                    f"SELECT id FROM {table} ORDER BY id DESC LIMIT 1 OFFSET ?",
+                    (max_rows,),
+                ).fetchone()
+                if row is not None:
+                    newest_to_delete = max(newest_to_delete, row[0])
+
+        deleted = 0
+        while newest_to_delete and not (stop is not None and stop.is_set()):
+            with self._transaction() as cursor:
+                count = cursor.execute(
+                    f"""
+                    DELETE FROM {table}
+                    WHERE id IN (
+                        SELECT id FROM {table} WHERE id <= ? ORDER BY id LIMIT ?
+                    )
+                """,
+                    (newest_to_delete, batch_size),
+                ).rowcount
+            deleted += count
+            if count < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+        return deleted
+
+    def incremental_vacuum(
+        self,
+        pages: int = 256,
+        pause: float = 0.0,
+        stop: Optional[threading.Event] = None,
+    ) -> None:
+        """
+        Return free pages to the filesystem `pages` at a time. Does nothing
+        unless the database uses `auto_vacuum=INCREMENTAL`.
+        """
+        while not (stop is not None and stop.is_set()):
+            with self._transaction() as cursor:
+                free = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+                if free == 0:
+                    return
+                cursor.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+                if cursor.execute("PRAGMA freelist_count").fetchone()[0] >= free:
+                    # Not in incremental mode
+                    return
+            if pause:
+                time.sleep(pause)
+
+    def backup(self, db_filename: str) -> None:
+        """
+        Copy the whole database to `db_filename` while it stays in use
+        """
+        target = sqlite3.connect(db_filename)
+        try:
+            with self._lock:
+                self._conn.backup(target)
+        finally:
+            target.close()
+
+    def vacuum(self) -> None:
+        """
+        Rebuild the whole database. This holds the write lock until it is
+        done, but is only needed once to switch an existing database over to
+        incremental vacuuming.
+        """
+        with self._lock:
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("VACUUM")
 
     def bbs_insert(
         self,
@@ -123,9 +562,8 @@ class Storage:
         """
         Log a received message
         """
-        now = datetime.now().isoformat()
-        with sqlite3.connect(self.db_filename) as conn:
-            cursor = conn.cursor()
+        now = timestamp_now()
+        with self._transaction() as cursor:
             cursor.execute(
                 """
                 INSERT INTO bbs
@@ -141,15 +579,46 @@ class Storage:
                     message,
                 ),
             )
-            conn.commit()
+            post_id = cursor.lastrowid
+        self._bbs_changed()
+        return post_id
+
+    def _bbs_changed(self) -> None:
+        with self._lock:
+            self._bbs_generation += 1
+
+    def bbs_version(self) -> Tuple[int, int]:
+        """
+        A value that changes whenever the board may have changed: a count of
+        the changes made through this connection, together with SQLite's
+        `data_version`, which changes when another connection commits
+        """
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            return self._bbs_generation, data_version
 
     def bbs_read(self):
         """
         Log a received message
         """
-        now = datetime.now().isoformat()
-        with sqlite3.connect(self.db_filename) as conn:
-            cursor = conn.cursor()
+        return self.bbs_page(
+            since=timestamp_now() - BBS_WINDOW_DAYS * MICROSECONDS_PER_DAY
+        )
+
+    def bbs_page(
+        self,
+        before: Optional[Tuple[int, int]] = None,
+        limit: int = 5,
+        since: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        A page of posts, newest first. `before` is the `(timestamp, id)` of
+        the last post of the previous page, so each page is a range scan of
+        the timestamp index however deep it is rather than an OFFSET scan.
+        """
+        if before is None:
+            before = (2**63 - 1, 0)
+        with self._transaction() as cursor:
             cursor.execute(
                 """
                 SELECT
@@ -157,16 +626,80 @@ class Storage:
                 FROM
                     bbs
                 WHERE
-                    timestamp >= datetime(?, '-28 days')
-                ORDER BY timestamp DESC
-                LIMIT 5
+                    (timestamp, id) < (?, ?)
+                    AND timestamp >= ?
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
             """,
-                (now,),
+                (*before, since if since is not None else 0, limit),
             )
             rows = cursor.fetchall()
             columns = [column[0] for column in cursor.description]
-            result = [dict(zip(columns, row)) for row in rows]
-            return result
+            return [dict(zip(columns, row)) for row in rows]
+
+    def iter_bbs(self, batch_size: int = 500) -> Iterator[dict]:
+        """
+        Stream the whole board, oldest first, in keyset-paginated batches
+        """
+        after = (-1, 0)
+        while True:
+            with self._transaction() as cursor:
+                cursor.execute(
+                    """
+                    SELECT
+                        *
+                    FROM
+                        bbs
+                    WHERE
+                        (timestamp, id) > (?, ?)
+                    ORDER BY timestamp, id
+                    LIMIT ?
+                """,
+                    (*after, batch_size),
+                )
+                columns = [column[0] for column in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1]["timestamp"], rows[-1]["id"])
+
+    def bbs_delete(self, post_id: int) -> bool:
+        """
+        Delete a post, returning whether it existed
+        """
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM bbs WHERE id = ?", (post_id,))
+            deleted = cursor.rowcount > 0
+        self._bbs_changed()
+        return deleted
+
+    def bbs_import(
+        self,
+        rows: Iterable[Tuple[Optional[int], str, Optional[str], Optional[str], str]],
+    ) -> int:
+        """
+        Bulk insert `(timestamp, from_id, from_short_name, from_long_name,
+        message)` posts in one transaction. A timestamp of None means now.
+        Returns the number of posts added.
+        """
+        now = timestamp_now()
+        with self._transaction() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO bbs
+                    (timestamp, from_id, from_short_name, from_long_name, message)
+                VALUES
+                    (?, ?, ?, ?, ?)
+            """,
+                (
+                    (timestamp if timestamp is not None else now, *rest)
+                    for timestamp, *rest in rows
+                ),
+            )
+            imported = cursor.rowcount
+        self._bbs_changed()
+        return imported
 
     def messages_insert(
         self,
@@ -179,9 +712,8 @@ class Storage:
         """
         Log a received message
         """
-        now = datetime.now().isoformat()
-        with sqlite3.connect(self.db_filename) as conn:
-            cursor = conn.cursor()
+        now = timestamp_now()
+        with self._transaction() as cursor:
             cursor.execute(
                 """
                 INSERT INTO messages
@@ -191,15 +723,13 @@ class Storage:
             """,
                 (now, from_id, from_short_name, from_long_name, to_id, message),
             )
-            conn.commit()
 
     def messages_read(self, to_id: str):
         """
         Log a received message
         """
-        now = datetime.now().isoformat()
-        with sqlite3.connect(self.db_filename) as conn:
-            cursor = conn.cursor()
+        since = timestamp_now() - 28 * MICROSECONDS_PER_DAY
+        with self._transaction() as cursor:
             cursor.execute(
                 """
                 SELECT
@@ -208,14 +738,105 @@ class Storage:
                     messages
                 WHERE
                     to_id = ?
-                    AND timestamp >= datetime(?, '-28 days')
+                    AND timestamp >= ?
+                ORDER BY timestamp DESC, id DESC
                 LIMIT 5
             """,
                 (
                     to_id,
-                    now,
+                    since,
                 ),
             )
             rows = cursor.fetchall()
             columns = [column[0] for column in cursor.description]
             return [dict(zip(columns, row)) for row in rows]
+
+    def messages_unread(self, to_id: str, limit: int = 5) -> List[dict]:
+        """
+        The newest messages to `to_id` which have not been delivered yet,
+        newest first, read from the partial index of undelivered messages
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    *
+                FROM
+                    messages
+                WHERE
+                    to_id = ?
+                    AND delivered_at IS NULL
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            """,
+                (to_id, limit),
+            )
+            rows = cursor.fetchall()
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in rows]
+
+    def messages_recipients(self) -> List[str]:
+        """
+        The addressees of messages which have not been delivered yet, read
+        from the partial index of undelivered messages
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                """
+                SELECT DISTINCT
+                    to_id
+                FROM
+                    messages
+                WHERE
+                    delivered_at IS NULL
+            """
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def messages_page(
+        self,
+        to_id: str,
+        before: Optional[Tuple[int, int]] = None,
+        limit: int = 5,
+    ) -> List[dict]:
+        """
+        A page of all the messages to `to_id`, delivered or not, newest
+        first. `before` is the `(timestamp, id)` of the last message of the
+        previous page, as for `bbs_page`.
+        """
+        if before is None:
+            before = (2**63 - 1, 0)
+        with self._transaction() as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    *
+                FROM
+                    messages
+                WHERE
+                    to_id = ?
+                    AND (timestamp, id) < (?, ?)
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            """,
+                (to_id, *before, limit),
+            )
+            rows = cursor.fetchall()
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in rows]
+
+    def messages_mark_delivered(self, message_ids: Iterable[int]) -> int:
+        """
+        Record that messages have been sent to their addressee, returning
+        how many had not been delivered before
+        """
+        now = timestamp_now()
+        with self._transaction() as cursor:
+            cursor.executemany(
+                """
+                UPDATE messages SET delivered_at = ?
+                WHERE id = ? AND delivered_at IS NULL
+            """,
+                ((now, message_id) for message_id in message_ids),
+            )
+            return cursor.rowcount
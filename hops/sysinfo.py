@@ -0,0 +1,271 @@
+"""
+This module provides the `SystemSampler` class, which collects the figures
+reported by `.status` without starting any processes.
+
+Host figures are read straight from `/proc` and the network interfaces, and
+cached for a few seconds so a burst of `.status` requests reads them once.
+Bot figures (packets per minute, database size, queue depths and command
+latencies) are recorded by the bot as it runs or read from registered sources.
+"""
+
+import fcntl
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+# ioctl returning the IPv4 address of a network interface
+SIOCGIFADDR = 0x8915
+
+
+def format_uptime(seconds: float) -> str:
+    """
+    Format a duration the way `uptime -p` does
+    """
+    minutes = int(seconds // 60)
+    parts = []
+    for unit, length in (("week", 10080), ("day", 1440), ("hour", 60)):
+        if minutes >= length:
+            count, minutes = divmod(minutes, length)
+            parts.append(f"{count} {unit}{'s' if count != 1 else ''}")
+    if minutes or not parts:
+        parts.append(f"{minutes} minute{'s' if minutes != 1 else ''}")
+    return "up " + ", ".join(parts)
+
+
+def format_bytes(size: float) -> str:
+    """
+    Format a size in bytes with a binary unit
+    """
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+
+class SystemSampler:
+    """
+    Cached snapshot of host and bot figures.
+
+    Host values are re-read at most every `ttl` seconds. Callables registered
+    with `add_source` are evaluated on every snapshot and should be cheap,
+    e.g. reading a queue depth.
+    """
+
+    def __init__(
+        self, ttl: float = 10.0, db_filename: Optional[str] = None, proc="/proc"
+    ):
+        self.ttl = ttl
+        self.db_filename = db_filename
+        self.proc = proc
+        self.sources: Dict[str, Callable[[], object]] = {}
+        self._cache: Dict[str, Tuple[float, object]] = {}
+        # Packets received per second over the last minute
+        self._packets: Deque[List[int]] = deque()
+        # Command name -> (count, total seconds, maximum seconds)
+        self._latencies: Dict[str, Tuple[int, float, float]] = {}
+        self._lock = threading.Lock()
+
+    def add_source(self, name: str, source: Callable[[], object]) -> None:
+        """
+        Report the value returned by `source` in every snapshot
+        """
+        self.sources[name] = source
+
+    def record_packet(self) -> None:
+        """
+        Count a received packet
+        """
+        second = int(time.monotonic())
+        with self._lock:
+            if self._packets and self._packets[-1][0] == second:
+                self._packets[-1][1] += 1
+            else:
+                self._packets.append([second, 1])
+                while self._packets[0][0] <= second - 60:
+                    self._packets.popleft()
+
+    def record_latency(self, command: str, seconds: float) -> None:
+        """
+        Record how long a command took to handle
+        """
+        with self._lock:
+            count, total, slowest = self._latencies.get(command, (0, 0.0, 0.0))
+            self._latencies[command] = (
+                count + 1,
+                total + seconds,
+                max(slowest, seconds),
+            )
+
+    def packets_per_minute(self) -> int:
+        """
+        Number of packets received in the last 60 seconds
+        """
+        cutoff = int(time.monotonic()) - 60
+        with self._lock:
+            return sum(count for second, count in self._packets if second > cutoff)
+
+    def latencies(self) -> Dict[str, Tuple[int, float, float]]:
+        """
+        Count, mean and maximum latency in seconds of each command
+        """
+        with self._lock:
+            return {
+                command: (count, total / count, slowest)
+                for command, (count, total, slowest) in self._latencies.items()
+            }
+
+    def uptime(self) -> Optional[float]:
+        """
+        Seconds since boot
+        """
+        return self._cached("uptime", self._read_uptime)
+
+    def load_average(self) -> Optional[Tuple[float, float, float]]:
+        """
+        The 1, 5 and 15 minute load averages
+        """
+        return self._cached("loadavg", self._read_load_average)
+
+    def memory(self) -> Optional[Tuple[int, int]]:
+        """
+        Available and total memory in bytes
+        """
+        return self._cached("meminfo", self._read_memory)
+
+    def ip_addresses(self) -> List[str]:
+        """
+        IPv4 addresses of the non-loopback interfaces
+        """
+        return self._cached("ip", self._read_ip_addresses) or []
+
+    def db_size(self) -> Optional[int]:
+        """
+        Size in bytes of the database including its write-ahead log
+        """
+        return self._cached("db_size", self._read_db_size)
+
+    def snapshot(self) -> Dict[str, object]:
+        """
+        All figures as a dictionary
+        """
+        snapshot: Dict[str, object] = {
+            "uptime": self.uptime(),
+            "load": self.load_average(),
+            "memory": self.memory(),
+            "ip": self.ip_addresses(),
+            "db_size": self.db_size(),
+            "packets_per_minute": self.packets_per_minute(),
+            "latencies": self.latencies(),
+        }
+        for name, source in self.sources.items():
+            try:
+                snapshot[name] = source()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to sample %s", name)
+                snapshot[name] = None
+        return snapshot
+
+    def render(self) -> str:
+        """
+        The snapshot as the text of a `.status` reply
+        """
+        snapshot = self.snapshot()
+        lines = []
+        uptime = snapshot.pop("uptime")
+        lines.append(
+            f"uptime: {format_uptime(uptime) if uptime is not None else 'N/A'}"
+        )
+        addresses = snapshot.pop("ip")
+        lines.append(f"ip: {addresses[0] if addresses else 'N/A'}")
+        load = snapshot.pop("load")
+        lines.append(
+            f"load: {', '.join(f'{value:.2f}' for value in load) if load else 'N/A'}"
+        )
+        memory = snapshot.pop("memory")
+        if memory is not None:
+            available, total = memory
+            lines.append(f"mem: {format_bytes(available)}/{format_bytes(total)} free")
+        db_size = snapshot.pop("db_size")
+        if db_size is not None:
+            lines.append(f"db: {format_bytes(db_size)}")
+        lines.append(f"pkts/min: {snapshot.pop('packets_per_minute')}")
+        latencies = snapshot.pop("latencies")
+        for name, value in snapshot.items():
+            lines.append(f"{name}: {value if value is not None else 'N/A'}")
+        slowest = sorted(latencies.items(), key=lambda item: item[1][1], reverse=True)
+        if slowest:
+            lines.append(
+                "ms: "
+                + ", ".join(
+                    f"{command} {mean * 1000:.0f}"
+                    for command, (_, mean, _) in slowest[:3]
+                )
+            )
+        return "\n".join(lines)
+
+    def _cached(self, key: str, read: Callable[[], object]):
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached[1]
+        try:
+            value = read()
+        except (OSError, ValueError, IndexError):
+            value = None
+        self._cache[key] = (now, value)
+        return value
+
+    def _read(self, name: str) -> str:
+        with open(os.path.join(self.proc, name), encoding="ascii") as file:
+            return file.read()
+
+    def _read_uptime(self) -> float:
+        return float(self._read("uptime").split()[0])
+
+    def _read_load_average(self) -> Tuple[float, float, float]:
+        fields = self._read("loadavg").split()
+        return float(fields[0]), float(fields[1]), float(fields[2])
+
+    def _read_memory(self) -> Optional[Tuple[int, int]]:
+        values = {}
+        for line in self._read("meminfo").splitlines():
+            name, _, value = line.partition(":")
+            if name in ("MemTotal", "MemAvailable", "MemFree"):
+                values[name] = int(value.split()[0]) * 1024
+        if "MemTotal" not in values:
+            return None
+        available = values.get("MemAvailable", values.get("MemFree", 0))
+        return available, values["MemTotal"]
+
+    def _read_db_size(self) -> Optional[int]:
+        if self.db_filename is None:
+            return None
+        size = os.path.getsize(self.db_filename)
+        wal = self.db_filename + "-wal"
+        if os.path.exists(wal):
+            size += os.path.getsize(wal)
+        return size
+
+    @staticmethod
+    def _read_ip_addresses() -> List[str]:
+        addresses = []
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for _, name in socket.if_nameindex():
+                if name == "lo":
+                    continue
+                request = struct.pack("256s", name.encode("utf-8")[:15])
+                try:
+                    response = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+                except OSError:
+                    # No IPv4 address on this interface
+                    continue
+                address = socket.inet_ntoa(response[20:24])
+                if not address.startswith("127."):
+                    addresses.append(address)
+        return addresses
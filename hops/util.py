@@ -2,7 +2,9 @@
 Utility functions
 """
 
-from typing import TypeVar, Dict, Any, List
+import asyncio
+import inspect
+from typing import TypeVar, Dict, Any, List, Optional
 
 T = TypeVar("T")
 
@@ -42,3 +44,31 @@ def flat_dict(d, parent_key="", sep="."):
         else:
             items[new_key] = v
     return items
+
+
+def complete(result):
+    """
+    Run a coroutine returned by a command handler to completion when the
+    handler was called outside the asyncio runtime
+    """
+    if inspect.iscoroutine(result):
+        return asyncio.run(result)
+    return result
+
+
+def changed_fields(previous: Optional[dict], current: dict) -> dict:
+    """
+    The fields of a flattened dictionary which differ from `previous`, with
+    removed fields mapped to None
+    """
+    if previous is None:
+        return dict(current)
+    changes = {
+        key: value
+        for key, value in current.items()
+        if key not in previous or previous[key] != value
+    }
+    for key in previous:
+        if key not in current:
+            changes[key] = None
+    return changes
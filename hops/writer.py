@@ -0,0 +1,141 @@
+"""
+This module provides the `BatchWriter` class, an asynchronous ingest pipeline
+for the high volume packet and node logs.
+
+Callbacks running on the meshtastic pubsub thread `put` rows onto a bounded
+queue and return immediately. A single writer thread drains the queue and
+group-commits the rows with `executemany` once either `batch_size` rows are
+waiting or `flush_interval` seconds have passed, so a slow fsync never delays
+the handling of the next received packet.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Tuple
+from .metrics import REGISTRY
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+BACKPRESSURE_POLICIES = (DROP_OLDEST, BLOCK)
+
+ROWS_WRITTEN = REGISTRY.counter(
+    "hops_rows_written_total", "Rows written by the batch writer", ["sink"]
+)
+ROWS_DROPPED = REGISTRY.counter(
+    "hops_rows_dropped_total", "Rows dropped by the batch writer", ["sink"]
+)
+
+
+class BatchWriter:
+    """
+    Background writer that group-commits queued rows to `Storage`.
+
+    When the queue is full the `policy` decides what happens to a new row:
+    `drop_oldest` discards the oldest queued row to make room and counts it in
+    `dropped`, `block` makes the caller wait until the writer catches up.
+    """
+
+    def __init__(
+        self,
+        storage,
+        max_queue: int = 10000,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        policy: str = DROP_OLDEST,
+    ):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Invalid back-pressure policy: {policy}")
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.sinks: Dict[str, Callable[[List[Tuple]], None]] = {
+            "packets": storage.log_packets,
+            "nodes": storage.log_nodes,
+        }
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._queue: deque = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="hops-writer", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        """
+        Number of rows waiting to be written
+        """
+        return len(self._queue)
+
+    def put(self, sink: str, row: Tuple) -> bool:
+        """
+        Queue a row for the named sink. Returns False if the row was dropped.
+        """
+        if sink not in self.sinks:
+            raise KeyError(sink)
+        with self._condition:
+            while not self._closed and len(self._queue) >= self.max_queue:
+                if self.policy == BLOCK:
+                    self._condition.wait()
+                else:
+                    dropped_sink, _ = self._queue.popleft()
+                    self.dropped += 1
+                    ROWS_DROPPED.labels(dropped_sink).inc()
+            if self._closed:
+                self.dropped += 1
+                ROWS_DROPPED.labels(sink).inc()
+                return False
+            self._queue.append((sink, row))
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify_all()
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Flush everything still queued and stop the writer thread
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning("Writer did not finish flushing %d rows", self.depth)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and len(self._queue) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._closed and not self._queue:
+                    return
+                count = min(len(self._queue), self.batch_size)
+                batch = [self._queue.popleft() for _ in range(count)]
+                # Wake any producers blocked on a full queue
+                self._condition.notify_all()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Tuple[str, Tuple]]) -> None:
+        grouped: Dict[str, List[Tuple]] = {}
+        for sink, row in batch:
+            grouped.setdefault(sink, []).append(row)
+        for sink, rows in grouped.items():
+            try:
+                self.sinks[sink](rows)
+                self.written += len(rows)
+                ROWS_WRITTEN.labels(sink).inc(len(rows))
+            except Exception:  # pylint: disable=broad-except
+                # A bad row must not stop the writer, or every later row
+                # would be lost
+                self.failed += len(rows)
+                logging.exception("Failed to write %d rows to %s", len(rows), sink)
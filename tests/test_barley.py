@@ -0,0 +1,90 @@
+"""
+Test the barley tools
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from hops.barley import _bbs_import, _bbs_list, _node_reference
+from hops.storage import Storage
+
+
+class TestBbsTools(unittest.TestCase):
+    """
+    Test listing and importing BBS posts
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = Storage(os.path.join(self.directory.name, "source.sqlite"))
+        self.target = Storage(os.path.join(self.directory.name, "target.sqlite"))
+
+    def tearDown(self):
+        self.source.close()
+        self.target.close()
+        self.directory.cleanup()
+
+    def test_list_import_round_trip(self):
+        """
+        Posts read back by `bbs import` are those written by `bbs list`,
+        whatever characters they contain
+        """
+        self.source.bbs_import(
+            [
+                (1_700_000_000_000_000, "!1", "😀", "George", "Plain post"),
+                (1_700_000_001_000_000, "!2", "A|B", None, 'Two\nlines | and "quotes"'),
+                (1_700_000_002_000_000, "!3", None, "Long|Name", "Ends with a pipe|"),
+            ]
+        )
+        listing = io.StringIO()
+        with contextlib.redirect_stdout(listing):
+            _bbs_list(self.source, argparse.Namespace())
+        self.assertIn("\n1|", listing.getvalue())
+        self.assertIn("|😀|George|Plain post\n", listing.getvalue())
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            _bbs_import(
+                self.target,
+                argparse.Namespace(file=io.StringIO(listing.getvalue())),
+            )
+        columns = [
+            "timestamp",
+            "from_id",
+            "from_short_name",
+            "from_long_name",
+            "message",
+        ]
+
+        def posts(storage: Storage) -> list:
+            return [[row[column] for column in columns] for row in storage.iter_bbs()]
+
+        self.assertEqual(posts(self.target), posts(self.source))
+        self.assertEqual(len(posts(self.target)), 3)
+
+
+class TestNodeReference(unittest.TestCase):
+    """
+    Test the node argument of `nodedb lastseen`
+    """
+
+    def test_valid(self):
+        """
+        Decimal node numbers and `!hex` node ids are accepted
+        """
+        self.assertEqual(_node_reference("305441741"), 305441741)
+        self.assertEqual(_node_reference("!1234abcd"), "!1234abcd")
+
+    def test_invalid(self):
+        """
+        Anything else is an argument error rather than an exception
+        """
+        for value in ("abc", "a1b2c3d4", "!xyz", "!", ""):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                _node_reference(value)
+
+
+if __name__ == "__main__":
+    unittest.main()
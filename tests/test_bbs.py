@@ -2,11 +2,13 @@
 Test the Hops class
 """
 
+import os
+import tempfile
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from hops.hops import Hops
 from hops.client import Client
-from hops.storage import Storage
+from hops.storage import BBS_WINDOW_DAYS, MICROSECONDS_PER_DAY, Storage, timestamp_now
 from hops.message_coordinates import MessageCoordinates
 
 
@@ -56,6 +58,141 @@ class TestHops(unittest.TestCase):
         )
         self.storage.bbs_read.assert_called_once_with()
 
+    def test_on_bbs_more(self):
+        """
+        Ensure that `.bbs more` continues after the last post sent
+        """
+        self.storage.bbs_read.return_value = [
+            {
+                "id": 9,
+                "timestamp": 900,
+                "from_id": "!1",
+                "from_short_name": None,
+                "message": "Hi",
+            }
+        ]
+        self.storage.bbs_page.return_value = []
+        self.hops.on_message(
+            self.message_coordinates, message=".bbs", client=self.client
+        )
+        self.hops.on_message(
+            self.message_coordinates, message=".bbs more", client=self.client
+        )
+        self.storage.bbs_page.assert_called_once()
+        self.assertEqual(self.storage.bbs_page.call_args.kwargs["before"], (900, 9))
+        self.assertEqual(self.client.send_response.call_args.kwargs["message"], "📭")
+
+    def test_on_bbs_packed_by_bytes(self):
+        """
+        Emoji heavy posts are packed so that no reply exceeds the payload limit
+        """
+        self.storage.bbs_read.return_value = [
+            {
+                "id": i,
+                "timestamp": i,
+                "from_id": "!1",
+                "from_short_name": "🐇",
+                "message": "🌞" * 40,
+            }
+            for i in range(5)
+        ]
+        self.hops.on_message(
+            self.message_coordinates, message=".bbs", client=self.client
+        )
+        replies = [
+            call.kwargs["message"] for call in self.client.send_response.call_args_list
+        ][1:]
+        self.assertEqual(len(replies), 5)
+        for reply in replies:
+            self.assertLessEqual(len(reply.encode("utf-8")), 233)
+
+    def test_on_bbs_cached(self):
+        """
+        The first page is rendered once until the board changes or its
+        oldest post leaves the window
+        """
+        self.storage.bbs_version.return_value = (0, 1)
+        self.storage.bbs_read.return_value = [
+            {
+                "id": 1,
+                "timestamp": timestamp_now(),
+                "from_id": "!1",
+                "from_short_name": "ONE",
+                "message": "Hi",
+            }
+        ]
+        for _ in range(3):
+            self.hops.on_message(
+                self.message_coordinates, message=".bbs", client=self.client
+            )
+        self.assertEqual(self.storage.bbs_read.call_count, 1)
+        self.assertEqual(
+            self.client.send_response.call_args.kwargs["message"], "ONE: Hi"
+        )
+        self.assertEqual((self.hops.bbs_cache.hits, self.hops.bbs_cache.misses), (2, 1))
+
+        self.storage.bbs_version.return_value = (1, 1)
+        self.hops.on_message(
+            self.message_coordinates, message=".bbs", client=self.client
+        )
+        self.assertEqual(self.storage.bbs_read.call_count, 2)
+
+        window = BBS_WINDOW_DAYS * MICROSECONDS_PER_DAY
+        with patch("hops.hops.timestamp_now", return_value=timestamp_now() + window):
+            self.hops.on_message(
+                self.message_coordinates, message=".bbs", client=self.client
+            )
+        self.assertEqual(self.storage.bbs_read.call_count, 3)
+
+
+class TestMail(unittest.TestCase):
+    """
+    Test `.mail` against a scratch database
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.directory.name, "db.sqlite"))
+        self.hops = Hops(storage=self.storage)
+        self.client = MagicMock(spec=Client)
+        self.coordinates = MessageCoordinates(
+            from_id=0x1234ABCD,
+            from_node=None,
+            to_id=2,
+            to_node=None,
+            message_id=3,
+            channel_index=0,
+            is_dm=True,
+        )
+        for i in range(7):
+            self.storage.messages_insert("!1", "ONE", None, "!1234abcd", f"m{i}")
+
+    def tearDown(self):
+        self.storage.close()
+        self.directory.cleanup()
+
+    def mail(self, command: str) -> list:
+        """
+        Send a command and return the replies
+        """
+        self.client.reset_mock()
+        self.hops.on_message(self.coordinates, command, self.client)
+        return [
+            call.kwargs["message"] for call in self.client.send_response.call_args_list
+        ]
+
+    def test_unread_then_more(self):
+        """
+        `.mail` sends unread mail once, newest first, and `.mail more` pages
+        back through older mail
+        """
+        self.assertEqual(
+            self.mail(".mail"), ["ONE: m6\nONE: m5\nONE: m4\nONE: m3\nONE: m2"]
+        )
+        self.assertEqual(self.mail(".mail more"), ["ONE: m1\nONE: m0"])
+        self.assertEqual(self.mail(".mail"), ["📭"])
+        self.assertEqual(self.mail(".mail more"), ["📭"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,77 @@
+"""
+Test the ExpiringCache and VersionedCache classes
+"""
+
+import unittest
+from unittest.mock import patch
+from hops.cache import ExpiringCache, VersionedCache
+
+
+class TestExpiringCache(unittest.TestCase):
+    """
+    Test the ExpiringCache class
+    """
+
+    def test_seen(self):
+        """
+        A key is only new the first time it is seen
+        """
+        cache = ExpiringCache()
+        self.assertFalse(cache.seen("a"))
+        self.assertTrue(cache.seen("a"))
+        self.assertFalse(cache.seen("b"))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_bounded(self):
+        """
+        The oldest key is evicted once the cache is full
+        """
+        cache = ExpiringCache(max_entries=2)
+        for key in "abc":
+            cache.seen(key)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(cache.seen("a"))
+
+    def test_expiry(self):
+        """
+        Keys are forgotten after the ttl
+        """
+        cache = ExpiringCache(ttl=10)
+        with patch("hops.cache.time.monotonic", return_value=100.0):
+            cache.seen("a")
+        with patch("hops.cache.time.monotonic", return_value=105.0):
+            self.assertTrue(cache.seen("a"))
+        with patch("hops.cache.time.monotonic", return_value=111.0):
+            self.assertFalse(cache.seen("a"))
+
+
+class TestVersionedCache(unittest.TestCase):
+    """
+    Test the VersionedCache class
+    """
+
+    def test_version(self):
+        """
+        A value is only returned at the version it was computed from
+        """
+        cache = VersionedCache()
+        self.assertIsNone(cache.get("page", 1, now=0))
+        cache.put("page", 1, ["chunk"])
+        self.assertEqual(cache.get("page", 1, now=0), ["chunk"])
+        self.assertIsNone(cache.get("page", 2, now=0))
+        self.assertIsNone(cache.get("page", 1, now=0))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_expiry(self):
+        """
+        A value is forgotten at its expiry time
+        """
+        cache = VersionedCache()
+        cache.put("page", 1, ["chunk"], expires=100)
+        self.assertEqual(cache.get("page", 1, now=99), ["chunk"])
+        self.assertIsNone(cache.get("page", 1, now=100))
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+Test the Client class
+"""
+
+import time
+import unittest
+from unittest.mock import MagicMock
+from pubsub import pub
+from hops.client import Client
+from hops.delivery import MailDelivery
+from hops.dispatch import CommandDispatcher
+from hops.hops import Hops
+from hops.message_coordinates import MessageCoordinates
+from hops.ratelimit import RateLimiter
+from hops.scheduler import HIGH, NORMAL, SendScheduler
+from hops.storage import Storage
+
+
+class TestClient(unittest.TestCase):
+    """
+    Test the Client class
+    """
+
+    def setUp(self):
+        self.storage = MagicMock(spec=Storage)
+        self.hops = MagicMock(spec=Hops)
+        self.interface = MagicMock()
+        self.client = Client(self.interface, self.hops, self.storage)
+
+    def tearDown(self):
+        pub.unsubAll()
+
+    def test_packet_logged_once_across_topics(self):
+        """
+        A packet delivered to a subtopic and its parents is logged once
+        """
+        packet = {"from": 1, "id": 42, "decoded": {"portnum": "POSITION_APP"}}
+        pub.sendMessage(
+            "meshtastic.receive.position", packet=packet, interface=self.interface
+        )
+        self.storage.log_packet.assert_called_once()
+        self.assertEqual(self.client.packet_dedupe.hits, 1)
+        self.assertEqual(self.client.packet_dedupe.hit_rate, 0.5)
+
+    def test_distinct_packets_logged(self):
+        """
+        Packets with different ids or senders are each logged
+        """
+        for sender, packet_id in [(1, 1), (1, 2), (2, 1)]:
+            self.client._log_packet({"from": sender, "id": packet_id}, None)
+        self.assertEqual(self.storage.log_packet.call_count, 3)
+
+    def test_nodes_logged_in_one_batch(self):
+        """
+        The node database is logged with a single bulk write on connect
+        """
+        self.interface.nodes = {
+            "!1": {"num": 1, "user": {"id": "!1", "shortName": "ONE"}},
+            "!2": {"num": 2, "user": {"id": "!2", "shortName": "TWO"}},
+        }
+        self.client._log_nodes(self.interface)
+        self.storage.log_nodes.assert_called_once()
+        rows = self.storage.log_nodes.call_args.args[0]
+        self.assertEqual([row[1] for row in rows], ["!1", "!2"])
+        self.assertEqual(rows[0][2]["user.shortName"], "ONE")
+
+    def test_send_response_enqueues(self):
+        """
+        With a scheduler, replies are queued rather than sent inline
+        """
+        scheduler = MagicMock(spec=SendScheduler)
+        client = Client(self.interface, self.hops, self.storage, scheduler=scheduler)
+        scheduler.start.assert_called_once_with(client._transmit)
+        for message, message_id in [("📬", 7), ("hello", None)]:
+            coordinates = MessageCoordinates(
+                from_id="!1",
+                from_node=None,
+                to_id="!2",
+                to_node=None,
+                message_id=message_id,
+                channel_index=None,
+                is_dm=True,
+            )
+            client.send_response(message, coordinates)
+        self.interface._sendPacket.assert_not_called()
+        ack, reply = scheduler.enqueue.call_args_list
+        self.assertEqual(ack.args[2], ("!1", 0))
+        self.assertEqual(ack.kwargs, {"priority": HIGH, "coalesce": False})
+        self.assertEqual(reply.kwargs, {"priority": NORMAL, "coalesce": True})
+        # A full queue is reported to the caller
+        scheduler.enqueue.return_value = False
+        self.assertFalse(client.send_response("dropped", coordinates))
+
+    def test_text_submitted_to_dispatcher(self):
+        """
+        With a dispatcher, received commands are not handled on the reader
+        thread
+        """
+        dispatcher = MagicMock(spec=CommandDispatcher)
+        client = Client(self.interface, self.hops, self.storage, dispatcher=dispatcher)
+        self.interface.nodesByNum = {}
+        packet = {"from": 1, "to": 2, "id": 3, "decoded": {"payload": b".ping"}}
+        client._event_text(packet, self.interface)
+        self.hops.on_message.assert_not_called()
+        sender, _, message, passed_client = dispatcher.submit.call_args.args
+        self.assertEqual((sender, message), (1, ".ping"))
+        self.assertIs(passed_client, client)
+
+    def test_repeated_text_handled_once(self):
+        """
+        Rebroadcasts of a text packet are only handled the first time
+        """
+        self.interface.nodesByNum = {}
+        packet = {"from": 1, "to": 2, "id": 3, "decoded": {"payload": b".post hi"}}
+        for _ in range(3):
+            self.client._event_text(dict(packet), self.interface)
+        self.assertEqual(self.hops.on_message.call_count, 1)
+
+        changed = dict(packet, decoded={"payload": b".post other"})
+        self.client._event_text(changed, self.interface)
+        self.client._event_text(dict(packet, id=4), self.interface)
+        self.assertEqual(self.hops.on_message.call_count, 3)
+        self.assertEqual(self.client.text_dedupe.hits, 2)
+
+    def test_heard_nodes_passed_to_delivery(self):
+        """
+        Each distinct packet, and each recent node update, tells mail
+        delivery that the sender is on the air
+        """
+        delivery = MagicMock(spec=MailDelivery)
+        delivery.online_window = 900
+        client = Client(self.interface, self.hops, self.storage, delivery=delivery)
+        packet = {"from": 1, "id": 42, "channel": 2}
+        pub.sendMessage(
+            "meshtastic.receive.position", packet=packet, interface=self.interface
+        )
+        delivery.heard.assert_called_once_with(1, 2, client)
+
+        delivery.reset_mock()
+        client._event_node_updated({"num": 3, "lastHeard": 1}, self.interface)
+        delivery.heard.assert_not_called()
+        client._event_node_updated(
+            {"num": 3, "lastHeard": int(time.time())}, self.interface
+        )
+        delivery.heard.assert_called_once_with(3, None, client)
+
+    def test_commands_admitted_before_dispatch(self):
+        """
+        Refused commands and chatter never take a place in the dispatcher's
+        queue
+        """
+        hops = Hops(limiter=RateLimiter(sender_budget=1, channel_budget=0))
+        dispatcher = MagicMock(spec=CommandDispatcher)
+        client = Client(self.interface, hops, self.storage, dispatcher=dispatcher)
+        self.interface.nodesByNum = {}
+        for packet_id, text in enumerate([b".ping", b".ping", b".bbs", b"hi all"]):
+            packet = {"from": 1, "to": 2, "id": packet_id + 1}
+            packet["decoded"] = {"payload": text}
+            client._event_text(packet, self.interface)
+        self.assertEqual(dispatcher.submit.call_count, 1)
+        sent = self.interface._sendPacket.call_args_list
+        self.assertEqual(
+            [call.args[0].decoded.payload for call in sent], ["⏳".encode()]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Test forwarding mail when its addressee is heard
+"""
+
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from hops.client import Client
+from hops.delivery import MailDelivery, id_to_num
+from hops.storage import Storage
+
+BOT = 0x0B0B0B0B
+ALICE = 0x1234ABCD
+BOB = 0x0000BEEF
+
+
+class TestMailDelivery(unittest.TestCase):
+    """
+    Test forwarding mail when its addressee is heard
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.directory.name, "db.sqlite"))
+        for i in range(7):
+            self.storage.messages_insert("!1", "ONE", None, "!1234abcd", f"m{i}")
+        self.client = MagicMock(spec=Client)
+        self.client.send_response.return_value = True
+        self.client.interface = MagicMock()
+        self.client.interface.nodesByNum = {}
+        self.client.interface.myInfo.my_node_num = BOT
+
+    def tearDown(self):
+        self.storage.close()
+        self.directory.cleanup()
+
+    def sent(self) -> list:
+        """
+        The messages sent since the last call
+        """
+        messages = [
+            (call.kwargs["message_coordinates"].from_id, call.kwargs["message"])
+            for call in self.client.send_response.call_args_list
+        ]
+        self.client.reset_mock()
+        return messages
+
+    def test_id_to_num(self):
+        """
+        Identifiers with and without leading zeroes give the node number
+        """
+        self.assertEqual(id_to_num("!0000beef"), BOB)
+        self.assertEqual(id_to_num("!beef"), BOB)
+
+    def test_seeded_from_storage(self):
+        """
+        Addressees with undelivered mail are known from the start
+        """
+        delivery = MailDelivery(self.storage)
+        self.assertIn(ALICE, delivery)
+        self.assertNotIn(BOB, delivery)
+
+    def test_heard_forwards_in_batches(self):
+        """
+        Mail goes when the addressee is heard, newest first and packed, a
+        batch at a time, and is then marked delivered
+        """
+        delivery = MailDelivery(self.storage)
+        delivery.heard(BOB, 0, self.client)
+        self.assertEqual(self.sent(), [])
+
+        delivery.heard(ALICE, 0, self.client)
+        self.assertEqual(
+            self.sent(), [(ALICE, "📫 ONE: m6\nONE: m5\nONE: m4\nONE: m3\nONE: m2")]
+        )
+        self.assertIn(ALICE, delivery)
+        delivery.heard(ALICE, 0, self.client)
+        self.assertEqual(self.sent(), [(ALICE, "📫 ONE: m1\nONE: m0")])
+        self.assertNotIn(ALICE, delivery)
+        self.assertEqual(delivery.pushed, 7)
+        self.assertEqual(self.storage.messages_unread("!1234abcd"), [])
+
+        delivery.heard(ALICE, 0, self.client)
+        self.assertEqual(self.sent(), [])
+
+    def test_add_forwards_if_on_the_air(self):
+        """
+        New mail for a node heard recently goes straight away, otherwise it
+        waits until the node is heard
+        """
+        delivery = MailDelivery(self.storage, online_window=60)
+        self.storage.messages_insert("!1", "ONE", None, "!0000beef", "hi bob")
+        delivery.add("!0000beef", self.client)
+        self.assertEqual(self.sent(), [])
+        self.assertIn(BOB, delivery)
+
+        delivery.heard(BOB, 0, self.client)
+        self.assertEqual(self.sent(), [(BOB, "📫 ONE: hi bob")])
+        self.storage.messages_insert("!1", "ONE", None, "!0000beef", "again")
+        delivery.add("!0000beef", self.client)
+        self.assertEqual(self.sent(), [(BOB, "📫 ONE: again")])
+        self.assertNotIn(BOB, delivery)
+
+    def test_refused_send_not_delivered(self):
+        """
+        Mail the client could not queue stays undelivered and is forwarded
+        again the next time the addressee is heard
+        """
+        delivery = MailDelivery(self.storage, batch=10)
+        self.client.send_response.return_value = False
+        delivery.heard(ALICE, 0, self.client)
+        self.assertEqual(len(self.sent()), 1)
+        self.assertIn(ALICE, delivery)
+        self.assertEqual(len(self.storage.messages_unread("!1234abcd", limit=10)), 7)
+
+        self.client.send_response.return_value = True
+        delivery.heard(ALICE, 0, self.client)
+        self.assertEqual(len(self.sent()), 1)
+        self.assertNotIn(ALICE, delivery)
+        self.assertEqual(delivery.pushed, 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
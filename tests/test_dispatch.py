@@ -0,0 +1,145 @@
+"""
+Test the CommandDispatcher class
+"""
+
+import asyncio
+import threading
+import unittest
+from unittest.mock import MagicMock
+from hops.dispatch import CommandDispatcher
+
+
+class TestCommandDispatcher(unittest.TestCase):
+    """
+    Test the CommandDispatcher class
+    """
+
+    def test_per_sender_order(self):
+        """
+        Commands from one sender run one at a time, in order
+        """
+        seen = []
+        running = threading.Event()
+        release = threading.Event()
+
+        def handler(_coordinates, message, _client):
+            if message == "first":
+                running.set()
+                release.wait(5)
+            seen.append(message)
+
+        dispatcher = CommandDispatcher(handler, workers=4)
+        dispatcher.submit("a", None, "first", MagicMock())
+        self.assertTrue(running.wait(5))
+        dispatcher.submit("a", None, "second", MagicMock())
+        self.assertEqual(dispatcher.pending, 1)
+        release.set()
+        dispatcher.close()
+        self.assertEqual(seen, ["first", "second"])
+        self.assertEqual(dispatcher.completed, 2)
+
+    def test_senders_run_in_parallel(self):
+        """
+        A slow command does not hold up other senders
+        """
+        release = threading.Event()
+        done = threading.Event()
+
+        def handler(_coordinates, message, _client):
+            if message == "slow":
+                release.wait(5)
+            else:
+                done.set()
+
+        dispatcher = CommandDispatcher(handler, workers=2)
+        dispatcher.submit("a", None, "slow", MagicMock())
+        dispatcher.submit("b", None, "fast", MagicMock())
+        self.assertTrue(done.wait(5))
+        self.assertFalse(release.is_set())
+        release.set()
+        dispatcher.close()
+        self.assertEqual(dispatcher.metrics()["utilization"], 0.0)
+
+    def test_shed_when_saturated(self):
+        """
+        Commands beyond `max_pending` are rejected
+        """
+        running = threading.Event()
+        release = threading.Event()
+
+        def handler(*_):
+            running.set()
+            release.wait(5)
+
+        dispatcher = CommandDispatcher(handler, workers=1, max_pending=1)
+        self.assertTrue(dispatcher.submit("a", None, "1", MagicMock()))
+        self.assertTrue(running.wait(5))
+        self.assertTrue(dispatcher.submit("a", None, "2", MagicMock()))
+        self.assertFalse(dispatcher.submit("a", None, "3", MagicMock()))
+        self.assertEqual(dispatcher.shed, 1)
+        release.set()
+        dispatcher.close()
+
+    def test_timeout_releases_lane(self):
+        """
+        An overrunning command lets the sender's next command start and its
+        late responses are discarded
+        """
+        release = threading.Event()
+        second = threading.Event()
+
+        def handler(_coordinates, message, client):
+            if message == "slow":
+                release.wait(5)
+                client.send_response("late", None)
+            else:
+                second.set()
+
+        client = MagicMock()
+        dispatcher = CommandDispatcher(handler, workers=2, timeout=0.05)
+        dispatcher.submit("a", None, "slow", client)
+        dispatcher.submit("a", None, "next", client)
+        self.assertTrue(second.wait(5))
+        self.assertEqual(dispatcher.timed_out, 1)
+        release.set()
+        dispatcher.close()
+        client.send_response.assert_not_called()
+
+    def test_handler_failure(self):
+        """
+        A failing command is counted and does not block its lane
+        """
+        seen = []
+
+        def handler(_coordinates, message, _client):
+            if message == "bad":
+                raise ValueError(message)
+            seen.append(message)
+
+        dispatcher = CommandDispatcher(handler, workers=1)
+        dispatcher.submit("a", None, "bad", MagicMock())
+        dispatcher.submit("a", None, "good", MagicMock())
+        dispatcher.close()
+        self.assertEqual(dispatcher.failed, 1)
+        self.assertEqual(seen, ["good"])
+
+    def test_coroutine_handler_awaited(self):
+        """
+        A handler returning a coroutine has it run to completion by the
+        worker, and is only counted as completed once it has
+        """
+        seen = []
+
+        async def handler(_coordinates, message, _client):
+            await asyncio.sleep(0)
+            seen.append(message)
+
+        dispatcher = CommandDispatcher(handler, workers=1)
+        dispatcher.submit("a", None, "hello", MagicMock())
+        dispatcher.close()
+        self.assertEqual(seen, ["hello"])
+        self.assertEqual(dispatcher.completed, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
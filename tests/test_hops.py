@@ -2,12 +2,15 @@
 Test the Hops class
 """
 
+import asyncio
 import unittest
 from unittest.mock import MagicMock
 from hops.hops import Hops
 from hops.client import Client
 from hops.storage import Storage
 from hops.message_coordinates import MessageCoordinates
+from hops.node_index import NodeIndex
+from hops.sysinfo import SystemSampler
 
 
 class TestHops(unittest.TestCase):
@@ -89,6 +92,45 @@ class TestHops(unittest.TestCase):
         )
         self.client.send_response.assert_not_called()
 
+    def test_on_message_ambiguous(self):
+        """
+        Ensure that an ambiguous addressee is reported rather than guessed
+        """
+        self.client.node_index = NodeIndex()
+        for num, short_name in [(10, "AB1"), (11, "AB2")]:
+            self.client.node_index.update(
+                {"num": num, "user": {"id": f"!{num:08x}", "shortName": short_name}}
+            )
+        self.hops.on_message(
+            self.message_coordinates,
+            message=".message ab hi",
+            client=self.client,
+        )
+        self.storage.messages_insert.assert_not_called()
+        self.client.send_response.assert_called_once_with(
+            message="❓ ab is ambiguous: AB1, AB2",
+            message_coordinates=self.message_coordinates,
+        )
+
+    def test_coroutine_latency_recorded_when_awaited(self):
+        """
+        The latency of a coroutine handler covers running it, not just
+        creating the coroutine
+        """
+        sampler = MagicMock(spec=SystemSampler)
+        hops = Hops(storage=self.storage, sampler=sampler)
+
+        async def slow(_coordinates, _argument, _client):
+            await asyncio.sleep(0.05)
+
+        hops._on_slow = slow
+        result = hops.on_message(self.message_coordinates, ".slow", self.client)
+        sampler.record_latency.assert_not_called()
+        asyncio.run(result)
+        command, elapsed = sampler.record_latency.call_args.args
+        self.assertEqual(command, "slow")
+        self.assertGreaterEqual(elapsed, 0.05)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,88 @@
+"""
+Test the MessageCoordinates class
+"""
+
+import copy
+import pickle
+import unittest
+from unittest.mock import MagicMock
+from hops.message_coordinates import MessageCoordinates
+
+BOT = 0x0B0B0B0B
+ALICE = 0x0000ABCD
+
+
+class TestMessageCoordinates(unittest.TestCase):
+    """
+    Test the MessageCoordinates class
+    """
+
+    def setUp(self):
+        self.node = {"num": ALICE, "user": {"id": "!0000abcd", "shortName": "ALI"}}
+        self.coordinates = MessageCoordinates(
+            from_id=ALICE,
+            from_node=self.node,
+            to_id=BOT,
+            to_node=None,
+            message_id=3,
+            channel_index=1,
+            is_dm=False,
+        )
+
+    def test_immutable(self):
+        """
+        Fields cannot be changed, added or removed
+        """
+        with self.assertRaises(AttributeError):
+            self.coordinates.is_dm = True
+        with self.assertRaises(AttributeError):
+            self.coordinates.extra = 1
+        with self.assertRaises(AttributeError):
+            del self.coordinates.message_id
+
+    def test_replace_shares_nodes(self):
+        """
+        A derived copy changes only the given fields and shares the node
+        details rather than copying them
+        """
+        direct = self.coordinates.direct()
+        self.assertTrue(direct.is_dm)
+        self.assertIsNone(direct.message_id)
+        self.assertEqual(direct.channel_index, 1)
+        self.assertIs(direct.from_node, self.node)
+        self.assertFalse(self.coordinates.is_dm)
+        self.assertIs(direct.direct(), direct)
+        self.assertEqual(
+            self.coordinates.replace(channel_index=0),
+            MessageCoordinates(ALICE, self.node, BOT, None, 3, 0, False),
+        )
+
+    def test_copies(self):
+        """
+        Coordinates survive being copied and pickled
+        """
+        for duplicate in (
+            copy.copy(self.coordinates),
+            copy.deepcopy(self.coordinates),
+            pickle.loads(pickle.dumps(self.coordinates)),
+        ):
+            self.assertEqual(duplicate, self.coordinates)
+
+    def test_from_packet(self):
+        """
+        Nodes are found by number, including those whose identifier has
+        leading zeroes
+        """
+        interface = MagicMock()
+        interface.nodesByNum = {ALICE: self.node}
+        interface.myInfo.my_node_num = BOT
+        packet = {"from": ALICE, "to": BOT, "id": 3, "channel": 1}
+        coordinates = MessageCoordinates.from_packet(packet, interface)
+        self.assertIs(coordinates.from_node, self.node)
+        self.assertIsNone(coordinates.to_node)
+        self.assertTrue(coordinates.is_dm)
+        self.assertEqual(coordinates.message_id, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Test the metrics registry and exporters
+"""
+
+import unittest
+import urllib.error
+import urllib.request
+from hops.metrics import MetricsServer, Registry
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test the metrics registry and exporters
+    """
+
+    def setUp(self):
+        self.registry = Registry()
+        self.counter = self.registry.counter("test_total", "A counter", ["kind"])
+        self.histogram = self.registry.histogram(
+            "test_seconds", "A histogram", buckets=(0.1, 1)
+        )
+
+    def test_disabled(self):
+        """
+        Nothing is recorded until the registry is enabled
+        """
+        self.counter.labels("a").inc()
+        self.histogram.observe(0.5)
+        self.assertEqual(self.counter.labels("a").value, 0)
+        self.assertEqual(self.histogram.labels().count, 0)
+
+    def test_exposition(self):
+        """
+        Metrics are rendered in the Prometheus text format
+        """
+        self.registry.enabled = True
+        self.counter.labels("a").inc(2)
+        for value in (0.05, 0.5, 5):
+            self.histogram.observe(value)
+        self.registry.gauge("test_depth", "A gauge", lambda: 7)
+        text = self.registry.expose().splitlines()
+        self.assertIn("# TYPE test_total counter", text)
+        self.assertIn('test_total{kind="a"} 2', text)
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{le="1"} 2', text)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn("test_seconds_count 3", text)
+        self.assertIn("test_depth 7", text)
+
+    def test_summary(self):
+        """
+        The log summary reduces histograms to a count and mean
+        """
+        self.registry.enabled = True
+        self.histogram.observe(1)
+        self.histogram.observe(3)
+        summary = self.registry.summary()
+        self.assertEqual(summary["test_seconds_count"], 2)
+        self.assertEqual(summary["test_seconds_mean"], 2)
+
+    def test_same_name_shared(self):
+        """
+        Declaring a metric twice returns the first declaration
+        """
+        self.assertIs(
+            self.registry.counter("test_total", "Again", ["kind"]), self.counter
+        )
+
+    def test_server(self):
+        """
+        The endpoint serves the exposition on localhost
+        """
+        server = MetricsServer(self.registry, port=0)
+        server.start()
+        self.addCleanup(server.close)
+        self.counter.labels("b").inc()
+        url = f"http://127.0.0.1:{server.port}"
+        with urllib.request.urlopen(f"{url}/metrics", timeout=5) as response:
+            body = response.read().decode("utf-8")
+        self.assertIn('test_total{kind="b"} 1', body)
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other", timeout=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,235 @@
+"""
+Test the schema migrations
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from hops.migrations import MIGRATIONS, SCHEMA_VERSION, iso_to_us
+from hops.storage import Storage
+
+LEGACY_SCHEMA = """
+CREATE TABLE packets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp DATETIME UNIQUE NOT NULL,
+    packet_json TEXT NOT NULL
+);
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp DATETIME UNIQUE NOT NULL,
+    node_id TEXT NOT NULL,
+    node_json TEXT NOT NULL
+);
+CREATE TABLE bbs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp DATETIME UNIQUE NOT NULL,
+    from_id TEXT NOT NULL,
+    from_short_name TEXT,
+    from_long_name TEXT,
+    message TEXT NOT NULL
+);
+CREATE INDEX idx_bbs_timestamp ON bbs (timestamp);
+CREATE TABLE messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp DATETIME UNIQUE NOT NULL,
+    from_id TEXT NOT NULL,
+    from_short_name TEXT,
+    from_long_name TEXT,
+    to_id TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX idx_messages_to_id_timestamp ON messages (to_id, timestamp);
+"""
+
+
+class TestMigrations(unittest.TestCase):
+    """
+    Test the schema migrations against a database from before versioning
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "db.sqlite")
+        self.recent = datetime.now() - timedelta(days=1)
+        with sqlite3.connect(self.filename) as conn:
+            conn.executescript(LEGACY_SCHEMA)
+            conn.executemany(
+                "INSERT INTO bbs (timestamp, from_id, message) VALUES (?, ?, ?)",
+                [((self.recent - timedelta(days=60)).isoformat(), "!1", "old")]
+                + [
+                    ((self.recent + timedelta(seconds=i)).isoformat(), "!1", f"m{i}")
+                    for i in range(3)
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO messages (timestamp, from_id, to_id, message) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    ((self.recent - timedelta(days=60)).isoformat(), "!1", "!2", "old"),
+                    (self.recent.isoformat(), "!1", "!2", "new"),
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO nodes (timestamp, node_id, node_json) VALUES (?, ?, ?)",
+                [
+                    ("2025-07-29T17:40:47.1", "!1", '{\n   "user.shortName": "OLD"\n}'),
+                    ("2025-07-29T17:40:47.2", "!2", '{"user.shortName": "TWO"}'),
+                    ("2025-07-29T17:40:47.3", "!1", '{"user.shortName": "ONE"}'),
+                    ("2025-07-29T17:40:47.4", "!1", '{"user.shortName": "ONE"}'),
+                    ("2025-07-29T17:40:47.5", "!1", '{"snr": 6}'),
+                ],
+            )
+        conn.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_upgrade_legacy_database(self):
+        """
+        Timestamps become integers and the schema version is recorded
+        """
+        storage = Storage(self.filename, migration_batch_size=2)
+        with storage._transaction() as cursor:
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            types = {row[1]: row[2] for row in cursor.execute("PRAGMA table_info(bbs)")}
+            first = cursor.execute(
+                "SELECT timestamp FROM bbs WHERE message = 'm0'"
+            ).fetchone()[0]
+            tables = {
+                row[0] for row in cursor.execute("SELECT name FROM sqlite_master")
+            }
+        self.assertEqual(version, SCHEMA_VERSION)
+        self.assertEqual(types["timestamp"], "INTEGER")
+        self.assertEqual(first, iso_to_us(self.recent.isoformat()))
+        self.assertIn("idx_bbs_timestamp", tables)
+        self.assertIn("idx_packets_timestamp", tables)
+        self.assertNotIn("bbs_migrating", tables)
+        self.assertNotIn("nodes", tables)
+        self.assertEqual(storage.node_read("!1")["node"], {"snr": 6})
+        # Every snapshot's changes are kept, unchanged snapshots are not
+        self.assertEqual(
+            self.node_changes(storage, "!1"),
+            [
+                {"user.shortName": "OLD"},
+                {"user.shortName": "ONE"},
+                {"snr": 6, "user.shortName": None},
+            ],
+        )
+        self.assertEqual(self.node_changes(storage, "!2"), [{"user.shortName": "TWO"}])
+        self.assertEqual(storage.node_read("!2")["node"], {"user.shortName": "TWO"})
+
+        # Only the posts inside the 28 day window, newest first
+        messages = [row["message"] for row in storage.bbs_read()]
+        self.assertEqual(messages, ["m2", "m1", "m0"])
+
+        # Mail from beyond the old window is not resurrected as unread
+        self.assertEqual(
+            [row["message"] for row in storage.messages_unread("!2")], ["new"]
+        )
+
+        # Posts in the same microsecond no longer collide
+        with storage._transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO bbs (timestamp, from_id, message) VALUES (?, ?, ?)",
+                (first, "!1", "c"),
+            )
+        storage.close()
+
+    @staticmethod
+    def node_changes(storage: Storage, node_id: str) -> list:
+        """
+        The changes logged for a node, oldest first
+        """
+        with storage._transaction() as cursor:
+            return [
+                json.loads(row[0])
+                for row in cursor.execute(
+                    "SELECT changes_json FROM node_changes WHERE node_id = ? "
+                    "ORDER BY timestamp, id",
+                    (node_id,),
+                )
+            ]
+
+    def test_resume_interrupted_node_history(self):
+        """
+        Converting node snapshots carries on after the last node finished,
+        discarding the changes of the node it was part way through
+        """
+        with sqlite3.connect(self.filename) as conn:
+            for migration in MIGRATIONS[:3]:
+                migration(conn, 2)
+            conn.executescript(
+                """
+                PRAGMA user_version = 3;
+                CREATE TABLE node_latest (
+                    node_id TEXT PRIMARY KEY,
+                    node_num INTEGER,
+                    short_name TEXT,
+                    long_name TEXT,
+                    hw_model TEXT,
+                    last_heard INTEGER,
+                    updated INTEGER NOT NULL,
+                    node_json TEXT NOT NULL
+                );
+                CREATE TABLE node_changes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp INTEGER NOT NULL,
+                    node_id TEXT NOT NULL,
+                    changes_json TEXT NOT NULL
+                );
+                INSERT INTO node_latest (node_id, short_name, updated, node_json)
+                VALUES ('!1', 'FINISHED', 1, '{"user.shortName":"FINISHED"}');
+                INSERT INTO node_changes (timestamp, node_id, changes_json)
+                VALUES (1, '!1', '{"user.shortName":"FINISHED"}'),
+                    (1, '!2', '{"user.shortName":"PARTIAL"}');
+                """
+            )
+        conn.close()
+        storage = Storage(self.filename, migration_batch_size=1)
+        self.assertEqual(storage.node_read("!1")["short_name"], "FINISHED")
+        self.assertEqual(
+            self.node_changes(storage, "!1"), [{"user.shortName": "FINISHED"}]
+        )
+        self.assertEqual(self.node_changes(storage, "!2"), [{"user.shortName": "TWO"}])
+        storage.close()
+
+    def test_resume_interrupted_rebuild(self):
+        """
+        A rebuild that stopped part way through carries on from the side table
+        """
+        # Simulate a database stopped after copying two rows of bbs
+        with sqlite3.connect(self.filename) as conn:
+            conn.executescript(
+                """
+                PRAGMA user_version = 1;
+                CREATE TABLE bbs_migrating (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp INTEGER NOT NULL,
+                    from_id TEXT NOT NULL,
+                    from_short_name TEXT,
+                    from_long_name TEXT,
+                    message TEXT NOT NULL
+                );
+                INSERT INTO bbs_migrating
+                SELECT id, 1, from_id, from_short_name, from_long_name, message
+                FROM bbs WHERE id <= 2;
+                """
+            )
+        conn.close()
+        storage = Storage(self.filename)
+        with storage._transaction() as cursor:
+            rows = cursor.execute(
+                "SELECT id, timestamp FROM bbs ORDER BY id"
+            ).fetchall()
+        self.assertEqual([row[0] for row in rows], [1, 2, 3, 4])
+        # Rows copied before the interruption are not copied again
+        self.assertEqual([row[1] for row in rows[:2]], [1, 1])
+        self.assertEqual(rows[2][1], iso_to_us(self.recent.isoformat()) + 1_000_000)
+        storage.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
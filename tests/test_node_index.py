@@ -0,0 +1,72 @@
+"""
+Test the NodeIndex class
+"""
+
+import unittest
+from hops.node_index import NodeIndex
+
+
+def node(num: int, short_name: str, long_name: str) -> dict:
+    """
+    A node as published by meshtastic
+    """
+    return {
+        "num": num,
+        "user": {"id": f"!{num:08x}", "shortName": short_name, "longName": long_name},
+    }
+
+
+class TestNodeIndex(unittest.TestCase):
+    """
+    Test the NodeIndex class
+    """
+
+    def setUp(self):
+        self.index = NodeIndex()
+        self.index.rebuild(
+            [
+                node(1, "BBS", "Smol Mobile BBS"),
+                node(2, "ANT", "Antenna Farm"),
+                node(3, "ANT2", "Another Node"),
+                {"num": 4},
+            ]
+        )
+
+    def test_exact(self):
+        """
+        Short names, long names and ids match case-insensitively
+        """
+        self.assertEqual(self.index.lookup("bbs"), [1])
+        self.assertEqual(self.index.lookup("ANTENNA FARM"), [2])
+        self.assertEqual(self.index.lookup("!00000003"), [3])
+        self.assertEqual(self.index.node_id(3), "!00000003")
+
+    def test_exact_beats_prefix(self):
+        """
+        An exact match is not ambiguous with longer names sharing its prefix
+        """
+        self.assertEqual(self.index.lookup("ant"), [2])
+
+    def test_prefix_and_ambiguity(self):
+        """
+        Prefixes return every node they match
+        """
+        self.assertEqual(self.index.lookup("smol"), [1])
+        self.assertEqual(self.index.lookup("an"), [2, 3])
+        self.assertEqual(self.index.lookup("an", prefix=False), [])
+        self.assertEqual(self.index.lookup("zzz"), [])
+
+    def test_update_renames(self):
+        """
+        Updating a node drops its old names
+        """
+        self.index.update(node(2, "FARM", "Antenna Farm"))
+        self.assertEqual(self.index.lookup("farm"), [2])
+        self.assertEqual(self.index.lookup("ant", prefix=False), [])
+        self.assertEqual(len(self.index), 4)
+        self.index.remove(2)
+        self.assertEqual(self.index.lookup("farm"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
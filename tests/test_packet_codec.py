@@ -0,0 +1,83 @@
+"""
+Test the packet archive codecs
+"""
+
+import json
+import unittest
+from meshtastic.protobuf.mesh_pb2 import MeshPacket
+from meshtastic.protobuf.portnums_pb2 import PortNum
+from hops.packet_codec import (
+    JSON,
+    PROTOBUF,
+    PROTOBUF_ZLIB,
+    decode_mesh_packet,
+    decode_packet,
+    encode_packet,
+    mesh_packet_from_flat_json,
+)
+from hops.util import flat_dict
+
+
+def make_packet() -> dict:
+    """
+    A text packet as published by meshtastic
+    """
+    mesh_packet = MeshPacket(id=7, to=0xFFFFFFFF, rx_time=1700000000, hop_limit=3)
+    setattr(mesh_packet, "from", 0x1234ABCD)
+    mesh_packet.decoded.portnum = PortNum.TEXT_MESSAGE_APP
+    mesh_packet.decoded.payload = "héllo 👋".encode("utf-8")
+    return {
+        "from": 0x1234ABCD,
+        "to": 0xFFFFFFFF,
+        "id": 7,
+        "rxTime": 1700000000,
+        "hopLimit": 3,
+        "fromId": "!1234abcd",
+        "decoded": {
+            "portnum": "TEXT_MESSAGE_APP",
+            "payload": mesh_packet.decoded.payload,
+            "text": "héllo 👋",
+        },
+        "raw": mesh_packet,
+    }
+
+
+class TestPacketCodec(unittest.TestCase):
+    """
+    Test the packet archive codecs
+    """
+
+    def test_protobuf_round_trip(self):
+        """
+        Both protobuf codecs store the exact packet
+        """
+        packet = make_packet()
+        for codec in (PROTOBUF, PROTOBUF_ZLIB):
+            used, data = encode_packet(packet, codec)
+            self.assertEqual(used, codec)
+            self.assertEqual(decode_mesh_packet(codec, data), packet["raw"])
+            self.assertEqual(decode_packet(codec, data)["id"], 7)
+
+    def test_json_fallback(self):
+        """
+        Packets without the raw protobuf are stored as compact JSON
+        """
+        packet = make_packet()
+        del packet["raw"]
+        codec, data = encode_packet(packet, PROTOBUF)
+        self.assertEqual(codec, JSON)
+        self.assertIn('"decoded.text":"héllo 👋"', data)
+        self.assertEqual(decode_packet(codec, data)["decoded.text"], "héllo 👋")
+
+    def test_rebuild_from_flat_json(self):
+        """
+        Legacy rows are rebuilt into the original protobuf
+        """
+        packet = make_packet()
+        legacy = json.dumps(flat_dict(packet), indent=3)
+        self.assertEqual(mesh_packet_from_flat_json(legacy), packet["raw"])
+        self.assertIsNone(mesh_packet_from_flat_json("not json"))
+
+
+if __name__ == "__main__":
+    unittest.main()
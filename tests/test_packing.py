@@ -0,0 +1,64 @@
+"""
+Test packing replies into packets
+"""
+
+import unittest
+from hops.packing import MAX_PAYLOAD, byte_length, pack, split
+
+
+class TestPacking(unittest.TestCase):
+    """
+    Test packing replies into packets
+    """
+
+    def test_rows_joined(self):
+        """
+        Rows that fit together share a packet
+        """
+        self.assertEqual(pack(["one", "two", "three"]), ["one\ntwo\nthree"])
+        self.assertEqual(pack([]), [])
+
+    def test_limit_in_bytes(self):
+        """
+        The limit applies to the UTF-8 encoding, not the number of characters
+        """
+        rows = ["🐇" * 25] * 4
+        packets = pack(rows)
+        self.assertEqual(len(packets), 2)
+        for packet in packets:
+            self.assertLessEqual(byte_length(packet), MAX_PAYLOAD)
+
+    def test_rows_kept_whole(self):
+        """
+        A row that fits in a packet of its own is not broken up
+        """
+        self.assertEqual(pack(["a" * 8, "b" * 8], limit=12), ["a" * 8, "b" * 8])
+
+    def test_fewer_packets_than_characters(self):
+        """
+        Plain text rows use the whole payload rather than 200 characters
+        """
+        rows = [f"USR: {'x' * 100}"] * 2
+        self.assertEqual(len(pack(rows)), 1)
+
+    def test_long_row_split_at_words(self):
+        """
+        A row too long for one packet is split between words, starting in
+        the space left by the previous row
+        """
+        self.assertEqual(
+            pack(["hi", "one two three four"], limit=12),
+            ["hi\none two", "three four"],
+        )
+        self.assertEqual(split("one two three", limit=9), ["one two", "three"])
+
+    def test_long_word_split(self):
+        """
+        Words longer than a packet are split between characters
+        """
+        pieces = split("👋" * 10, limit=9)
+        self.assertEqual(pieces, ["👋👋", "👋👋", "👋👋", "👋👋", "👋👋"])
+
+
+if __name__ == "__main__":
+    unittest.main()
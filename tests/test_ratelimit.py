@@ -0,0 +1,103 @@
+"""
+Test the RateLimiter class
+"""
+
+import unittest
+from unittest.mock import MagicMock, patch
+from hops.client import Client
+from hops.hops import Hops
+from hops.message_coordinates import MessageCoordinates
+from hops.ratelimit import ADMIT, DROP, NOTIFY, RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    """
+    Test the RateLimiter class
+    """
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch("hops.ratelimit.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sender_budget(self):
+        """
+        Expensive commands use up a sender's budget faster, and one notice is
+        given per run of refused commands
+        """
+        limiter = RateLimiter(sender_budget=6, channel_budget=0, window=60)
+        self.assertEqual(limiter.admit(1, 0, "bbs"), ADMIT)
+        self.assertEqual(limiter.admit(1, 0, "ping"), ADMIT)
+        self.assertEqual(limiter.admit(1, 0, "ping"), ADMIT)
+        self.assertEqual(limiter.admit(1, 0, "bbs"), NOTIFY)
+        self.assertEqual(limiter.admit(1, 0, "bbs"), DROP)
+        self.assertEqual(limiter.admit(1, 0, "ping"), ADMIT)
+        self.assertEqual(limiter.admit(1, 0, "ping"), NOTIFY)
+        self.assertEqual(limiter.admit(2, 0, "bbs"), ADMIT)
+        self.assertEqual(
+            (limiter.admitted, limiter.rejected, limiter.notices), (5, 3, 2)
+        )
+
+    def test_sliding_window(self):
+        """
+        Budget is returned as the commands that spent it leave the window
+        """
+        limiter = RateLimiter(sender_budget=2, channel_budget=0, window=60)
+        limiter.admit(1, 0, "ping")
+        self.now += 30
+        limiter.admit(1, 0, "ping")
+        self.assertEqual(limiter.admit(1, 0, "ping"), NOTIFY)
+        self.now += 31
+        self.assertEqual(limiter.admit(1, 0, "ping"), ADMIT)
+        self.assertEqual(limiter.admit(1, 0, "ping"), NOTIFY)
+
+    def test_channel_budget(self):
+        """
+        Senders on a channel share its budget, other channels are unaffected
+        """
+        limiter = RateLimiter(sender_budget=10, channel_budget=3, window=60)
+        for sender in range(3):
+            self.assertEqual(limiter.admit(sender, 0, "ping"), ADMIT)
+        self.assertEqual(limiter.admit(3, 0, "ping"), NOTIFY)
+        self.assertEqual(limiter.admit(3, 1, "ping"), ADMIT)
+
+    def test_bounded(self):
+        """
+        Idle senders are forgotten, and the table never exceeds its size
+        """
+        limiter = RateLimiter(max_entries=10, window=60)
+        for sender in range(100):
+            limiter.admit(sender, 0, "ping")
+        self.assertEqual(len(limiter), 10)
+        self.now += 61
+        limiter.admit(0, 0, "ping")
+        self.assertEqual(len(limiter), 2)
+
+    def test_hops_notice(self):
+        """
+        Hops answers the first refused command with a back-off notice and
+        does not run refused commands
+        """
+        hops = Hops(limiter=RateLimiter(sender_budget=1, channel_budget=0))
+        client = MagicMock(spec=Client)
+        coordinates = MessageCoordinates(
+            from_id=1,
+            from_node=None,
+            to_id=2,
+            to_node=None,
+            message_id=3,
+            channel_index=0,
+            is_dm=True,
+        )
+        for _ in range(3):
+            if hops.admit(coordinates, hops.command(".ping"), client):
+                hops.on_message(coordinates, ".ping", client)
+        messages = [
+            call.kwargs["message"] for call in client.send_response.call_args_list
+        ]
+        self.assertEqual(messages, ["🏓", "⏳"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Test replaying the packet log through the bot
+"""
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from meshtastic.protobuf.mesh_pb2 import MeshPacket
+from meshtastic.protobuf.portnums_pb2 import PortNum
+from pubsub import pub
+from hops.hops import Hops
+from hops.packet_codec import JSON, PROTOBUF, encode_mesh_packet
+from hops.replay import PacketReplayer, ReplayInterface, guess_my_node_num, replay
+from hops.storage import Storage
+from hops.util import flat_dict
+
+BOT = 0x0B0B0B0B
+ALICE = 0x1234ABCD
+
+
+def text_packet(packet_id: int, text: str, to: int = BOT) -> MeshPacket:
+    """
+    A text packet from Alice
+    """
+    mesh_packet = MeshPacket(id=packet_id, to=to, hop_limit=3)
+    setattr(mesh_packet, "from", ALICE)
+    mesh_packet.decoded.portnum = PortNum.TEXT_MESSAGE_APP
+    mesh_packet.decoded.payload = text.encode("utf-8")
+    return mesh_packet
+
+
+class TestReplay(unittest.TestCase):
+    """
+    Test replaying the packet log through the bot
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = Storage(os.path.join(self.directory.name, "source.sqlite"))
+        self.target = Storage(os.path.join(self.directory.name, "target.sqlite"))
+        self.source.log_node(
+            "!1234abcd",
+            flat_dict({"num": ALICE, "user": {"id": "!1234abcd", "shortName": "ALI"}}),
+        )
+        packets = [
+            text_packet(1, ".ping"),
+            text_packet(2, "hello everyone", to=0xFFFFFFFF),
+            text_packet(3, ".post hello board"),
+            text_packet(4, ".ping"),
+        ]
+        self.source.log_packets(
+            (timestamp, PROTOBUF, encode_mesh_packet(packet))
+            for timestamp, packet in zip(range(0, 4_000_000, 1_000_000), packets)
+        )
+        self.source.log_packet('{"unparseable":true}', JSON)
+
+    def tearDown(self):
+        pub.unsubAll()
+        self.source.close()
+        self.target.close()
+        self.directory.cleanup()
+
+    def test_replay(self):
+        """
+        Commands in the log are answered in order, and the bot's own state
+        goes to the target database
+        """
+        report = replay(self.source, self.target, BOT, speed=0)
+        self.assertEqual(report["replayed"], 4)
+        self.assertEqual(report["skipped"], 1)
+        self.assertEqual(
+            [(record["reply_id"], record["to"]) for record in report["outbound"]],
+            [(1, ALICE), (3, ALICE), (4, ALICE)],
+        )
+        self.assertEqual(report["commands"]["ping"]["count"], 2)
+        self.assertEqual(len(self.source.bbs_read()), 0)
+        self.assertEqual(self.target.bbs_read()[0]["from_short_name"], "ALI")
+
+    def test_admin_commands_disabled(self):
+        """
+        Admin commands in the log do nothing, even if the bot has an admin
+        """
+        self.source.log_packets(
+            (timestamp, PROTOBUF, encode_mesh_packet(packet))
+            for timestamp, packet in [
+                (5_000_000, text_packet(5, ".status")),
+                (6_000_000, text_packet(6, ".shutdown")),
+            ]
+        )
+        with patch.object(Hops, "admin_user_id", "!1234abcd"), patch(
+            "hops.hops.subprocess.Popen"
+        ) as popen:
+            report = replay(self.source, self.target, BOT, speed=0)
+        popen.assert_not_called()
+        self.assertNotIn(5, [record["reply_id"] for record in report["outbound"]])
+        self.assertEqual(len(report["outbound"]), 3)
+
+    def test_replays_identical(self):
+        """
+        Replaying the same log twice gives the same responses
+        """
+        first = replay(self.source, self.target, BOT, speed=0)
+        pub.unsubAll()
+        second = replay(self.source, self.target, BOT, speed=0, limit=2)
+        self.assertEqual(second["outbound"], first["outbound"][:1])
+
+    def test_timing_scaled(self):
+        """
+        The logged gaps between packets are divided by the speed
+        """
+        interface = ReplayInterface(BOT)
+        delays = []
+        replayer = PacketReplayer(self.source, interface, speed=10, sleep=delays.append)
+        replayer.run(limit=4)
+        self.assertEqual(len(delays), 3)
+        for expected, delay in zip([0.1, 0.2, 0.3], delays):
+            self.assertAlmostEqual(delay, expected, delta=0.05)
+
+    def test_guess_my_node_num(self):
+        """
+        The bot is the node most direct messages were sent to
+        """
+        self.assertEqual(guess_my_node_num(self.source), BOT)
+
+
+if __name__ == "__main__":
+    unittest.main()
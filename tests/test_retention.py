@@ -0,0 +1,84 @@
+"""
+Test pruning of the packet and node logs
+"""
+
+import os
+import tempfile
+import unittest
+from hops.retention import Pruner, RetentionPolicy
+from hops.storage import MICROSECONDS_PER_DAY, Storage, timestamp_now
+
+
+class TestRetention(unittest.TestCase):
+    """
+    Test pruning of the packet and node logs
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.directory.name, "db.sqlite"))
+        now = timestamp_now()
+        # Ten old packets followed by ten recent ones
+        self.storage.log_packets(
+            [
+                (now - 40 * MICROSECONDS_PER_DAY + i, "json", "x" * 1000)
+                for i in range(10)
+            ]
+            + [(now - i, "json", "{}") for i in range(10)]
+        )
+
+    def tearDown(self):
+        self.storage.close()
+        self.directory.cleanup()
+
+    def count(self, table: str) -> int:
+        with self.storage._transaction() as cursor:
+            return cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def test_prune_by_age(self):
+        """
+        Rows older than the maximum age are deleted in batches
+        """
+        deleted = self.storage.prune("packets", max_age_days=30, batch_size=3)
+        self.assertEqual(deleted, 10)
+        self.assertEqual(self.count("packets"), 10)
+
+    def test_prune_by_rows(self):
+        """
+        Only the newest rows are kept
+        """
+        self.assertEqual(self.storage.prune("packets", max_rows=4), 16)
+        with self.storage._transaction() as cursor:
+            ids = [
+                row[0] for row in cursor.execute("SELECT id FROM packets ORDER BY id")
+            ]
+        self.assertEqual(ids, [17, 18, 19, 20])
+
+    def test_prune_unknown_table(self):
+        """
+        Only the log tables can be pruned
+        """
+        with self.assertRaises(ValueError):
+            self.storage.prune("bbs", max_rows=0)
+
+    def test_pruner_reclaims_pages(self):
+        """
+        The pruner applies every policy and vacuums the freed pages
+        """
+        with self.storage._transaction() as cursor:
+            self.assertEqual(cursor.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+        pruner = Pruner(
+            self.storage,
+            [
+                RetentionPolicy("packets", max_age_days=30),
+                RetentionPolicy("node_changes"),
+            ],
+            pause=0,
+        )
+        self.assertEqual(pruner.run_once(), {"packets": 10, "node_changes": 0})
+        with self.storage._transaction() as cursor:
+            self.assertEqual(cursor.execute("PRAGMA freelist_count").fetchone()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
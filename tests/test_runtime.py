@@ -0,0 +1,103 @@
+"""
+Test the AsyncRuntime class
+"""
+
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from hops.runtime import AsyncRuntime
+
+
+class TestAsyncRuntime(unittest.TestCase):
+    """
+    Test the AsyncRuntime class
+    """
+
+    def start(self, runtime):
+        """
+        Run the runtime on a background thread until the test ends
+        """
+        thread = threading.Thread(target=runtime.run, daemon=True)
+        thread.start()
+
+        def stop():
+            runtime.stop()
+            thread.join(5)
+
+        self.addCleanup(stop)
+
+    def test_sync_handlers_in_order(self):
+        """
+        Blocking handlers run in the executor, in order per sender
+        """
+        seen = []
+        done = threading.Event()
+
+        def handler(_coordinates, message, _client):
+            seen.append((message, threading.current_thread().name))
+            if len(seen) == 3:
+                done.set()
+
+        runtime = AsyncRuntime(handler, workers=2)
+        for message in ["1", "2", "3"]:
+            runtime.submit("a", None, message, MagicMock())
+        self.start(runtime)
+        self.assertTrue(done.wait(5))
+        self.assertEqual([message for message, _ in seen], ["1", "2", "3"])
+        self.assertTrue(all(name.startswith("hops-async") for _, name in seen))
+
+    def test_coroutine_handler(self):
+        """
+        A handler returning a coroutine has it awaited on the loop
+        """
+        done = threading.Event()
+        client = MagicMock()
+
+        async def reply(client):
+            await asyncio.sleep(0)
+            client.send_response("pong", None)
+            done.set()
+
+        runtime = AsyncRuntime(lambda _c, _m, client: reply(client))
+        self.start(runtime)
+        runtime.submit("a", None, ".ping", client)
+        self.assertTrue(done.wait(5))
+        client.send_response.assert_called_once_with("pong", None)
+
+    def test_timeout(self):
+        """
+        A command overrunning its timeout is abandoned
+        """
+
+        async def slow(*_):
+            await asyncio.sleep(5)
+
+        runtime = AsyncRuntime(slow, timeout=0.05)
+        self.start(runtime)
+        runtime.submit("a", None, ".slow", MagicMock())
+        for _ in range(100):
+            if runtime.timed_out:
+                break
+            time.sleep(0.05)
+        self.assertEqual(runtime.timed_out, 1)
+
+    def test_periodic_job_and_stop(self):
+        """
+        Periodic jobs run until the runtime is stopped
+        """
+        ran = threading.Event()
+        runtime = AsyncRuntime(MagicMock())
+        runtime.every(0.01, ran.set, name="tick")
+        thread = threading.Thread(target=runtime.run, daemon=True)
+        thread.start()
+        self.assertTrue(ran.wait(5))
+        runtime.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(runtime.loop.is_closed())
+
+
+if __name__ == "__main__":
+    unittest.main()
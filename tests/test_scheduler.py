@@ -0,0 +1,127 @@
+"""
+Test the SendScheduler class
+"""
+
+import argparse
+import threading
+import time
+import unittest
+from hops import cli
+from hops.scheduler import HIGH, LOW, NORMAL, SendScheduler
+
+
+class TestSendScheduler(unittest.TestCase):
+    """
+    Test the SendScheduler class
+    """
+
+    def drain(self, scheduler):
+        """
+        Pop everything queued, in transmit order
+        """
+        order = []
+        while scheduler.depth:
+            outbound = scheduler._pop()
+            order.append((outbound.destination, outbound.message))
+        return order
+
+    def test_priority_order(self):
+        """
+        Acknowledgements overtake queued replies and notifications
+        """
+        scheduler = SendScheduler()
+        scheduler.enqueue("notify", None, "a", priority=LOW)
+        scheduler.enqueue("reply", None, "b", priority=NORMAL)
+        scheduler.enqueue("ack", None, "c", priority=HIGH)
+        self.assertEqual(
+            [message for _, message in self.drain(scheduler)],
+            ["ack", "reply", "notify"],
+        )
+
+    def test_round_robin_between_destinations(self):
+        """
+        A long reply to one destination does not hold up another
+        """
+        scheduler = SendScheduler()
+        for i in range(3):
+            scheduler.enqueue(f"a{i}", None, "a", coalesce=False)
+        scheduler.enqueue("b0", None, "b", coalesce=False)
+        self.assertEqual(
+            self.drain(scheduler),
+            [("a", "a0"), ("b", "b0"), ("a", "a1"), ("a", "a2")],
+        )
+
+    def test_coalesce(self):
+        """
+        Short replies to the same destination share a packet if they fit
+        """
+        scheduler = SendScheduler(max_payload=12)
+        scheduler.enqueue("hello", None, "a")
+        scheduler.enqueue("world", None, "a")
+        scheduler.enqueue("too long", None, "a")
+        scheduler.enqueue("other", None, "b")
+        self.assertEqual(scheduler.coalesced, 1)
+        self.assertEqual(
+            self.drain(scheduler),
+            [("a", "hello\nworld"), ("b", "other"), ("a", "too long")],
+        )
+
+    def test_no_coalesce_reactions(self):
+        """
+        Messages queued with coalescing disabled are sent on their own
+        """
+        scheduler = SendScheduler()
+        scheduler.enqueue("👍", None, "a", coalesce=False)
+        scheduler.enqueue("text", None, "a")
+        self.assertEqual(scheduler.depth, 2)
+
+    def test_queue_full(self):
+        """
+        Replies are dropped once the queue is full
+        """
+        scheduler = SendScheduler(max_queue=1)
+        self.assertTrue(scheduler.enqueue("one", None, "a", coalesce=False))
+        self.assertFalse(scheduler.enqueue("two", None, "b"))
+        self.assertEqual(scheduler.dropped, 1)
+
+    def test_airtime_budget(self):
+        """
+        Once the burst is spent, sends are paced by the duty cycle
+        """
+        sent = []
+        done = threading.Event()
+
+        def transmit(message, _coordinates):
+            sent.append(time.monotonic())
+            if len(sent) == 3:
+                done.set()
+
+        # Each packet costs 0.1s of airtime; the bucket holds two of them and
+        # refills at half speed, so the third waits about 0.2s
+        scheduler = SendScheduler(
+            airtime_per_byte=0.01, packet_overhead=0, duty_cycle=0.5, burst=0.2
+        )
+        for i in range(3):
+            scheduler.enqueue(f"{i:010}", None, i)
+        started = time.monotonic()
+        scheduler.start(transmit)
+        self.assertTrue(done.wait(5))
+        scheduler.close()
+        self.assertLess(sent[1] - started, 0.1)
+        self.assertGreaterEqual(sent[2] - started, 0.15)
+        self.assertEqual(scheduler.sent, 3)
+
+    def test_invalid_duty_cycle(self):
+        """
+        A duty cycle that would never let anything be sent is refused
+        """
+        for duty_cycle in (0, -0.1, 1.5):
+            with self.assertRaises(ValueError):
+                SendScheduler(duty_cycle=duty_cycle)
+        with self.assertRaises(argparse.ArgumentTypeError):
+            cli.duty_cycle("0")
+        self.assertEqual(cli.duty_cycle("0.5"), 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,278 @@
+"""
+Test the Storage class
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from hops.packet_codec import PROTOBUF, decode_mesh_packet
+from hops.storage import Storage
+from hops.util import flat_dict
+from tests.test_packet_codec import make_packet
+
+
+class TestStorage(unittest.TestCase):
+    """
+    Test the Storage class against a scratch database
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.directory.name, "db.sqlite"))
+
+    def tearDown(self):
+        self.storage.close()
+        self.directory.cleanup()
+
+    def test_wal_mode(self):
+        """
+        The shared connection runs in WAL mode with the requested sync level
+        """
+        with self.storage._transaction() as cursor:
+            self.assertEqual(cursor.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            # NORMAL
+            self.assertEqual(cursor.execute("PRAGMA synchronous").fetchone()[0], 1)
+
+    def test_invalid_synchronous(self):
+        """
+        Unknown synchronous levels are rejected
+        """
+        with self.assertRaises(ValueError):
+            Storage(os.path.join(self.directory.name, "other.sqlite"), "SOMETIMES")
+
+    def test_bbs_round_trip(self):
+        """
+        A post can be read back
+        """
+        self.storage.bbs_insert("!1", "ONE", "Node One", "Hello")
+        rows = self.storage.bbs_read()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["message"], "Hello")
+        self.assertEqual(rows[0]["from_short_name"], "ONE")
+
+    def test_bbs_pagination(self):
+        """
+        Pages follow on from each other, even for posts in the same microsecond
+        """
+        self.storage.bbs_import(
+            [(1000 + i // 2, "!1", None, None, f"post {i}") for i in range(12)]
+        )
+        pages = []
+        before = None
+        while True:
+            page = self.storage.bbs_page(before=before, limit=5)
+            if not page:
+                break
+            pages.append([row["message"] for row in page])
+            before = (page[-1]["timestamp"], page[-1]["id"])
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual(pages[0][0], "post 11")
+        self.assertEqual(pages[-1][-1], "post 0")
+
+        streamed = [row["message"] for row in self.storage.iter_bbs(batch_size=5)]
+        self.assertEqual(streamed, [f"post {i}" for i in range(12)])
+
+        self.assertTrue(self.storage.bbs_delete(1))
+        self.assertFalse(self.storage.bbs_delete(1))
+        self.assertEqual(len(list(self.storage.iter_bbs())), 11)
+
+    def test_bbs_version(self):
+        """
+        The board version changes with every change to the board, whichever
+        connection made it
+        """
+        versions = [self.storage.bbs_version()]
+        post_id = self.storage.bbs_insert("!1", None, None, "Hello")
+        versions.append(self.storage.bbs_version())
+        self.storage.bbs_import([(None, "!1", None, None, "Again")])
+        versions.append(self.storage.bbs_version())
+        self.storage.bbs_delete(post_id)
+        versions.append(self.storage.bbs_version())
+        other = Storage(self.storage.db_filename)
+        other.bbs_insert("!2", None, None, "From elsewhere")
+        other.close()
+        versions.append(self.storage.bbs_version())
+        self.assertEqual(len(set(versions)), 5)
+        self.assertEqual(self.storage.bbs_version(), versions[-1])
+
+    def test_messages_round_trip(self):
+        """
+        A message can be read back by its addressee only
+        """
+        self.storage.messages_insert("!1", "ONE", "Node One", "!2", "Hi two")
+        self.assertEqual(len(self.storage.messages_read("!2")), 1)
+        self.assertEqual(self.storage.messages_read("!3"), [])
+
+    def test_messages_delivery(self):
+        """
+        Unread messages come newest first until delivered, and every message
+        can be paged through
+        """
+        for i in range(7):
+            self.storage.messages_insert("!1", None, None, "!2", f"m{i}")
+        unread = self.storage.messages_unread("!2")
+        self.assertEqual(
+            [row["message"] for row in unread], [f"m{i}" for i in (6, 5, 4, 3, 2)]
+        )
+        self.assertEqual(
+            self.storage.messages_mark_delivered(row["id"] for row in unread), 5
+        )
+        self.assertEqual(self.storage.messages_mark_delivered([unread[0]["id"]]), 0)
+        self.assertEqual(
+            [row["message"] for row in self.storage.messages_unread("!2")], ["m1", "m0"]
+        )
+
+        pages = []
+        before = None
+        while True:
+            page = self.storage.messages_page("!2", before=before, limit=3)
+            if not page:
+                break
+            pages.append([row["message"] for row in page])
+            before = (page[-1]["timestamp"], page[-1]["id"])
+        self.assertEqual(pages, [["m6", "m5", "m4"], ["m3", "m2", "m1"], ["m0"]])
+
+    def test_concurrent_writers(self):
+        """
+        Writes from several threads share the connection safely
+        """
+
+        def write(n):
+            for i in range(25):
+                self.storage.log_node(f"!{n}", {"i": i})
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with self.storage._transaction() as cursor:
+            count = cursor.execute("SELECT COUNT(*) FROM node_changes").fetchone()[0]
+        self.assertEqual(count, 100)
+        self.assertEqual(self.storage.node_read("!3")["node"], {"i": 24})
+
+    def test_log_nodes_changes_only(self):
+        """
+        Only new nodes and changed fields are written to the change log
+        """
+        node = {"num": 1, "user.shortName": "ONE", "snr": 5.0, "lastHeard": 1700000000}
+        self.assertEqual(self.storage.log_nodes([(1, "!1", node)]), 1)
+        self.assertEqual(self.storage.log_nodes([(2, "!1", dict(node))]), 0)
+        changed = dict(node, snr=6.5)
+        del changed["lastHeard"]
+        self.assertEqual(self.storage.log_nodes([(3, "!1", changed)]), 1)
+
+        with self.storage._transaction() as cursor:
+            changes = [
+                json.loads(row[0])
+                for row in cursor.execute(
+                    "SELECT changes_json FROM node_changes ORDER BY id"
+                )
+            ]
+        self.assertEqual(changes, [node, {"snr": 6.5, "lastHeard": None}])
+        latest = self.storage.node_read("!1")
+        self.assertEqual(latest["short_name"], "ONE")
+        self.assertEqual(latest["updated"], 3)
+        self.assertIsNone(latest["last_heard"])
+        self.assertEqual(latest["node"], changed)
+
+    def test_node_search_and_listing(self):
+        """
+        Nodes can be searched by name and hardware and listed by last heard
+        """
+        self.storage.log_nodes(
+            [
+                (
+                    1,
+                    "!1",
+                    {
+                        "num": 1,
+                        "user.longName": "Smol Mobile",
+                        "user.shortName": "BBS",
+                        "user.hwModel": "HELTEC_V3",
+                        "lastHeard": 10,
+                    },
+                ),
+                (
+                    1,
+                    "!2",
+                    {
+                        "num": 2,
+                        "user.longName": "Antenna Farm",
+                        "user.shortName": "🐇",
+                        "user.hwModel": "TBEAM",
+                        "lastHeard": 30,
+                    },
+                ),
+                (
+                    1,
+                    "!3",
+                    {
+                        "num": 3,
+                        "user.longName": "Another Farm",
+                        "user.shortName": "FRM",
+                    },
+                ),
+            ]
+        )
+        search = lambda needle: [
+            row["node_id"] for row in self.storage.nodes_search(needle)
+        ]
+        self.assertEqual(search("mob"), ["!1"])
+        self.assertEqual(sorted(search("farm")), ["!2", "!3"])
+        self.assertEqual(search("tbeam"), ["!2"])
+        self.assertEqual(search("🐇"), ["!2"])
+
+        # Renames are picked up by the search index
+        self.storage.log_node("!1", {"num": 1, "user.longName": "Static BBS"})
+        self.assertEqual(search("mob"), [])
+        self.assertEqual(search("static"), ["!1"])
+
+        self.assertEqual(self.storage.node_read_by_num(2)["long_name"], "Antenna Farm")
+        self.assertIsNone(self.storage.node_read_by_num(4))
+        listed = [row["node_id"] for row in self.storage.iter_nodes(batch_size=1)]
+        self.assertEqual(listed, ["!2", "!1", "!3"])
+
+    def test_compact_legacy_packets(self):
+        """
+        A database with flattened JSON packets is upgraded and converted
+        """
+        filename = os.path.join(self.directory.name, "legacy.sqlite")
+        packet = make_packet()
+        with sqlite3.connect(filename) as conn:
+            conn.execute(
+                """
+                CREATE TABLE packets (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME UNIQUE NOT NULL,
+                    packet_json TEXT NOT NULL
+                )
+            """
+            )
+            conn.executemany(
+                "INSERT INTO packets (timestamp, packet_json) VALUES (?, ?)",
+                [
+                    ("2025-07-29T17:40:47.1", json.dumps(flat_dict(packet), indent=3)),
+                    ("2025-07-29T17:40:47.2", json.dumps({"decoded": "bogus"})),
+                ],
+            )
+        conn.close()
+
+        storage = Storage(filename)
+        self.assertEqual(storage.compact_packets(PROTOBUF, batch_size=1), (1, 1))
+        self.assertEqual(storage.compact_packets(PROTOBUF), (0, 0))
+        with storage._transaction() as cursor:
+            codec, data = cursor.execute(
+                "SELECT codec, packet FROM packets ORDER BY id"
+            ).fetchone()
+        self.assertEqual(decode_mesh_packet(codec, data), packet["raw"])
+        self.assertEqual(len(list(storage.iter_packets())), 2)
+        storage.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
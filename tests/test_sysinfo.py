@@ -0,0 +1,88 @@
+"""
+Test the SystemSampler class
+"""
+
+import os
+import tempfile
+import unittest
+from hops.sysinfo import SystemSampler, format_uptime
+
+MEMINFO = """MemTotal:         512000 kB
+MemFree:           10000 kB
+MemAvailable:     256000 kB
+"""
+
+
+class TestSystemSampler(unittest.TestCase):
+    """
+    Test the SystemSampler class
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.write("uptime", "93784.12 1000.00\n")
+        self.write("loadavg", "0.50 0.25 0.10 1/100 1234\n")
+        self.write("meminfo", MEMINFO)
+        self.sampler = SystemSampler(ttl=60, proc=self.directory.name)
+
+    def write(self, name, content):
+        """
+        Write a fake /proc file
+        """
+        with open(os.path.join(self.directory.name, name), "w", encoding="ascii") as f:
+            f.write(content)
+
+    def test_proc_files(self):
+        """
+        Host figures are parsed from /proc
+        """
+        self.assertEqual(self.sampler.uptime(), 93784.12)
+        self.assertEqual(self.sampler.load_average(), (0.5, 0.25, 0.1))
+        self.assertEqual(self.sampler.memory(), (256000 * 1024, 512000 * 1024))
+
+    def test_cached(self):
+        """
+        Values are not re-read within the TTL
+        """
+        self.assertEqual(self.sampler.uptime(), 93784.12)
+        self.write("uptime", "1.00 1.00\n")
+        self.assertEqual(self.sampler.uptime(), 93784.12)
+        self.sampler.ttl = 0
+        self.assertEqual(self.sampler.uptime(), 1.0)
+
+    def test_missing_file(self):
+        """
+        A figure that cannot be read is reported as unavailable
+        """
+        os.remove(os.path.join(self.directory.name, "loadavg"))
+        self.assertIsNone(self.sampler.load_average())
+        self.assertIn("load: N/A", self.sampler.render())
+
+    def test_bot_figures(self):
+        """
+        Packets, latencies and registered sources appear in the rendering
+        """
+        for _ in range(3):
+            self.sampler.record_packet()
+        self.sampler.record_latency("bbs", 0.2)
+        self.sampler.record_latency("bbs", 0.4)
+        self.sampler.add_source("queues", lambda: "write 0")
+        self.assertEqual(self.sampler.latencies()["bbs"][0], 2)
+        rendered = self.sampler.render().split("\n")
+        self.assertEqual(rendered[0], "uptime: up 1 day, 2 hours, 3 minutes")
+        self.assertIn("pkts/min: 3", rendered)
+        self.assertIn("queues: write 0", rendered)
+        self.assertIn("ms: bbs 300", rendered)
+
+    def test_format_uptime(self):
+        """
+        Durations are formatted like `uptime -p`
+        """
+        self.assertEqual(format_uptime(30), "up 0 minutes")
+        self.assertEqual(format_uptime(60), "up 1 minute")
+        self.assertEqual(format_uptime(8 * 86400 + 120), "up 1 week, 1 day, 2 minutes")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Test the BatchWriter class
+"""
+
+import threading
+import unittest
+from unittest.mock import MagicMock
+from hops.storage import Storage
+from hops.writer import BatchWriter, BLOCK
+
+
+class TestBatchWriter(unittest.TestCase):
+    """
+    Test the BatchWriter class
+    """
+
+    def setUp(self):
+        self.storage = MagicMock(spec=Storage)
+
+    def test_flush_on_close(self):
+        """
+        Rows still queued at shutdown are written
+        """
+        writer = BatchWriter(self.storage, batch_size=100, flush_interval=60)
+        writer.put("packets", ("t1", "json", "{}"))
+        writer.put("nodes", ("t1", "!1", {}))
+        writer.close()
+        self.storage.log_packets.assert_called_once_with([("t1", "json", "{}")])
+        self.storage.log_nodes.assert_called_once_with([("t1", "!1", {})])
+        self.assertEqual(writer.written, 2)
+        self.assertEqual(writer.depth, 0)
+
+    def test_sink_failure_keeps_writing(self):
+        """
+        Rows a sink fails on are counted and logged, and the writer carries
+        on writing later rows
+        """
+        written = threading.Event()
+        self.storage.log_nodes.side_effect = TypeError("not serializable")
+        self.storage.log_packets.side_effect = lambda rows: written.set()
+        writer = BatchWriter(self.storage, batch_size=1, flush_interval=60)
+        with self.assertLogs(level="ERROR"):
+            writer.put("nodes", ("t1", "!1", {"bad": object()}))
+            writer.put("packets", ("t2", "json", "{}"))
+            self.assertTrue(written.wait(5))
+        self.assertTrue(writer._thread.is_alive())
+        writer.close()
+        self.assertEqual(writer.failed, 1)
+        self.assertEqual(writer.written, 1)
+
+    def test_group_commit_at_batch_size(self):
+        """
+        A full batch is written with a single call
+        """
+        written = threading.Event()
+        self.storage.log_packets.side_effect = lambda rows: written.set()
+        writer = BatchWriter(self.storage, batch_size=3, flush_interval=60)
+        for i in range(3):
+            writer.put("packets", (f"t{i}", "{}"))
+        self.assertTrue(written.wait(5))
+        writer.close()
+        self.storage.log_packets.assert_called_once_with(
+            [("t0", "{}"), ("t1", "{}"), ("t2", "{}")]
+        )
+
+    def test_drop_oldest(self):
+        """
+        The oldest row makes way for a new one when the queue is full
+        """
+        release = threading.Event()
+        self.storage.log_packets.side_effect = lambda rows: release.wait(5)
+        writer = BatchWriter(self.storage, max_queue=2, batch_size=1)
+        writer.put("packets", ("t0", "{}"))
+        # Wait for the writer to pick up the first row and stall on it
+        while writer.depth:
+            pass
+        for i in range(1, 5):
+            writer.put("packets", (f"t{i}", "{}"))
+        self.assertEqual(writer.dropped, 2)
+        self.assertEqual(writer.depth, 2)
+        release.set()
+        writer.close()
+        written = [call.args[0][0][0] for call in self.storage.log_packets.mock_calls]
+        self.assertEqual(written, ["t0", "t3", "t4"])
+
+    def test_invalid_policy(self):
+        """
+        Unknown back-pressure policies are rejected
+        """
+        with self.assertRaises(ValueError):
+            BatchWriter(self.storage, policy="ignore")
+
+    def test_block_policy_with_storage(self):
+        """
+        Blocking producers still get every row into the database
+        """
+        storage = Storage(":memory:")
+        writer = BatchWriter(storage, max_queue=4, batch_size=2, policy=BLOCK)
+        for i in range(20):
+            writer.put("nodes", (i, "!1", {"i": i}))
+        writer.close()
+        self.assertEqual(writer.dropped, 0)
+        with storage._transaction() as cursor:
+            count = cursor.execute("SELECT COUNT(*) FROM node_changes").fetchone()[0]
+        self.assertEqual(count, 20)
+        storage.close()
+
+
+if __name__ == "__main__":
+    unittest.main()